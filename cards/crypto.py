@@ -0,0 +1,136 @@
+"""
+Formato de armazenamento dos dados sensíveis de um cartão.
+
+Os quatro campos sensíveis são serializados juntos e selados num único blob
+AES-256-GCM, de modo que ler um cartão custa uma única decifragem (com uma
+única verificação de autenticidade).
+
+Layout do blob (versão 2):
+
+    versão  1 byte
+    chave   4 bytes (início do SHA-256 da chave usada)
+    nonce   12 bytes
+    dados   JSON cifrado + tag GCM de 16 bytes
+
+Blobs da versão 1 não têm o identificador da chave e são abertos tentando
+cada chave de `ENCRYPTION_KEYS`.
+
+O cabeçalho e o id do dono do cartão entram como dados associados (AAD):
+um blob copiado para o cartão de outro usuário não abre.
+
+Como no MultiFernet, `ENCRYPTION_KEYS` lista as chaves ativas da mais nova
+para a mais antiga: a primeira sela, todas abrem. `manage.py
+rotate_card_keys` regrava os cartões antigos com a chave mais nova.
+"""
+import base64
+import functools
+import hashlib
+import hmac
+import json
+import os
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+
+VERSION = 2
+LEGACY_VERSION = 1
+KEY_ID_SIZE = 4
+NONCE_SIZE = 12
+SEALED_FIELDS = ('card_holder_name', 'card_number', 'expiry_date', 'cvv')
+
+
+class CardDecryptionError(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=8)
+def _build_keyring(keys):
+    # Cada chave é uma chave Fernet (32 bytes em base64 urlsafe), usada aqui
+    # inteira como chave AES-256.
+    keyring = []
+    for key in keys:
+        raw = base64.urlsafe_b64decode(key)
+        keyring.append((hashlib.sha256(raw).digest()[:KEY_ID_SIZE], AESGCM(raw)))
+    return keyring
+
+
+def _keyring(keys=None):
+    return _build_keyring(tuple(keys or settings.ENCRYPTION_KEYS))
+
+
+def primary_key_id(keys=None):
+    return _keyring(keys)[0][0]
+
+
+def _associated_data(header, user_id):
+    return header + str(user_id).encode('ascii')
+
+
+def seal_card(values, user_id, keys=None):
+    key_id, aead = _keyring(keys)[0]
+    plaintext = json.dumps([values[name] for name in SEALED_FIELDS], separators=(',', ':')).encode('utf-8')
+    header = bytes([VERSION]) + key_id
+    nonce = os.urandom(NONCE_SIZE)
+    return header + nonce + aead.encrypt(nonce, plaintext, _associated_data(header, user_id))
+
+
+def _decrypt(aead, header, nonce, ciphertext, user_id):
+    try:
+        return aead.decrypt(nonce, ciphertext, _associated_data(header, user_id))
+    except InvalidTag:
+        return None
+
+
+def open_card(blob, user_id, keys=None):
+    blob = bytes(blob)
+    keyring = _keyring(keys)
+    plaintext = None
+
+    if blob[:1] == bytes([VERSION]) and len(blob) > 1 + KEY_ID_SIZE + NONCE_SIZE:
+        header_size = 1 + KEY_ID_SIZE
+        header, nonce, ciphertext = blob[:header_size], blob[header_size:header_size + NONCE_SIZE], blob[header_size + NONCE_SIZE:]
+        for key_id, aead in keyring:
+            if key_id == header[1:]:
+                plaintext = _decrypt(aead, header, nonce, ciphertext, user_id)
+                break
+    elif blob[:1] == bytes([LEGACY_VERSION]) and len(blob) > 1 + NONCE_SIZE:
+        header, nonce, ciphertext = blob[:1], blob[1:1 + NONCE_SIZE], blob[1 + NONCE_SIZE:]
+        for _, aead in keyring:
+            plaintext = _decrypt(aead, header, nonce, ciphertext, user_id)
+            if plaintext is not None:
+                break
+    else:
+        raise CardDecryptionError("Formato de cartão desconhecido.")
+
+    if plaintext is None:
+        raise CardDecryptionError("Não foi possível decifrar o cartão.")
+    return dict(zip(SEALED_FIELDS, json.loads(plaintext)))
+
+
+def needs_rotation(blob, keys=None):
+    # Decidido só pelo cabeçalho, sem decifrar.
+    blob = bytes(blob)
+    return blob[:1] != bytes([VERSION]) or blob[1:1 + KEY_ID_SIZE] != primary_key_id(keys)
+
+
+def rotate(blob, user_id, keys=None):
+    return seal_card(open_card(blob, user_id, keys), user_id, keys)
+
+
+def _blind_index_key():
+    # Sem chave própria, deriva uma da ENCRYPTION_KEY original. Ela não muda
+    # com a rotação de ENCRYPTION_KEYS, então os índices continuam válidos.
+    if settings.CARD_BLIND_INDEX_KEY:
+        return settings.CARD_BLIND_INDEX_KEY.encode('utf-8')
+    return hmac.new(settings.ENCRYPTION_KEY.encode('utf-8'), b'card-blind-index', hashlib.sha256).digest()
+
+
+def card_fingerprint(card_number):
+    """
+    Índice cego do número do cartão: HMAC-SHA256 dos dígitos. É
+    determinístico, então permite busca e deduplicação por igualdade no
+    banco, mas não revela o número sem a chave.
+    """
+    digits = ''.join(char for char in card_number if char.isdigit())
+    return hmac.new(_blind_index_key(), digits.encode('ascii'), hashlib.sha256).hexdigest()
@@ -0,0 +1,94 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from cards.crypto import CardDecryptionError
+from cards.models import Card
+
+LOOKUP_FIELDS = ['last4', 'bin', 'number_fingerprint']
+
+
+class Command(BaseCommand):
+    help = "Preenche o índice cego, o BIN e os últimos dígitos dos cartões a partir do blob selado."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Recalcula todos os cartões (ex.: após trocar CARD_BLIND_INDEX_KEY).")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help="Pausa, em segundos, entre os lotes.")
+
+    def handle(self, *args, **options):
+        cards = Card.objects.only('id', 'user_id', 'sealed', *LOOKUP_FIELDS).order_by('pk')
+        if not options['all']:
+            cards = cards.filter(number_fingerprint='')
+
+        started = time.monotonic()
+        updated = failed = 0
+        self.duplicates = []
+        batch = []
+        for card in cards.iterator(chunk_size=options['batch_size']):
+            try:
+                card.set_lookup_fields(card.open()['card_number'])
+            except CardDecryptionError:
+                failed += 1
+                continue
+            batch.append(card)
+            if len(batch) >= options['batch_size']:
+                updated += self._flush(batch)
+                batch = []
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+        if batch:
+            updated += self._flush(batch)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"{updated} cartão(ões) indexado(s) em {elapsed:.1f}s."))
+        if failed:
+            self.stderr.write(f"{failed} cartão(ões) não puderam ser decifrados.")
+        if self.duplicates:
+            self.stderr.write(
+                f"{len(self.duplicates)} cartão(ões) repetem um cartão já indexado do mesmo usuário e ficaram "
+                f"sem índice cego; remova as cópias: {', '.join(str(pk) for pk in self.duplicates)}."
+            )
+
+    def _flush(self, batch):
+        # Cartões duplicados cadastrados antes da constraint
+        # unique_card_per_user só se revelam aqui, ao calcular o índice cego.
+        # A primeira cópia é indexada e as demais ficam de fora (com índice
+        # vazio, ignorado pela constraint) e são reportadas.
+        taken = set(
+            Card.objects.filter(
+                user_id__in={card.user_id for card in batch},
+                number_fingerprint__in={card.number_fingerprint for card in batch},
+            )
+            .exclude(pk__in=[card.pk for card in batch])
+            .values_list('user_id', 'number_fingerprint')
+        )
+        unique = []
+        for card in batch:
+            key = (card.user_id, card.number_fingerprint)
+            if key in taken:
+                self.duplicates.append(card.pk)
+                continue
+            taken.add(key)
+            unique.append(card)
+
+        try:
+            with transaction.atomic():
+                Card.objects.bulk_update(unique, LOOKUP_FIELDS)
+            return len(unique)
+        except IntegrityError:
+            pass
+
+        # Um cadastro concorrente ocupou o mesmo índice: grava um a um.
+        written = 0
+        for card in unique:
+            try:
+                with transaction.atomic():
+                    card.save(update_fields=LOOKUP_FIELDS)
+                written += 1
+            except IntegrityError:
+                self.duplicates.append(card.pk)
+        return written
@@ -0,0 +1,119 @@
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cards.crypto import CardDecryptionError, needs_rotation, primary_key_id, rotate
+from cards.models import Card
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Regrava os cartões selados com chaves antigas usando a chave mais nova de "
+        "ENCRYPTION_KEYS, em lotes pequenos e retomáveis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Cartões regravados por transação.")
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="Linhas lidas do banco por vez.")
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help="Pausa, em segundos, entre os lotes.")
+        parser.add_argument('--checkpoint', default=None,
+                            help="Arquivo onde o último id processado é salvo; a execução retoma a partir dele.")
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        # O checkpoint guarda também a chave primária da rotação; um arquivo
+        # de outra rotação não vale para esta.
+        key_id = primary_key_id().hex()
+        last_pk = self._read_checkpoint(checkpoint, key_id)
+        if last_pk:
+            self.stdout.write(f"Retomando a partir do cartão {last_pk}.")
+
+        started = time.monotonic()
+        self.failed = 0
+        rotated = skipped = 0
+        batch = []
+
+        cards = (
+            Card.objects.filter(pk__gt=last_pk)
+            .order_by('pk')
+            .only('pk', 'user_id', 'sealed')
+            .iterator(chunk_size=options['chunk_size'])
+        )
+        for card in cards:
+            last_pk = card.pk
+            if not needs_rotation(card.sealed):
+                skipped += 1
+                continue
+
+            batch.append((card, bytes(card.sealed)))
+            if len(batch) >= options['batch_size']:
+                rotated += self._flush(batch)
+                batch = []
+                self._write_checkpoint(checkpoint, key_id, last_pk)
+                if options['sleep']:
+                    time.sleep(options['sleep'])
+
+        if batch:
+            rotated += self._flush(batch)
+        self._write_checkpoint(checkpoint, key_id, last_pk)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{rotated} cartão(ões) regravado(s), {skipped} já na chave atual, em {elapsed:.1f}s."
+        ))
+        if self.failed:
+            self.stderr.write(
+                f"{self.failed} cartão(ões) não abriram com nenhuma chave de ENCRYPTION_KEYS e ficaram como estavam."
+            )
+
+    def _flush(self, batch):
+        # Confere, dentro da transação, que o cartão não foi alterado desde a
+        # leitura; um cartão editado no meio do caminho já foi selado com a
+        # chave nova pelo próprio serializer e fica como está.
+        with transaction.atomic():
+            current = dict(
+                Card.objects.select_for_update()
+                .filter(pk__in=[card.pk for card, _ in batch])
+                .values_list('pk', 'sealed')
+            )
+            changed = []
+            for card, original in batch:
+                if card.pk in current and bytes(current[card.pk]) == original:
+                    try:
+                        card.sealed = rotate(original, card.user_id)
+                    except CardDecryptionError:
+                        # Um cartão ilegível não impede a rotação dos demais.
+                        logger.exception('Não foi possível regravar o cartão %s', card.pk)
+                        self.failed += 1
+                        continue
+                    changed.append(card)
+            Card.objects.bulk_update(changed, ['sealed'])
+        return len(changed)
+
+    def _read_checkpoint(self, path, key_id):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as fh:
+            saved_key_id, _, saved_pk = fh.read().strip().partition(' ')
+        if saved_key_id != key_id or not saved_pk:
+            self.stderr.write(
+                f"O checkpoint {path} não é da chave primária atual; a rotação recomeça do início."
+            )
+            return 0
+        return int(saved_pk)
+
+    def _write_checkpoint(self, path, key_id, last_pk):
+        if not path:
+            return
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as fh:
+            fh.write(f'{key_id} {last_pk}')
+        os.replace(tmp_path, path)
@@ -0,0 +1,106 @@
+import json
+import logging
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.db import migrations, models
+
+from cards.crypto import SEALED_FIELDS, CardDecryptionError, open_card, seal_card
+
+logger = logging.getLogger(__name__)
+
+
+def fernet_to_sealed(apps, schema_editor):
+    Card = apps.get_model('cards', 'Card')
+    cipher_suite = Fernet(settings.ENCRYPTION_KEY.encode('utf-8'))
+    batch = []
+    for card in Card.objects.all().iterator(chunk_size=500):
+        tokens = {field: getattr(card, field) for field in SEALED_FIELDS}
+        try:
+            values = {
+                field: cipher_suite.decrypt(token.encode('utf-8')).decode('utf-8')
+                for field, token in tokens.items()
+            }
+        except InvalidToken:
+            # Um cartão ilegível não impede a migração dos demais. Os tokens
+            # originais ficam guardados em `sealed` (formato que open_card
+            # recusa) para não se perderem com a remoção das colunas.
+            logger.warning('Cartão %s não abriu com a ENCRYPTION_KEY; mantido como estava.', card.pk)
+            card.sealed = json.dumps(tokens).encode('utf-8')
+        else:
+            card.sealed = seal_card(values, card.user_id)
+        batch.append(card)
+        if len(batch) >= 500:
+            Card.objects.bulk_update(batch, ['sealed'])
+            batch = []
+    if batch:
+        Card.objects.bulk_update(batch, ['sealed'])
+
+
+def sealed_to_fernet(apps, schema_editor):
+    Card = apps.get_model('cards', 'Card')
+    cipher_suite = Fernet(settings.ENCRYPTION_KEY.encode('utf-8'))
+    batch = []
+    for card in Card.objects.all().iterator(chunk_size=500):
+        try:
+            values = open_card(card.sealed, card.user_id)
+        except CardDecryptionError:
+            # Cartão preservado por fernet_to_sealed: volta com os tokens originais.
+            for field, token in json.loads(bytes(card.sealed)).items():
+                setattr(card, field, token)
+        else:
+            for field in SEALED_FIELDS:
+                setattr(card, field, cipher_suite.encrypt(values[field].encode('utf-8')).decode('utf-8'))
+        batch.append(card)
+        if len(batch) >= 500:
+            Card.objects.bulk_update(batch, list(SEALED_FIELDS))
+            batch = []
+    if batch:
+        Card.objects.bulk_update(batch, list(SEALED_FIELDS))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0001_initial'),
+    ]
+
+    operations = [
+        # Os campos antigos ficam anuláveis antes de sair, para que a
+        # migração possa ser desfeita com a tabela já populada.
+        *[
+            migrations.AlterField(
+                model_name='card',
+                name=field,
+                field=models.CharField(max_length=255, null=True),
+            )
+            for field in SEALED_FIELDS
+        ],
+        migrations.AddField(
+            model_name='card',
+            name='sealed',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(fernet_to_sealed, sealed_to_fernet),
+        migrations.RemoveField(
+            model_name='card',
+            name='card_holder_name',
+        ),
+        migrations.RemoveField(
+            model_name='card',
+            name='card_number',
+        ),
+        migrations.RemoveField(
+            model_name='card',
+            name='expiry_date',
+        ),
+        migrations.RemoveField(
+            model_name='card',
+            name='cvv',
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='sealed',
+            field=models.BinaryField(),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.3 on 2026-10-18 10:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+from cards.crypto import CardDecryptionError, open_card
+
+
+def backfill_last4(apps, schema_editor):
+    Card = apps.get_model('cards', 'Card')
+    batch = []
+    for card in Card.objects.only('id', 'user_id', 'sealed').iterator(chunk_size=500):
+        try:
+            number = open_card(card.sealed, card.user_id)['card_number']
+        except CardDecryptionError:
+            # Cartões que a 0002 não conseguiu migrar ficam sem last4.
+            continue
+        digits = ''.join(char for char in number if char.isdigit())
+        card.last4 = digits[-4:]
+        batch.append(card)
+        if len(batch) >= 500:
+            Card.objects.bulk_update(batch, ['last4'])
+            batch = []
+    if batch:
+        Card.objects.bulk_update(batch, ['last4'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0002_card_sealed'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='last4',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=4),
+        ),
+        migrations.RunPython(backfill_last4, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='cards_card_user_cursor_idx'),
+        ),
+    ]
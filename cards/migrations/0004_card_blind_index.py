@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0003_card_last4'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='bin',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=6),
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='number_fingerprint',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0004_card_blind_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='card',
+            constraint=models.UniqueConstraint(condition=models.Q(('number_fingerprint', ''), _negated=True), fields=('user', 'number_fingerprint'), name='unique_card_per_user'),
+        ),
+    ]
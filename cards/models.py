@@ -1,13 +1,51 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+from .crypto import card_fingerprint, open_card, seal_card
+
+def card_digits(card_number):
+    return ''.join(char for char in card_number if char.isdigit())
+
 class Card(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cards')
-    card_holder_name = models.CharField(max_length=255)
-    card_number = models.CharField(max_length=255)
-    expiry_date = models.CharField(max_length=255)
-    cvv = models.CharField(max_length=255)         
+    sealed = models.BinaryField()
+    # Últimos quatro dígitos em claro: bastam para a listagem, que assim não
+    # precisa decifrar nada.
+    last4 = models.CharField(max_length=4, blank=True, default='', db_index=True)
+    bin = models.CharField(max_length=6, blank=True, default='', db_index=True)
+    number_fingerprint = models.CharField(max_length=64, blank=True, default='', db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='cards_card_user_cursor_idx'),
+        ]
+        constraints = [
+            # Um mesmo cartão uma única vez por usuário. Cartões ainda sem
+            # índice cego (antes do backfill_card_index) ficam de fora.
+            models.UniqueConstraint(
+                fields=['user', 'number_fingerprint'],
+                condition=~models.Q(number_fingerprint=''),
+                name='unique_card_per_user',
+            ),
+        ]
+
     def __str__(self):
-        return f"Card for {self.user.username}"
\ No newline at end of file
+        return f"Card for {self.user.username}"
+
+    @property
+    def masked_number(self):
+        return f"•••• {self.last4}" if self.last4 else "••••"
+
+    def seal(self, values):
+        self.sealed = seal_card(values, self.user_id)
+        self.set_lookup_fields(values['card_number'])
+
+    def set_lookup_fields(self, card_number):
+        digits = card_digits(card_number)
+        self.last4 = digits[-4:]
+        self.bin = digits[:6]
+        self.number_fingerprint = card_fingerprint(digits)
+
+    def open(self):
+        return open_card(self.sealed, self.user_id)
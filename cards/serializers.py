@@ -1,41 +1,98 @@
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
-from django.conf import settings
-from cryptography.fernet import Fernet
 
+from face_wallet.metrics import span
+
+from .crypto import SEALED_FIELDS, CardDecryptionError, card_fingerprint
 from .models import Card
 
-key = settings.ENCRYPTION_KEY.encode('utf-8')
-cipher_suite = Fernet(key)
+DUPLICATE_CARD_MESSAGE = "Este cartão já está cadastrado."
+
+class CardListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Card
+        fields = ('id', 'masked_number', 'last4', 'created_at')
 
 class CardSerializer(serializers.ModelSerializer):
-    card_holder_name = serializers.CharField()
-    card_number = serializers.CharField()
-    expiry_date = serializers.CharField()
+    card_holder_name = serializers.CharField(write_only=True)
+    card_number = serializers.CharField(write_only=True)
+    expiry_date = serializers.CharField(write_only=True)
     cvv = serializers.CharField(write_only=True)
 
     class Meta:
         model = Card
         fields = ('id', 'card_holder_name', 'card_number', 'expiry_date', 'cvv')
 
+    def validate_card_number(self, value):
+        # Deduplicação pelo índice cego: uma consulta indexada em vez de
+        # decifrar todos os cartões do usuário.
+        cards = Card.objects.filter(
+            user=self.context['request'].user, number_fingerprint=card_fingerprint(value)
+        )
+        if self.instance is not None:
+            cards = cards.exclude(pk=self.instance.pk)
+        with span('card.dedupe'):
+            duplicate = cards.exists()
+        if duplicate:
+            raise serializers.ValidationError(DUPLICATE_CARD_MESSAGE)
+        return value
+
     def create(self, validated_data):
-        validated_data['user'] = self.context['request'].user
+        card = Card(user=self.context['request'].user)
+        with span('card.seal'):
+            card.seal({field: validated_data[field] for field in SEALED_FIELDS})
+        with span('card.save'):
+            self._save_unique(card)
+        return card
+
+    def update(self, instance, validated_data):
+        with span('card.open'):
+            values = instance.open()
+        values.update({field: validated_data[field] for field in SEALED_FIELDS if field in validated_data})
+        with span('card.seal'):
+            instance.seal(values)
+        self._save_unique(instance, update_fields=['sealed', 'last4', 'bin', 'number_fingerprint'])
+        return instance
 
-        validated_data['card_holder_name'] = cipher_suite.encrypt(validated_data['card_holder_name'].encode('utf-8')).decode('utf-8')
-        validated_data['card_number'] = cipher_suite.encrypt(validated_data['card_number'].encode('utf-8')).decode('utf-8')
-        validated_data['expiry_date'] = cipher_suite.encrypt(validated_data['expiry_date'].encode('utf-8')).decode('utf-8')
-        validated_data['cvv'] = cipher_suite.encrypt(validated_data['cvv'].encode('utf-8')).decode('utf-8')
-        
-        return super().create(validated_data)
+    def _save_unique(self, card, **kwargs):
+        # A consulta de validate_card_number não impede que duas requisições
+        # simultâneas cadastrem o mesmo cartão; quem chega depois esbarra na
+        # constraint e recebe o mesmo 400.
+        try:
+            with transaction.atomic():
+                card.save(**kwargs)
+        except IntegrityError:
+            raise serializers.ValidationError({'card_number': [DUPLICATE_CARD_MESSAGE]})
 
     def to_representation(self, instance):
         ret = super().to_representation(instance)
-        
+
         try:
-            ret['card_holder_name'] = cipher_suite.decrypt(ret['card_holder_name'].encode('utf-8')).decode('utf-8')
-            ret['card_number'] = cipher_suite.decrypt(ret['card_number'].encode('utf-8')).decode('utf-8')
-            ret['expiry_date'] = cipher_suite.decrypt(ret['expiry_date'].encode('utf-8')).decode('utf-8')
-        except Exception as e:
+            with span('card.open'):
+                values = instance.open()
+            ret['card_holder_name'] = values['card_holder_name']
+            ret['card_number'] = values['card_number']
+            ret['expiry_date'] = values['expiry_date']
+        except CardDecryptionError:
             for field in ['card_holder_name', 'card_number', 'expiry_date']:
                 ret[field] = "Error decrypting data"
-                
-        return ret
\ No newline at end of file
+
+        return ret
+
+
+class CardLookupSerializer(serializers.Serializer):
+    card_number = serializers.CharField(required=False)
+    bin = serializers.RegexField(r'^\d{6}$', required=False)
+    last4 = serializers.RegexField(r'^\d{4}$', required=False)
+
+    def validate(self, attrs):
+        if not attrs:
+            raise serializers.ValidationError("Informe card_number, bin ou last4.")
+        return attrs
+
+class CardLookupResultSerializer(serializers.ModelSerializer):
+    username = serializers.CharField(source='user.username')
+
+    class Meta:
+        model = Card
+        fields = ('id', 'user_id', 'username', 'bin', 'last4', 'created_at')
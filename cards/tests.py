@@ -1,3 +1,173 @@
-from django.test import TestCase
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from cryptography.fernet import Fernet
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .crypto import open_card, primary_key_id, seal_card
+from .models import Card
+from .serializers import CardSerializer
+
+OLD_KEY = Fernet.generate_key().decode()
+NEW_KEY = Fernet.generate_key().decode()
+VALUES = {'card_holder_name': 'Ana', 'card_number': '4111111111111111', 'expiry_date': '12/30', 'cvv': '123'}
+
+
+class RotateCardKeysTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ana', password='senha-forte-123')
+        self.cards = [self.create_card(OLD_KEY)]
+        # Selado com uma chave que não está na lista, no meio do primeiro lote.
+        self.create_card(Fernet.generate_key().decode())
+        self.cards += [self.create_card(OLD_KEY), self.create_card(OLD_KEY)]
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'rotate.ckpt')
+        self.addCleanup(lambda: os.path.exists(self.checkpoint) and os.remove(self.checkpoint))
+
+    def create_card(self, key):
+        return Card.objects.create(user=self.user, sealed=seal_card(VALUES, self.user.pk, keys=[key]))
+
+    def rotate(self):
+        with self.assertLogs('cards.management.commands.rotate_card_keys', level='ERROR'):
+            call_command('rotate_card_keys', batch_size=2, checkpoint=self.checkpoint,
+                         stdout=StringIO(), stderr=StringIO())
+
+    @override_settings(ENCRYPTION_KEYS=[NEW_KEY, OLD_KEY])
+    def test_unreadable_card_does_not_stop_rotation(self):
+        self.rotate()
+
+        for card in self.cards:
+            card.refresh_from_db()
+            self.assertEqual(bytes(card.sealed)[1:5], primary_key_id([NEW_KEY]))
+            self.assertEqual(open_card(card.sealed, self.user.pk, keys=[NEW_KEY]), VALUES)
+
+    def test_checkpoint_from_another_primary_key_is_ignored(self):
+        with override_settings(ENCRYPTION_KEYS=[NEW_KEY, OLD_KEY]):
+            self.rotate()
+
+        newest = Fernet.generate_key().decode()
+        with override_settings(ENCRYPTION_KEYS=[newest, NEW_KEY]):
+            self.rotate()
+
+        for card in self.cards:
+            card.refresh_from_db()
+            self.assertEqual(bytes(card.sealed)[1:5], primary_key_id([newest]))
+
+
+class SealedMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('cards', target)])
+        return executor.loader.project_state([('cards', target)]).apps
+
+    def tearDown(self):
+        self.migrate('0005_card_unique_per_user')
+
+    def test_unreadable_card_is_kept_and_skipped(self):
+        Card = self.migrate('0001_initial').get_model('cards', 'Card')
+        user = User.objects.create_user(username='ana', password='senha-forte-123')
+        cipher = Fernet(settings.ENCRYPTION_KEY.encode())
+        good = Card.objects.create(user_id=user.pk, **{
+            field: cipher.encrypt(value.encode()).decode() for field, value in VALUES.items()
+        })
+        foreign = Fernet(Fernet.generate_key())
+        bad_tokens = {field: foreign.encrypt(value.encode()).decode() for field, value in VALUES.items()}
+        bad = Card.objects.create(user_id=user.pk, **bad_tokens)
+
+        with self.assertLogs('cards.migrations.0002_card_sealed', level='WARNING') as logs:
+            Card = self.migrate('0003_card_last4').get_model('cards', 'Card')
+        self.assertIn(f'Cartão {bad.pk}', logs.output[0])
+        self.assertEqual(open_card(Card.objects.get(pk=good.pk).sealed, user.pk), VALUES)
+        self.assertEqual(Card.objects.get(pk=good.pk).last4, '1111')
+        self.assertEqual(Card.objects.get(pk=bad.pk).last4, '')
+
+        Card = self.migrate('0001_initial').get_model('cards', 'Card')
+        restored = Card.objects.get(pk=bad.pk)
+        self.assertEqual({field: getattr(restored, field) for field in VALUES}, bad_tokens)
+        self.assertEqual(cipher.decrypt(Card.objects.get(pk=good.pk).card_number.encode()).decode(), VALUES['card_number'])
+        # O tearDown volta à última migração, que registraria o cartão de novo.
+        restored.delete()
+
+
+class CardListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ana', password='senha-forte-123')
+        self.cards = [
+            Card.objects.create(user=self.user, sealed=seal_card(VALUES, self.user.pk), last4=f'{n:04d}')
+            for n in range(5)
+        ]
+        other = User.objects.create_user(username='bia', password='senha-forte-123')
+        Card.objects.create(user=other, sealed=seal_card(VALUES, other.pk), last4='9999')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_cursor_pages_cover_the_user_cards_once(self):
+        seen = []
+        url = '/api/cards/?page_size=2'
+        while url:
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['results']), 2)
+            seen += [card['id'] for card in page['results']]
+            url = page['next']
+        # Mesma data de criação: o desempate é pelo id, do mais novo ao mais antigo.
+        self.assertEqual(seen, [card.pk for card in reversed(self.cards)])
+
+    def test_list_never_loads_the_sealed_blob(self):
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch('cards.models.open_card', side_effect=AssertionError('cartão decifrado')):
+            response = self.api.get('/api/cards/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([card['last4'] for card in response.json()['results']], ['0004', '0003', '0002', '0001', '0000'])
+        card_queries = [query['sql'] for query in queries.captured_queries if 'cards_card' in query['sql']]
+        self.assertTrue(card_queries)
+        self.assertFalse([sql for sql in card_queries if 'sealed' in sql], card_queries)
+
+
+class CardDuplicateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ana', password='senha-forte-123')
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_concurrent_duplicate_is_rejected_by_constraint(self):
+        self.assertEqual(self.api.post('/api/cards/', VALUES).status_code, 201)
+
+        # Simula a outra requisição que passou pela checagem antes do insert.
+        with mock.patch.object(CardSerializer, 'validate_card_number', lambda self, value: value):
+            response = self.api.post('/api/cards/', VALUES)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'card_number': ['Este cartão já está cadastrado.']})
+        self.assertEqual(Card.objects.filter(user=self.user).count(), 1)
+
+
+class BackfillCardIndexTests(TestCase):
+    def test_legacy_duplicates_are_reported_and_skipped(self):
+        user = User.objects.create_user(username='ana', password='senha-forte-123')
+        # Cartões gravados antes do índice cego: sem fingerprint, sem
+        # colisão na constraint.
+        cards = [Card.objects.create(user=user, sealed=seal_card(VALUES, user.pk)) for _ in range(3)]
+        other = dict(VALUES, card_number='5555555555554444')
+        cards.append(Card.objects.create(user=user, sealed=seal_card(other, user.pk)))
+
+        stderr = StringIO()
+        call_command('backfill_card_index', batch_size=2, stdout=StringIO(), stderr=stderr)
+
+        fingerprints = dict(Card.objects.values_list('pk', 'number_fingerprint'))
+        self.assertNotEqual(fingerprints[cards[0].pk], '')
+        self.assertEqual(fingerprints[cards[1].pk], '')
+        self.assertEqual(fingerprints[cards[2].pk], '')
+        self.assertNotEqual(fingerprints[cards[3].pk], '')
+        self.assertIn(f'{cards[1].pk}, {cards[2].pk}', stderr.getvalue())
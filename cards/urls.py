@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CardViewSet
+from .views import CardLookupView, CardViewSet
 
 router = DefaultRouter()
 router.register(r'cards', CardViewSet, basename='card')
 
 urlpatterns = [
+    path('cards/lookup/', CardLookupView.as_view(), name='card-lookup'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
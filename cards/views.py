@@ -1,12 +1,65 @@
 from rest_framework import viewsets
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from face_wallet.db_routing import read_alias
+from users.permissions import HasFaceStepUp
 
 from .models import Card
-from .serializers import CardSerializer
+from .pagination import CardCursorPagination
+from .crypto import card_fingerprint
+from .serializers import (
+    CardListSerializer, CardLookupResultSerializer, CardLookupSerializer, CardSerializer
+)
 
 class CardViewSet(viewsets.ModelViewSet):
     serializer_class = CardSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CardCursorPagination
+    # Ações que devolvem os dados decifrados de um cartão já existente.
+    step_up_actions = ('retrieve', 'update', 'partial_update')
+    # Ações só de leitura, atendidas por uma réplica quando houver.
+    replica_actions = ('list', 'retrieve')
+
+    def get_permissions(self):
+        if self.action in self.step_up_actions:
+            return [IsAuthenticated(), HasFaceStepUp()]
+        return super().get_permissions()
 
     def get_queryset(self):
-        return Card.objects.filter(user=self.request.user)
\ No newline at end of file
+        queryset = Card.objects.filter(user=self.request.user)
+        if self.action in self.replica_actions:
+            queryset = queryset.using(read_alias())
+        if self.action == 'list':
+            # A listagem não decifra nada, então nem carrega o blob selado.
+            queryset = queryset.only('id', 'user_id', 'last4', 'created_at')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return CardListSerializer
+        return CardSerializer
+
+class CardLookupView(APIView):
+    permission_classes = [IsAdminUser]
+    serializer_class = CardLookupSerializer
+    max_results = 200
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        criteria = serializer.validated_data
+
+        cards = Card.objects.select_related('user').only(
+            'id', 'user_id', 'user__username', 'bin', 'last4', 'created_at'
+        )
+        if 'card_number' in criteria:
+            cards = cards.filter(number_fingerprint=card_fingerprint(criteria['card_number']))
+        if 'bin' in criteria:
+            cards = cards.filter(bin=criteria['bin'])
+        if 'last4' in criteria:
+            cards = cards.filter(last4=criteria['last4'])
+
+        cards = cards.order_by('-created_at')[:self.max_results]
+        return Response({"results": CardLookupResultSerializer(cards, many=True).data}, status=200)
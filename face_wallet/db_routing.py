@@ -0,0 +1,79 @@
+"""
+Roteamento entre o banco primário e as réplicas de leitura.
+
+Escritas vão sempre para `default`. Leituras dos modelos em
+`DATABASE_REPLICA_MODELS` (e as consultas que pedem `read_alias()`
+explicitamente, como a listagem de cartões) vão para uma das réplicas de
+`DATABASE_READ_REPLICAS`, a não ser que:
+
+* o primário esteja dentro de uma transação (a leitura tem que enxergar o
+  que a transação já gravou);
+* a requisição atual já tenha feito alguma escrita: a partir daí ela lê só
+  do primário, para não ler de uma réplica atrasada o que acabou de gravar.
+
+Sem réplicas configuradas, tudo vai para `default`.
+"""
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_pinned = contextvars.ContextVar('db_pinned_to_primary', default=False)
+
+
+def read_alias():
+    replicas = settings.DATABASE_READ_REPLICAS
+    if not replicas or _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    return random.choice(replicas)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.label_lower in settings.DATABASE_REPLICA_MODELS:
+            return read_alias()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _pinned.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Primário e réplicas têm os mesmos dados.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinMiddleware:
+    """
+    Começa cada requisição lendo das réplicas. Tem caminho síncrono e
+    assíncrono, para não obrigar o Django a rodar sob ASGI a cadeia inteira
+    num thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _pinned.set(False)
+        try:
+            return self.get_response(request)
+        finally:
+            _pinned.reset(token)
+
+    async def __acall__(self, request):
+        token = _pinned.set(False)
+        try:
+            return await self.get_response(request)
+        finally:
+            _pinned.reset(token)
@@ -0,0 +1,236 @@
+"""
+Instrumentação leve: spans de tempo nomeados, histogramas agregados por
+processo e um endpoint no formato texto do Prometheus.
+
+    with metrics.span('face.encode'):
+        ...
+
+Cada span custa duas leituras de `perf_counter` e uma inserção num
+histograma de buckets fixos, então a instrumentação pode ficar ligada em
+produção. `MetricsMiddleware` mede latência e número de queries por rota e
+devolve os spans da requisição no cabeçalho `Server-Timing`.
+
+Os valores ficam na memória de cada processo; com vários workers, cada um
+expõe os seus.
+"""
+import bisect
+import contextvars
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTE_BUCKETS = tuple(256 * 1024 * 2 ** power for power in range(10))
+
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+_request_metrics = contextvars.ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._help = {}
+        self._collectors = []
+
+    def observe(self, name, value, labels=(), buckets=LATENCY_BUCKETS, help=''):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+                self._help.setdefault(name, help)
+            histogram.observe(value)
+
+    def increment(self, name, labels=(), amount=1, help=''):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self._help.setdefault(name, help)
+
+    def register_collector(self, collector):
+        # Um coletor devolve [(nome, tipo, ajuda, [(labels, valor), ...])]
+        # no momento da coleta; serve para expor estatísticas já mantidas por
+        # outros módulos (caches, pool) sem duplicá-las aqui.
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            histograms = {key: (h.buckets, list(h.counts), h.sum, h.count) for key, h in self._histograms.items()}
+            counters = dict(self._counters)
+            help_texts = dict(self._help)
+            collectors = list(self._collectors)
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines += [f'# HELP {name} {help_texts[name]}', f'# TYPE {name} counter']
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+
+        for name in sorted({name for name, _ in histograms}):
+            lines += [f'# HELP {name} {help_texts[name]}', f'# TYPE {name} histogram']
+            for (metric, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+                lines.append(f'{name}_bucket{_labels(labels + (("le", "+Inf"),))} {count}')
+                lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+                lines.append(f'{name}_count{_labels(labels)} {count}')
+
+        for collector in collectors:
+            for name, kind, help_text, samples in collector():
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+                lines += [f'{name}{_labels(labels)} {_number(value)}' for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+registry = Registry()
+
+
+def observe_span(name, seconds):
+    registry.observe('face_wallet_span_seconds', seconds, (('span', name),),
+                     help="Duração dos trechos instrumentados, em segundos.")
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_span(name, time.perf_counter() - started)
+
+
+def _count_query(execute, sql, params, many, context):
+    # O contador da requisição vem do contexto, que o asgiref copia para os
+    # threads do sync_to_async; assim as queries da view síncrona contam
+    # também sob ASGI.
+    metrics = _request_metrics.get()
+    if metrics is not None:
+        metrics.queries += 1
+    return execute(sql, params, many, context)
+
+
+def _instrument(connection, **kwargs):
+    # No início da lista: connection.execute_wrapper() remove sempre o
+    # último wrapper ao sair.
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_query)
+
+
+connection_created.connect(_instrument)
+
+
+class _RequestMetrics:
+    def __init__(self):
+        self.spans = []
+        self.queries = 0
+
+    def __enter__(self):
+        self._tokens = (_request_spans.set(self.spans), _request_metrics.set(self))
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self._started
+        _request_spans.reset(self._tokens[0])
+        _request_metrics.reset(self._tokens[1])
+
+    def record(self, request, response):
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unmatched'
+        labels = (('route', route), ('method', request.method))
+        registry.observe('face_wallet_http_request_seconds', self.elapsed, labels,
+                         help="Latência das requisições HTTP por rota, em segundos.")
+        registry.observe('face_wallet_http_request_queries', self.queries, labels, buckets=QUERY_BUCKETS,
+                         help="Queries ao banco por requisição.")
+        registry.increment('face_wallet_http_requests_total', labels + (('status', response.status_code),),
+                           help="Requisições HTTP por rota e status.")
+
+        if self.spans:
+            response['Server-Timing'] = ', '.join(
+                f'{name.replace(".", "-")};dur={seconds * 1000:.1f}' for name, seconds in self.spans
+            )
+        return response
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # Conexões abertas antes de este módulo ser importado.
+        for connection in connections.all():
+            _instrument(connection)
+        with _RequestMetrics() as metrics:
+            response = self.get_response(request)
+        return metrics.record(request, response)
+
+    async def __acall__(self, request):
+        with _RequestMetrics() as metrics:
+            response = await self.get_response(request)
+        return metrics.record(request, response)
+
+
+def metrics_view(request):
+    # Protegido por um token próprio (Authorization: Bearer <METRICS_TOKEN>),
+    # para que o Prometheus não precise de um usuário da aplicação. Sem o
+    # token configurado, o endpoint não existe.
+    token = settings.METRICS_TOKEN
+    if not token:
+        raise Http404()
+    provided = request.META.get('HTTP_AUTHORIZATION', '')
+    if not hmac.compare_digest(provided.encode(), f'Bearer {token}'.encode()):
+        return HttpResponse("Não autorizado.\n", status=401, content_type='text/plain; charset=utf-8')
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
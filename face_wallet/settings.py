@@ -11,7 +11,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from corsheaders.defaults import default_headers
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -46,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'face_wallet.metrics.MetricsMiddleware',
+    'face_wallet.db_routing.PrimaryPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,10 +83,66 @@ WSGI_APPLICATION = 'face_wallet.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# DB_ENGINE escolhe o backend. Com SQLite, DB_NAME é o arquivo e DB_REPLICAS
+# lista arquivos de réplica (úteis para testar o roteamento localmente, ver
+# `manage.py sync_sqlite_replicas`); com PostgreSQL/MySQL, DB_REPLICAS lista
+# os hosts das réplicas, com o mesmo nome, usuário e senha do primário.
+DB_ENGINE = config('DB_ENGINE', default='django.db.backends.sqlite3')
+DB_REPLICAS = config('DB_REPLICAS', default='', cast=Csv())
+DB_CONN_MAX_AGE = config('DB_CONN_MAX_AGE', default=60, cast=int)
+
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    # WAL deixa leituras e a escrita correrem em paralelo; synchronous=NORMAL
+    # só sincroniza o disco nos checkpoints do WAL; transações IMMEDIATE pegam
+    # o lock de escrita logo no início em vez de falhar com "database is
+    # locked" ao tentar promovê-lo.
+    SQLITE_OPTIONS = {
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            f"PRAGMA mmap_size={config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int)};"
+        ),
+        'timeout': config('SQLITE_BUSY_TIMEOUT', default=5, cast=float),
+        'transaction_mode': 'IMMEDIATE',
+    }
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'OPTIONS': SQLITE_OPTIONS,
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        }
+    }
+    for index, name in enumerate(DB_REPLICAS, start=1):
+        DATABASES[f'replica_{index}'] = dict(DATABASES['default'], NAME=name, TEST={'MIRROR': 'default'})
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': config('DB_NAME'),
+            'USER': config('DB_USER', default=''),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default=''),
+            'PORT': config('DB_PORT', default=''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
+        }
+    }
+    for index, host in enumerate(DB_REPLICAS, start=1):
+        DATABASES[f'replica_{index}'] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+
+# Leituras dos modelos listados (e as listagens/consultas de cartões) vão para
+# uma réplica, exceto dentro de transações e depois de uma escrita na mesma
+# requisição (face_wallet.db_routing).
+DATABASE_ROUTERS = ['face_wallet.db_routing.PrimaryReplicaRouter']
+DATABASE_READ_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_REPLICA_MODELS = config('DATABASE_REPLICA_MODELS', default='users.profile', cast=Csv())
+
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
     }
 }
 
@@ -130,14 +189,36 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 ENCRYPTION_KEY = config('ENCRYPTION_KEY')
+# Chaves ativas para os cartões, da mais nova para a mais antiga. A primeira
+# cifra; todas decifram (ver cards/crypto.py e manage.py rotate_card_keys).
+ENCRYPTION_KEYS = config('ENCRYPTION_KEYS', default=ENCRYPTION_KEY, cast=Csv())
+# Chave do índice cego dos números de cartão (HMAC). Vazia = derivada da
+# ENCRYPTION_KEY. Trocá-la exige rodar `manage.py backfill_card_index --all`.
+CARD_BLIND_INDEX_KEY = config('CARD_BLIND_INDEX_KEY', default='')
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    # Limites dos endpoints públicos (users.throttling), por
+    # '<throttle_scope da view>_<ip|phone|email>'.
+    'DEFAULT_THROTTLE_RATES': {
+        'register_ip': config('THROTTLE_REGISTER_IP', default='20/hour'),
+        'register_phone': config('THROTTLE_REGISTER_PHONE', default='3/hour'),
+        'register_email': config('THROTTLE_REGISTER_EMAIL', default='3/hour'),
+        'verify_phone_ip': config('THROTTLE_VERIFY_PHONE_IP', default='30/hour'),
+        'password_reset_ip': config('THROTTLE_PASSWORD_RESET_IP', default='10/hour'),
+        'password_reset_email': config('THROTTLE_PASSWORD_RESET_EMAIL', default='3/hour'),
+        'password_reset_confirm_ip': config('THROTTLE_PASSWORD_RESET_CONFIRM_IP', default='30/hour'),
+        'password_reset_confirm_email': config('THROTTLE_PASSWORD_RESET_CONFIRM_EMAIL', default='10/hour'),
+    },
+    # Número de proxies reversos na frente da aplicação. Com 0, o IP usado nos
+    # limites é o REMOTE_ADDR e o X-Forwarded-For enviado pelo cliente é
+    # ignorado.
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
 }
 
 EVOLUTION_API_URL = config('EVOLUTION_API_URL')
@@ -149,3 +230,127 @@ CORS_ALLOWED_ORIGINS = [
     "http://127.0.0.1:8080",
     "http://localhost:5173"
 ]
+# O grant de verificação facial (users.step_up) vai no cabeçalho X-Face-Grant.
+CORS_ALLOW_HEADERS = (*default_headers, 'x-face-grant')
+
+# Pool de inferência facial (users.face_pool). FACE_POOL_SIZE=0 executa o
+# encoding no próprio thread da requisição. Sem FACE_POOL_ADDRESS o pool é
+# criado em cada worker HTTP (N workers = N × FACE_POOL_SIZE processos); com
+# ele, os workers enviam os jobs ao serviço único de `manage.py run_face_pool`
+# (`host:porta` ou caminho de socket Unix), autenticados por FACE_POOL_AUTHKEY.
+FACE_POOL_SIZE = config('FACE_POOL_SIZE', default=2, cast=int)
+FACE_POOL_MAX_QUEUE = config('FACE_POOL_MAX_QUEUE', default=16, cast=int)
+FACE_POOL_JOB_TIMEOUT = config('FACE_POOL_JOB_TIMEOUT', default=30, cast=float)
+FACE_POOL_ADDRESS = config('FACE_POOL_ADDRESS', default='')
+FACE_POOL_AUTHKEY = config('FACE_POOL_AUTHKEY', default=SECRET_KEY)
+
+# Controle de admissão dos endpoints faciais (users.admission): requisições
+# processadas ao mesmo tempo, tamanho da fila de espera, requisições por
+# cliente (ativas + na fila), tempo máximo na fila e a base do Retry-After,
+# em segundos.
+FACE_ADMISSION_MAX_ACTIVE = config('FACE_ADMISSION_MAX_ACTIVE', default=4, cast=int)
+FACE_ADMISSION_MAX_QUEUE = config('FACE_ADMISSION_MAX_QUEUE', default=32, cast=int)
+FACE_ADMISSION_PER_CLIENT = config('FACE_ADMISSION_PER_CLIENT', default=2, cast=int)
+FACE_ADMISSION_QUEUE_TIMEOUT = config('FACE_ADMISSION_QUEUE_TIMEOUT', default=10, cast=float)
+FACE_ADMISSION_RETRY_AFTER = config('FACE_ADMISSION_RETRY_AFTER', default=2, cast=int)
+
+# Precisão usada ao gravar Profile.face_embedding ('float32' ou 'float64').
+FACE_EMBEDDING_DTYPE = config('FACE_EMBEDDING_DTYPE', default='float32')
+
+# Pipeline de detecção facial (users.face_processing.DETECTION_PRESETS).
+# FACE_DETECTION_PRESET escolhe entre 'fast', 'balanced' e 'accurate';
+# FACE_DETECTION sobrescreve chaves individuais do preset, ex.:
+# {'max_dimension': 640, 'num_jitters': 2}.
+FACE_DETECTION_PRESET = config('FACE_DETECTION_PRESET', default='balanced')
+FACE_DETECTION = {}
+# Permite que o cliente envie `face_box` ("top,right,bottom,left", em pixels
+# da imagem original) e pule a detecção.
+FACE_ALLOW_CLIENT_BOX = config('FACE_ALLOW_CLIENT_BOX', default=False, cast=bool)
+
+# Triagem de qualidade antes do encoder (users.image_quality.DEFAULT_THRESHOLDS).
+# Sobrescreve limites individuais, ex.: {'min_sharpness': 40, 'face_cascade': True}.
+FACE_QUALITY = {}
+
+# Distância máxima entre embeddings para considerar dois rostos iguais.
+FACE_MATCH_TOLERANCE = config('FACE_MATCH_TOLERANCE', default=0.50, cast=float)
+
+# Galeria de templates por usuário (users.gallery): quantos templates além
+# do cadastro cada usuário pode ter e se verificações bem-sucedidas com
+# distância entre FACE_GALLERY_MIN_NOVELTY e FACE_GALLERY_ADD_DISTANCE
+# acrescentam o novo embedding à galeria.
+FACE_GALLERY_MAX_TEMPLATES = config('FACE_GALLERY_MAX_TEMPLATES', default=4, cast=int)
+FACE_GALLERY_AUTO_ADD = config('FACE_GALLERY_AUTO_ADD', default=True, cast=bool)
+FACE_GALLERY_ADD_DISTANCE = config('FACE_GALLERY_ADD_DISTANCE', default=0.40, cast=float)
+FACE_GALLERY_MIN_NOVELTY = config('FACE_GALLERY_MIN_NOVELTY', default=0.15, cast=float)
+
+# Diretório do snapshot do índice 1:N (users.face_index). Vazio = o índice é
+# carregado direto do banco em cada processo.
+FACE_INDEX_PATH = config('FACE_INDEX_PATH', default='')
+# Log de alterações do índice, lido pelos outros processos: alias de CACHES
+# compartilhado entre os workers, validade de cada entrada e o atraso máximo
+# (em alterações) que ainda é aplicado incrementalmente.
+FACE_INDEX_CACHE_ALIAS = config('FACE_INDEX_CACHE_ALIAS', default='default')
+FACE_INDEX_CHANGE_TTL = config('FACE_INDEX_CHANGE_TTL', default=86400, cast=int)
+FACE_INDEX_MAX_CATCH_UP = config('FACE_INDEX_MAX_CATCH_UP', default=1000, cast=int)
+
+# Limites das imagens enviadas aos endpoints faciais (users.uploads): tamanho
+# do arquivo e resolução lida do cabeçalho. Uploads até esse tamanho ficam em
+# memória, sem passar por arquivo temporário.
+FACE_UPLOAD_MAX_BYTES = config('FACE_UPLOAD_MAX_BYTES', default=8 * 1024 * 1024, cast=int)
+FACE_IMAGE_MAX_PIXELS = config('FACE_IMAGE_MAX_PIXELS', default=40_000_000, cast=int)
+FILE_UPLOAD_MAX_MEMORY_SIZE = FACE_UPLOAD_MAX_BYTES
+
+# Número máximo de imagens aceitas por POST /api/auth/verify-face/batch/.
+FACE_BATCH_MAX_ITEMS = config('FACE_BATCH_MAX_ITEMS', default=16, cast=int)
+
+# Cache dos embeddings decodificados (users.embedding_cache): LRU por processo
+# com até FACE_EMBEDDING_CACHE_SIZE usuários e, opcionalmente, um segundo
+# nível num alias de CACHES compartilhado entre os workers.
+FACE_EMBEDDING_CACHE_SIZE = config('FACE_EMBEDDING_CACHE_SIZE', default=10000, cast=int)
+FACE_EMBEDDING_CACHE_ALIAS = config('FACE_EMBEDDING_CACHE_ALIAS', default='')
+FACE_EMBEDDING_CACHE_TIMEOUT = config('FACE_EMBEDDING_CACHE_TIMEOUT', default=3600, cast=int)
+# Alias de CACHES (compartilhado entre os workers) com a versão da galeria de
+# cada usuário, conferida antes de usar uma galeria em cache.
+FACE_GALLERY_VERSION_ALIAS = config('FACE_GALLERY_VERSION_ALIAS', default='default')
+
+# Outbox do WhatsApp (users.outbox / manage.py drain_outbox).
+EVOLUTION_API_CONNECT_TIMEOUT = config('EVOLUTION_API_CONNECT_TIMEOUT', default=3, cast=float)
+EVOLUTION_API_READ_TIMEOUT = config('EVOLUTION_API_READ_TIMEOUT', default=10, cast=float)
+OUTBOX_BATCH_SIZE = config('OUTBOX_BATCH_SIZE', default=50, cast=int)
+OUTBOX_CONCURRENCY = config('OUTBOX_CONCURRENCY', default=4, cast=int)
+OUTBOX_MAX_ATTEMPTS = config('OUTBOX_MAX_ATTEMPTS', default=5, cast=int)
+OUTBOX_BACKOFF_BASE = config('OUTBOX_BACKOFF_BASE', default=2, cast=float)
+OUTBOX_BACKOFF_MAX = config('OUTBOX_BACKOFF_MAX', default=300, cast=float)
+OUTBOX_CLAIM_LEASE = config('OUTBOX_CLAIM_LEASE', default=60, cast=int)
+OUTBOX_POLL_INTERVAL = config('OUTBOX_POLL_INTERVAL', default=1, cast=float)
+
+# Códigos enviados pelo WhatsApp (users.otp): validade em segundos e número
+# de tentativas antes de o código ser invalidado.
+OTP_CODE_TTL = config('OTP_CODE_TTL', default=600, cast=int)
+OTP_MAX_ATTEMPTS = config('OTP_MAX_ATTEMPTS', default=5, cast=int)
+
+# Limites de requisição (users.throttling): alias de CACHES com os contadores
+# (compartilhado entre os workers em produção) e chave geral, para testes de
+# carga.
+RATE_LIMIT_ENABLED = config('RATE_LIMIT_ENABLED', default=True, cast=bool)
+RATE_LIMIT_CACHE_ALIAS = config('RATE_LIMIT_CACHE_ALIAS', default='default')
+
+# Cache da autenticação por token (users.authentication): LRU por processo
+# com TTL curto, conferido contra a versão do token em
+# AUTH_TOKEN_VERSION_ALIAS (compartilhado entre os workers), e um segundo
+# nível opcional em AUTH_TOKEN_CACHE_ALIAS, válido por AUTH_TOKEN_CACHE_TTL.
+AUTH_TOKEN_CACHE_SIZE = config('AUTH_TOKEN_CACHE_SIZE', default=10000, cast=int)
+AUTH_TOKEN_LOCAL_TTL = config('AUTH_TOKEN_LOCAL_TTL', default=5, cast=int)
+AUTH_TOKEN_CACHE_TTL = config('AUTH_TOKEN_CACHE_TTL', default=300, cast=int)
+AUTH_TOKEN_CACHE_ALIAS = config('AUTH_TOKEN_CACHE_ALIAS', default='')
+AUTH_TOKEN_VERSION_ALIAS = config('AUTH_TOKEN_VERSION_ALIAS', default='default')
+
+# Grant de verificação facial (users.step_up): validade em segundos e alias de
+# CACHES onde os grants ficam registrados (compartilhado entre os workers em
+# produção).
+FACE_STEP_UP_TTL = config('FACE_STEP_UP_TTL', default=300, cast=int)
+FACE_STEP_UP_CACHE_ALIAS = config('FACE_STEP_UP_CACHE_ALIAS', default='default')
+
+# Token exigido pelo endpoint /metrics (Authorization: Bearer <token>). Vazio
+# desativa o endpoint.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
@@ -0,0 +1,121 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from users.models import Profile
+
+from . import db_routing, metrics
+
+
+class PrimaryPinMiddlewareTests(SimpleTestCase):
+    def test_async_chain_stays_async(self):
+        seen = []
+
+        async def view(request):
+            seen.append(db_routing._pinned.get())
+            return HttpResponse()
+
+        middleware = db_routing.PrimaryPinMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        async def request():
+            db_routing._pinned.set(True)
+            await middleware(None)
+
+        async_to_sync(request)()
+        self.assertEqual(seen, [False])
+
+
+@override_settings(DATABASE_READ_REPLICAS=['replica'], DATABASE_REPLICA_MODELS=['users.profile'])
+class PrimaryReplicaRouterTests(TransactionTestCase):
+    # O alias 'replica' só existe a partir do setUpClass.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # Segundo alias SQLite sobre o mesmo banco de teste: uma réplica
+        # sempre em dia, mas com conexão (e consultas) próprias.
+        connections.settings['replica'] = dict(connections['default'].settings_dict)
+        cls.addClassCleanup(connections.settings.pop, 'replica')
+        cls.addClassCleanup(lambda: connections['replica'].close())
+        super().setUpClass()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='ana', password='senha-forte-123')
+        Profile.objects.create(user=self.user, phone_number='5511999999999')
+
+    def request(self, view):
+        """Roda `view` como uma requisição e devolve o alias de cada leitura de Profile."""
+        aliases = []
+
+        def read():
+            with CaptureQueriesContext(connections['default']) as primary, \
+                    CaptureQueriesContext(connections['replica']) as replica:
+                self.assertEqual(Profile.objects.get(user=self.user).phone_number, '5511999999999')
+            aliases.append('default' if primary.captured_queries else 'replica')
+            self.assertEqual(len(primary) + len(replica), 1)
+
+        def get_response(request):
+            view(read)
+            return HttpResponse()
+
+        db_routing.PrimaryPinMiddleware(get_response)(RequestFactory().get('/'))
+        return aliases
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.request(lambda read: read()), ['replica'])
+
+    def test_request_is_pinned_to_the_primary_after_a_write(self):
+        def view(read):
+            read()
+            User.objects.create_user(username='bia', password='senha-forte-123')
+            read()
+
+        self.assertEqual(self.request(view), ['replica', 'default'])
+        # A requisição seguinte volta a ler das réplicas.
+        self.assertEqual(self.request(lambda read: read()), ['replica'])
+
+    def test_reads_inside_atomic_go_to_the_primary(self):
+        def view(read):
+            with transaction.atomic():
+                read()
+            read()
+
+        self.assertEqual(self.request(view), ['default', 'replica'])
+
+
+class MetricsMiddlewareTests(TestCase):
+    def test_async_path_counts_queries_of_sync_code(self):
+        def lookup():
+            with metrics.span('user.lookup'):
+                return User.objects.count() + User.objects.filter(is_staff=True).count()
+
+        async def view(request):
+            await sync_to_async(lookup)()
+            return HttpResponse()
+
+        middleware = metrics.MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        with mock.patch.object(metrics.registry, 'observe') as observe:
+            response = async_to_sync(middleware)(RequestFactory().get('/'))
+
+        queries = [call.args[1] for call in observe.call_args_list if call.args[0] == 'face_wallet_http_request_queries']
+        self.assertEqual(queries, [2])
+        self.assertIn('user-lookup;dur=', response['Server-Timing'])
+
+
+class CorsTests(SimpleTestCase):
+    def test_preflight_allows_the_face_grant_header(self):
+        response = self.client.options(
+            '/api/cards/1/',
+            HTTP_ORIGIN='http://localhost:5173',
+            HTTP_ACCESS_CONTROL_REQUEST_METHOD='GET',
+            HTTP_ACCESS_CONTROL_REQUEST_HEADERS='authorization, x-face-grant',
+        )
+        self.assertIn('x-face-grant', response['Access-Control-Allow-Headers'])
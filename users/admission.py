@@ -0,0 +1,207 @@
+"""
+Controle de admissão dos endpoints de biometria.
+
+Cada requisição facial precisa de uma vaga antes de entrar na view. Há no
+máximo `FACE_ADMISSION_MAX_ACTIVE` requisições em processamento; as demais
+esperam numa fila limitada a `FACE_ADMISSION_MAX_QUEUE`. A fila é separada por
+cliente (o usuário de um token válido, resolvido por
+`CachedTokenAuthentication`, ou então o IP, com o mesmo critério de
+`NUM_PROXIES` dos limites de requisição) e as vagas liberadas são
+distribuídas em rodízio entre os clientes, de modo que um único dispositivo
+disparando requisições não atrasa os outros. Com a fila cheia a resposta é imediata (429 para o cliente
+que excedeu a própria cota, 503 quando o serviço inteiro está saturado), com
+`Retry-After`.
+
+As views continuam síncronas: `admission_controlled` as envolve numa view
+assíncrona que espera pela vaga e só então executa a view original num
+thread. Sob ASGI, a espera só não ocupa thread porque todos os middlewares de
+`MIDDLEWARE` têm caminho assíncrono (`MetricsMiddleware` e
+`PrimaryPinMiddleware` inclusive); um middleware só síncrono faria o Django
+rodar a cadeia inteira num thread. O controlador usa primitivas de
+threading, então também funciona sob WSGI.
+"""
+import asyncio
+import functools
+import threading
+from collections import OrderedDict, deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework import exceptions
+from rest_framework.throttling import BaseThrottle
+
+from .authentication import CachedTokenAuthentication
+
+
+class AdmissionRejected(Exception):
+    status_code = 503
+    detail = "Serviço de biometria sobrecarregado. Tente novamente em instantes."
+
+
+class ClientOverLimit(AdmissionRejected):
+    status_code = 429
+    detail = "Muitas requisições de biometria simultâneas para este cliente."
+
+
+class _Waiter:
+    __slots__ = ('loop', 'future', 'granted')
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionController:
+    def __init__(self, max_active, max_queue, per_client, queue_timeout):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.per_client = per_client
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._waiting = OrderedDict()
+        self._per_client = {}
+
+    def stats(self):
+        with self._lock:
+            return {'active': self._active, 'queued': self._queued, 'clients': len(self._per_client)}
+
+    def _try_acquire(self, client, loop):
+        with self._lock:
+            if self._per_client.get(client, 0) >= self.per_client:
+                raise ClientOverLimit()
+            if self._active < self.max_active and not self._queued:
+                self._active += 1
+                self._per_client[client] = self._per_client.get(client, 0) + 1
+                return None
+            if self._queued >= self.max_queue:
+                raise AdmissionRejected()
+
+            waiter = _Waiter(loop)
+            self._waiting.setdefault(client, deque()).append(waiter)
+            self._queued += 1
+            self._per_client[client] = self._per_client.get(client, 0) + 1
+            return waiter
+
+    def _forget(self, client):
+        remaining = self._per_client[client] - 1
+        if remaining:
+            self._per_client[client] = remaining
+        else:
+            del self._per_client[client]
+
+    def _abandon(self, client, waiter):
+        # Devolve True se a vaga já tinha sido concedida a este waiter (o
+        # timeout e a liberação chegaram juntos) e portanto precisa ser usada
+        # ou liberada por quem esperava.
+        with self._lock:
+            if waiter.granted:
+                return True
+            queue = self._waiting.get(client)
+            queue.remove(waiter)
+            if not queue:
+                del self._waiting[client]
+            self._queued -= 1
+            self._forget(client)
+            return False
+
+    async def acquire(self, client):
+        waiter = self._try_acquire(client, asyncio.get_running_loop())
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if self._abandon(client, waiter):
+                if isinstance(e, asyncio.CancelledError):
+                    self.release(client)
+                    raise
+                return
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise AdmissionRejected()
+
+    def release(self, client):
+        with self._lock:
+            self._forget(client)
+            if not self._waiting:
+                self._active -= 1
+                return
+
+            # Rodízio: o próximo cliente da fila recebe a vaga e, se ainda
+            # tiver requisições esperando, volta para o fim da fila.
+            next_client, queue = self._waiting.popitem(last=False)
+            waiter = queue.popleft()
+            if queue:
+                self._waiting[next_client] = queue
+            self._queued -= 1
+            waiter.granted = True
+        waiter.loop.call_soon_threadsafe(_wake, waiter.future)
+
+    def retry_after(self):
+        with self._lock:
+            backlog = self._queued + self._active
+        return max(1, round(settings.FACE_ADMISSION_RETRY_AFTER * backlog / max(1, self.max_active)))
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController(
+                    max_active=settings.FACE_ADMISSION_MAX_ACTIVE,
+                    max_queue=settings.FACE_ADMISSION_MAX_QUEUE,
+                    per_client=settings.FACE_ADMISSION_PER_CLIENT,
+                    queue_timeout=settings.FACE_ADMISSION_QUEUE_TIMEOUT,
+                )
+    return _controller
+
+
+def client_key(request):
+    # O cabeçalho Authorization em si não serve de chave: um cliente que
+    # inventa um token diferente a cada requisição ganharia uma cota nova a
+    # cada vez. Só um token válido identifica o cliente pelo usuário.
+    if request.META.get('HTTP_AUTHORIZATION'):
+        try:
+            resolved = CachedTokenAuthentication().authenticate(request)
+        except exceptions.AuthenticationFailed:
+            resolved = None
+        if resolved is not None:
+            return f'user:{resolved[0].pk}'
+    return f'ip:{BaseThrottle().get_ident(request)}'
+
+
+def admission_controlled(view):
+    run_view = sync_to_async(view)
+    resolve_client = sync_to_async(client_key)
+
+    @functools.wraps(view)
+    async def wrapped(request, *args, **kwargs):
+        controller = get_controller()
+        client = await resolve_client(request)
+        try:
+            await controller.acquire(client)
+        except AdmissionRejected as e:
+            response = JsonResponse({"detail": e.detail}, status=e.status_code)
+            response['Retry-After'] = str(controller.retry_after())
+            return response
+
+        try:
+            return await run_view(request, *args, **kwargs)
+        finally:
+            controller.release(client)
+
+    return wrapped
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from face_wallet.metrics import registry
+        from . import checks, monitoring, signals  # noqa: F401
+
+        registry.register_collector(monitoring.collect)
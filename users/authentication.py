@@ -0,0 +1,109 @@
+"""
+Autenticação por token com cache.
+
+`CachedTokenAuthentication` resolve a chave do token por um LRU no próprio
+processo, com TTL curto (`AUTH_TOKEN_LOCAL_TTL`). Cada token tem um número de
+versão em `AUTH_TOKEN_VERSION_ALIAS`, um cache compartilhado entre os
+workers; os sinais de `Token` e `User` incrementam a versão após o commit
+quando o token é removido ou o usuário é alterado/desativado, e a entrada
+local só é usada se foi montada com a versão atual. Assim um logout ou uma
+desativação valem em todos os processos na requisição seguinte.
+
+Com `AUTH_TOKEN_CACHE_ALIAS` configurado, um segundo nível compartilhado
+guarda só `user_id`, `is_active` e a criação do token (nunca o usuário
+inteiro, com o hash da senha), o que poupa a consulta do token num processo
+que ainda não o conhece.
+"""
+import copy
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .caching import LRUCache, invalidate_versioned
+
+_local = LRUCache(settings.AUTH_TOKEN_CACHE_SIZE, ttl=settings.AUTH_TOKEN_LOCAL_TTL)
+
+
+def _digest(key):
+    # A chave do token não vai em claro para o cache compartilhado.
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _shared_key(key):
+    return 'auth_token:' + _digest(key)
+
+
+def _version_key(key):
+    return 'auth_token_version:' + _digest(key)
+
+
+def _shared_cache():
+    alias = settings.AUTH_TOKEN_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def _version_cache():
+    return caches[settings.AUTH_TOKEN_VERSION_ALIAS]
+
+
+def _version(key):
+    return _version_cache().get(_version_key(key), 0)
+
+
+def invalidate(key):
+    def evict():
+        _local.delete(key)
+        shared = _shared_cache()
+        if shared is not None:
+            shared.delete(_shared_key(key))
+
+    # A versão só precisa sobreviver às entradas montadas antes dela; depois
+    # disso pode expirar e voltar a zero sem ressuscitar nada.
+    timeout = 2 * max(settings.AUTH_TOKEN_CACHE_TTL, settings.AUTH_TOKEN_LOCAL_TTL)
+    invalidate_versioned(_version_cache(), _version_key(key), evict, timeout=timeout)
+
+
+def stats():
+    return _local.stats()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        # A versão é lida antes do banco: uma invalidação que chegue no meio
+        # do caminho muda a versão e a entrada gravada aqui já nasce vencida.
+        version = _version(key)
+        entry = _local.get(key, version=version)
+        if entry is None:
+            entry = self._load(key, version)
+            _local.set(key, entry, version=version)
+
+        user, token = entry
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        # Cada requisição recebe sua própria cópia, para que alterações em
+        # request.user não vazem para outras requisições pelo cache.
+        return copy.copy(user), token
+
+    def _load(self, key, version):
+        shared = _shared_cache()
+        if shared is not None:
+            cached = shared.get(_shared_key(key))
+            if cached is not None and cached[0] == version:
+                _, user_id, is_active, created = cached
+                if not is_active:
+                    raise exceptions.AuthenticationFailed('User inactive or deleted.')
+                user = get_user_model().objects.filter(pk=user_id).first()
+                if user is not None:
+                    return user, self.get_model()(key=key, user=user, created=created)
+
+        user, token = super().authenticate_credentials(key)
+        if shared is not None:
+            shared.set(
+                _shared_key(key), (version, user.pk, user.is_active, token.created), settings.AUTH_TOKEN_CACHE_TTL
+            )
+        return user, token
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.db import transaction
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None, version=None):
+        """
+        Com `version`, uma entrada guardada com outra versão conta como miss
+        e é descartada, como se tivesse expirado.
+        """
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and (
+                (entry[0] is not None and entry[0] <= time.monotonic())
+                or (version is not None and entry[1] != version)
+            ):
+                del self._data[key]
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value, version=None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, version, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize}
+
+
+def incr(cache, key, timeout=None):
+    """
+    Incrementa um contador no cache do Django, criando-o se não existir, e
+    devolve o valor novo. `cache.incr` é atômico no Redis, no Memcached e no
+    locmem.
+    """
+    cache.add(key, 0, timeout=timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # A chave expirou entre o add e o incr.
+        cache.set(key, 1, timeout=timeout)
+        return 1
+
+
+def invalidate_versioned(cache, version_key, evict, timeout=None):
+    """
+    Invalida uma entrada versionada: `evict` remove a cópia deste processo
+    (e a do cache compartilhado, se houver) e, após o commit, a versão em
+    `version_key` é incrementada para que os outros processos descartem as
+    suas.
+    """
+    def commit():
+        incr(cache, version_key, timeout=timeout)
+        evict()
+
+    # Remove já e de novo após o commit, para que uma leitura concorrente
+    # durante a transação não deixe o valor antigo no cache.
+    evict()
+    transaction.on_commit(commit)
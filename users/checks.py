@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core import checks
+
+# Backends cujo conteúdo não é visto pelos outros processos.
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Aliases de CACHES que coordenam os workers entre si.
+SHARED_CACHE_SETTINGS = (
+    'FACE_INDEX_CACHE_ALIAS',
+    'FACE_GALLERY_VERSION_ALIAS',
+    'AUTH_TOKEN_VERSION_ALIAS',
+    'FACE_STEP_UP_CACHE_ALIAS',
+    'RATE_LIMIT_CACHE_ALIAS',
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache_aliases(app_configs, **kwargs):
+    warnings = []
+    for setting in SHARED_CACHE_SETTINGS:
+        alias = getattr(settings, setting)
+        backend = settings.CACHES.get(alias, {}).get('BACKEND') if alias else None
+        if backend in PROCESS_LOCAL_BACKENDS:
+            warnings.append(checks.Warning(
+                f"{setting}='{alias}' usa {backend.rsplit('.', 1)[-1]}, que não é compartilhado entre processos.",
+                hint="Com mais de um worker, aponte o alias para um cache compartilhado (Redis, Memcached, banco).",
+                obj=setting,
+                id='users.W001',
+            ))
+    return warnings
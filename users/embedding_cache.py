@@ -0,0 +1,165 @@
+"""
+Cache das galerias faciais já decodificadas, por `user_id`.
+
+A galeria de um usuário é uma matriz (N x D) com o embedding do cadastro na
+primeira linha, seguido dos templates adicionais (`FaceTemplate`), pronta para
+ser comparada com um único cálculo vetorizado.
+
+O primeiro nível é um LRU no próprio processo, guardando a galeria pronta
+para uso. Com `FACE_EMBEDDING_CACHE_ALIAS` configurado, um segundo nível no
+cache do Django (compartilhado entre workers) guarda os bytes empacotados.
+
+Cada usuário tem um número de versão em `FACE_GALLERY_VERSION_ALIAS`, um
+cache compartilhado entre os workers. Os sinais de `Profile` e `FaceTemplate`
+incrementam a versão após o commit, e as entradas dos dois níveis guardam a
+versão com que foram montadas. Antes de usar uma galeria do cache, a versão
+é conferida (uma leitura de chave curta, ou um get_many para o lote), então
+um template removido deixa de valer em todos os processos, não só no que
+recebeu o sinal.
+"""
+import threading
+from collections import defaultdict, namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .caching import LRUCache, invalidate_versioned
+from .embeddings import pack_embedding, unpack_embedding
+
+# O TTL só cobre o caso de a versão sumir do cache compartilhado (despejo).
+_local = LRUCache(settings.FACE_EMBEDDING_CACHE_SIZE, ttl=settings.FACE_EMBEDDING_CACHE_TIMEOUT)
+_shared_hits = 0
+_stats_lock = threading.Lock()
+
+# `template_ids[i]` é o id do FaceTemplate da linha i; None na linha do
+# cadastro.
+Gallery = namedtuple('Gallery', ['matrix', 'template_ids'])
+
+
+def _key(user_id):
+    return f'face_gallery:{user_id}'
+
+
+def _version_key(user_id):
+    return f'face_gallery_version:{user_id}'
+
+
+def _shared_cache():
+    alias = settings.FACE_EMBEDDING_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def _version_cache():
+    return caches[settings.FACE_GALLERY_VERSION_ALIAS]
+
+
+def _versions(user_ids):
+    cached = _version_cache().get_many([_version_key(user_id) for user_id in user_ids])
+    return {user_id: cached.get(_version_key(user_id), 0) for user_id in user_ids}
+
+
+def _build(rows):
+    template_ids = tuple(template_id for template_id, _ in rows)
+    matrix = np.vstack([embedding for _, embedding in rows]).astype(np.float32, copy=False)
+    matrix.flags.writeable = False
+    return Gallery(matrix, template_ids)
+
+
+def _remember(user_id, gallery, version, shared=None):
+    _local.set(user_id, gallery, version=version)
+    if shared is not None:
+        packed = [(template_id, pack_embedding(row)) for template_id, row in zip(gallery.template_ids, gallery.matrix)]
+        shared.set(_key(user_id), (version, packed), settings.FACE_EMBEDDING_CACHE_TIMEOUT)
+
+
+def get_galleries(user_ids):
+    """
+    Devolve {user_id: Gallery} para os usuários que têm rosto cadastrado.
+    O que não estiver em cache é buscado em duas consultas (perfis e
+    templates), independente do número de usuários.
+    """
+    global _shared_hits
+    from .models import FaceTemplate, Profile
+
+    # A versão é lida antes do banco: uma alteração que chegue no meio do
+    # caminho muda a versão e a entrada gravada aqui já nasce vencida.
+    versions = _versions(set(user_ids))
+    found = {}
+    missing = []
+    for user_id, version in versions.items():
+        gallery = _local.get(user_id, version=version)
+        if gallery is not None:
+            found[user_id] = gallery
+        else:
+            missing.append(user_id)
+
+    shared = _shared_cache()
+    if missing and shared is not None:
+        cached = shared.get_many([_key(user_id) for user_id in missing])
+        for user_id in list(missing):
+            entry = cached.get(_key(user_id))
+            if entry is not None and entry[0] == versions[user_id]:
+                found[user_id] = _build([(template_id, unpack_embedding(data)) for template_id, data in entry[1]])
+                _local.set(user_id, found[user_id], version=versions[user_id])
+                missing.remove(user_id)
+                with _stats_lock:
+                    _shared_hits += 1
+
+    if missing:
+        rows = defaultdict(list)
+        for user_id, data in Profile.objects.filter(user_id__in=missing).values_list('user_id', 'face_embedding'):
+            if data:
+                rows[user_id].append((None, unpack_embedding(bytes(data))))
+
+        templates = (
+            FaceTemplate.objects.filter(user_id__in=list(rows))
+            .order_by('user_id', 'created_at')
+            .values_list('user_id', 'pk', 'embedding')
+        )
+        for user_id, template_id, data in templates:
+            rows[user_id].append((template_id, unpack_embedding(bytes(data))))
+
+        for user_id, user_rows in rows.items():
+            found[user_id] = _build(user_rows)
+            _remember(user_id, found[user_id], versions[user_id], shared)
+
+    return found
+
+
+def get_gallery(user_id):
+    """
+    Galeria do usuário, ou None se o perfil não tem rosto. Levanta
+    Profile.DoesNotExist quando o perfil não existe.
+    """
+    from .models import Profile
+
+    galleries = get_galleries([user_id])
+    if user_id in galleries:
+        return galleries[user_id]
+    if not Profile.objects.filter(user_id=user_id).exists():
+        raise Profile.DoesNotExist()
+    return None
+
+
+def invalidate(user_id):
+    def evict():
+        _local.delete(user_id)
+        shared = _shared_cache()
+        if shared is not None:
+            shared.delete(_key(user_id))
+
+    # A nova versão invalida a galeria nos caches dos outros processos.
+    invalidate_versioned(_version_cache(), _version_key(user_id), evict)
+
+
+def clear():
+    _local.clear()
+
+
+def stats():
+    result = _local.stats()
+    # Todo acerto do segundo nível foi antes um miss do LRU local.
+    result['shared_hits'] = _shared_hits
+    result['misses'] = result['misses'] - _shared_hits
+    return result
@@ -0,0 +1,39 @@
+"""
+Formato binário dos embeddings faciais armazenados em `Profile.face_embedding`.
+
+Layout (little-endian):
+
+    magic  b'FE'   2 bytes
+    versão         1 byte
+    dtype          1 byte  (1 = float32, 2 = float64)
+    dimensão       2 bytes (uint16)
+    valores        dimensão * itemsize bytes
+"""
+import struct
+
+import numpy as np
+
+MAGIC = b'FE'
+VERSION = 1
+
+_HEADER = struct.Struct('<2sBBH')
+_DTYPES = {1: np.dtype('<f4'), 2: np.dtype('<f8')}
+_DTYPE_CODES = {dtype.str: code for code, dtype in _DTYPES.items()}
+
+
+def pack_embedding(embedding, dtype='float32'):
+    dtype = np.dtype(dtype).newbyteorder('<')
+    if dtype.str not in _DTYPE_CODES:
+        raise ValueError(f"Tipo de embedding não suportado: {dtype}")
+
+    values = np.ascontiguousarray(embedding, dtype=dtype).ravel()
+    return _HEADER.pack(MAGIC, VERSION, _DTYPE_CODES[dtype.str], values.size) + values.tobytes()
+
+
+def unpack_embedding(data):
+    # np.frombuffer não copia: o array resultante é uma view somente-leitura
+    # sobre o valor lido do banco.
+    magic, version, code, dimension = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION or code not in _DTYPES:
+        raise ValueError("Formato de embedding desconhecido.")
+    return np.frombuffer(data, dtype=_DTYPES[code], count=dimension, offset=_HEADER.size)
@@ -0,0 +1,122 @@
+"""
+Servidor HTTP local que imita o endpoint `/message/sendText/{instance}` da
+Evolution API. Guarda as mensagens recebidas em memória para que testes e o
+harness de carga possam ler os códigos enviados, e permite simular falhas.
+
+    stub = EvolutionStub(api_key='chave', instance_name='carteira')
+    stub.start()
+    ...  # EVOLUTION_API_URL = stub.url
+    stub.messages  # [{'number': ..., 'text': ...}, ...]
+    stub.stop()
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+CODE_PATTERN = re.compile(r'\*(\d{6})\*')
+
+
+class EvolutionStub:
+    def __init__(self, host='127.0.0.1', port=0, api_key='stub-key', instance_name='stub'):
+        self.api_key = api_key
+        self.instance_name = instance_name
+        self.messages = []
+        self.fail_next = 0
+        self.fail_status = 503
+        self.delay = 0.0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def fail(self, count, status=503):
+        with self._lock:
+            self.fail_next = count
+            self.fail_status = status
+
+    def last_code(self, phone_number):
+        with self._lock:
+            for message in reversed(self.messages):
+                if message['number'] == phone_number:
+                    match = CODE_PATTERN.search(message['text'])
+                    if match:
+                        return match.group(1)
+        return None
+
+    def _record(self, payload):
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return self.fail_status
+            self.messages.append({
+                'number': payload.get('number'),
+                'text': payload.get('textMessage', {}).get('text', ''),
+            })
+            return 201
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                if path != f"/message/sendText/{stub.instance_name}":
+                    return self._reply(404, {'error': 'Not Found'})
+                if self.headers.get('apikey') != stub.api_key:
+                    return self._reply(401, {'error': 'Unauthorized'})
+
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    return self._reply(400, {'error': 'Invalid JSON'})
+
+                if stub.delay:
+                    threading.Event().wait(stub.delay)
+                status = stub._record(payload)
+                self._reply(status, {'key': {'remoteJid': payload.get('number')}, 'status': 'PENDING'})
+
+            def do_GET(self):
+                # Consulta usada pelo harness de carga: /messages ou
+                # /messages?number=5511999999999
+                parsed = urlparse(self.path)
+                if parsed.path != '/messages':
+                    return self._reply(404, {'error': 'Not Found'})
+                number = dict(
+                    part.split('=', 1) for part in parsed.query.split('&') if '=' in part
+                ).get('number')
+                with stub._lock:
+                    messages = [m for m in stub.messages if number is None or m['number'] == number]
+                self._reply(200, messages)
+
+        return Handler
@@ -0,0 +1,335 @@
+"""
+Índice em memória dos embeddings faciais, usado na identificação 1:N.
+
+A base do índice é uma matriz contígua (N x D, float32) com os embeddings de
+todos os perfis, ordenada por `user_id`. Ela pode vir do banco ou de um
+snapshot em disco (`FACE_INDEX_PATH`, gerado por `manage.py build_face_index`),
+aberto com `mmap` para que todos os workers do gunicorn compartilhem as
+mesmas páginas.
+
+Alterações posteriores em `Profile` não reescrevem a base: o perfil alterado
+é marcado como inativo nela e passa a viver numa pequena matriz de delta.
+Cada alteração também entra num log no cache compartilhado
+`FACE_INDEX_CACHE_ALIAS` (um contador de sequência e uma chave por
+alteração com o `user_id`). Na consulta seguinte, os outros processos leem
+as entradas que ainda não aplicaram e buscam só os perfis afetados. O índice
+inteiro só é recarregado quando o log não basta: atraso maior que
+`FACE_INDEX_MAX_CATCH_UP` alterações, entradas expiradas ou uma importação
+em massa (`invalidate()`).
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import caching
+from .embeddings import unpack_embedding
+
+SEQUENCE_KEY = 'face_index:sequence'
+# Entrada do log que pede a recarga completa do índice.
+RELOAD = 'reload'
+# Tempo máximo esperando por uma entrada do log que ainda não apareceu (o
+# contador é incrementado antes de a entrada ser gravada).
+_GAP_TIMEOUT = 5.0
+
+_SNAPSHOT_MATRIX = 'embeddings.npy'
+_SNAPSHOT_IDS = 'user_ids.npy'
+_SNAPSHOT_META = 'meta.json'
+
+
+class EmbeddingIndex:
+    def __init__(self, user_ids, matrix):
+        order = np.argsort(user_ids, kind='stable')
+        if not np.array_equal(order, np.arange(len(user_ids))):
+            user_ids, matrix = user_ids[order], matrix[order]
+
+        self.dimension = matrix.shape[1]
+        self._lock = threading.Lock()
+
+        self._base_ids = user_ids
+        self._base = matrix
+        self._base_norms = np.einsum('ij,ij->i', matrix, matrix)
+        self._base_alive = np.ones(len(user_ids), dtype=bool)
+
+        self._delta = np.empty((16, self.dimension), dtype=np.float32)
+        self._delta_ids = np.empty(16, dtype=np.int64)
+        self._delta_size = 0
+        self._delta_rows = {}
+
+    def __len__(self):
+        with self._lock:
+            return int(self._base_alive.sum()) + self._delta_size
+
+    def _base_position(self, user_id):
+        position = int(np.searchsorted(self._base_ids, user_id))
+        if position < len(self._base_ids) and self._base_ids[position] == user_id:
+            return position
+        return None
+
+    def upsert(self, user_id, embedding):
+        with self._lock:
+            position = self._base_position(user_id)
+            if position is not None:
+                self._base_alive[position] = False
+
+            row = self._delta_rows.get(user_id)
+            if row is None:
+                if self._delta_size == len(self._delta_ids):
+                    self._delta = np.concatenate([self._delta, np.empty_like(self._delta)])
+                    self._delta_ids = np.concatenate([self._delta_ids, np.empty_like(self._delta_ids)])
+                row = self._delta_size
+                self._delta_size += 1
+                self._delta_rows[user_id] = row
+                self._delta_ids[row] = user_id
+            self._delta[row] = embedding
+
+    def remove(self, user_id):
+        with self._lock:
+            position = self._base_position(user_id)
+            if position is not None:
+                self._base_alive[position] = False
+
+            row = self._delta_rows.pop(user_id, None)
+            if row is not None:
+                last = self._delta_size - 1
+                if row != last:
+                    self._delta[row] = self._delta[last]
+                    self._delta_ids[row] = self._delta_ids[last]
+                    self._delta_rows[int(self._delta_ids[row])] = row
+                self._delta_size -= 1
+
+    def search(self, embedding, k=1):
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+
+        with self._lock:
+            alive = self._base_alive.copy()
+            delta = self._delta[:self._delta_size].copy()
+            delta_ids = self._delta_ids[:self._delta_size].copy()
+
+        # ||a - q||² = ||a||² - 2·a·q + ||q||², calculado para a base inteira
+        # com um único produto matriz-vetor.
+        base_sq = self._base_norms - 2.0 * (self._base @ query) + query @ query
+        base_sq[~alive] = np.inf
+        delta_sq = np.einsum('ij,ij->i', delta - query, delta - query)
+
+        ids = np.concatenate([self._base_ids, delta_ids])
+        distances = np.sqrt(np.maximum(np.concatenate([base_sq, delta_sq]), 0.0))
+
+        k = min(k, len(distances))
+        if k <= 0:
+            return []
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        return [
+            (int(ids[i]), float(distances[i]))
+            for i in nearest
+            if np.isfinite(distances[i])
+        ]
+
+
+def _profiles_with_embedding():
+    from .models import Profile
+    return Profile.objects.exclude(face_embedding__isnull=True)
+
+
+def _load_rows(queryset):
+    user_ids = []
+    embeddings = []
+    for user_id, data in queryset.values_list('user_id', 'face_embedding').iterator(chunk_size=2000):
+        if data:
+            user_ids.append(user_id)
+            embeddings.append(unpack_embedding(data))
+    return user_ids, embeddings
+
+
+def build_from_database():
+    user_ids, embeddings = _load_rows(_profiles_with_embedding())
+    if not embeddings:
+        return EmbeddingIndex(np.empty(0, dtype=np.int64), np.empty((0, 128), dtype=np.float32))
+    return EmbeddingIndex(np.array(user_ids, dtype=np.int64), np.vstack(embeddings).astype(np.float32))
+
+
+def write_snapshot(path):
+    built_at = timezone.now()
+    index = build_from_database()
+    os.makedirs(path, exist_ok=True)
+
+    # Grava em arquivos temporários e troca de uma vez, para que um worker
+    # que esteja abrindo o snapshot nunca veja um arquivo pela metade.
+    for name, array in ((_SNAPSHOT_MATRIX, index._base), (_SNAPSHOT_IDS, index._base_ids)):
+        tmp_path = os.path.join(path, f'.{name}.tmp')
+        with open(tmp_path, 'wb') as fh:
+            np.save(fh, np.ascontiguousarray(array))
+        os.replace(tmp_path, os.path.join(path, name))
+
+    tmp_path = os.path.join(path, f'.{_SNAPSHOT_META}.tmp')
+    with open(tmp_path, 'w') as fh:
+        json.dump({'built_at': built_at.isoformat(), 'count': len(index._base_ids)}, fh)
+    os.replace(tmp_path, os.path.join(path, _SNAPSHOT_META))
+    return len(index._base_ids)
+
+
+def load_snapshot(path):
+    with open(os.path.join(path, _SNAPSHOT_META)) as fh:
+        built_at = parse_datetime(json.load(fh)['built_at'])
+
+    matrix = np.load(os.path.join(path, _SNAPSHOT_MATRIX), mmap_mode='r')
+    user_ids = np.load(os.path.join(path, _SNAPSHOT_IDS))
+    index = EmbeddingIndex(user_ids, matrix)
+
+    # Traz o snapshot para o estado atual do banco: perfis alterados depois
+    # da geração entram no delta e perfis removidos são desativados.
+    changed_ids, changed = _load_rows(_profiles_with_embedding().filter(updated_at__gte=built_at))
+    for user_id, embedding in zip(changed_ids, changed):
+        index.upsert(user_id, embedding)
+
+    current = np.fromiter(
+        _profiles_with_embedding().values_list('user_id', flat=True).iterator(chunk_size=10000),
+        dtype=np.int64,
+    )
+    for user_id in np.setdiff1d(user_ids, current, assume_unique=True):
+        index.remove(int(user_id))
+    return index
+
+
+def load_index():
+    path = settings.FACE_INDEX_PATH
+    if path and os.path.exists(os.path.join(path, _SNAPSHOT_META)):
+        return load_snapshot(path)
+    return build_from_database()
+
+
+_index = None
+_sequence = None
+_gap_since = None
+_index_lock = threading.Lock()
+
+
+def _shared():
+    return caches[settings.FACE_INDEX_CACHE_ALIAS]
+
+
+def _change_key(sequence):
+    return f'face_index:change:{sequence}'
+
+
+def _publish(change):
+    shared = _shared()
+    sequence = caching.incr(shared, SEQUENCE_KEY)
+    shared.set(_change_key(sequence), change, settings.FACE_INDEX_CHANGE_TTL)
+    return sequence
+
+
+def _reload(sequence):
+    global _index, _sequence, _gap_since
+    # O banco é lido depois do contador: alterações no meio do caminho já
+    # entram na carga e reaplicá-las depois não muda nada.
+    _index = load_index()
+    _sequence = sequence
+    _gap_since = None
+
+
+def _apply(user_ids):
+    from .models import Profile
+
+    found = dict(Profile.objects.filter(user_id__in=user_ids).values_list('user_id', 'face_embedding'))
+    for user_id in user_ids:
+        data = found.get(user_id)
+        if data:
+            _index.upsert(user_id, unpack_embedding(data))
+        else:
+            _index.remove(user_id)
+
+
+def _catch_up(current):
+    global _sequence, _gap_since
+    pending = range(_sequence + 1, current + 1)
+    if len(pending) > settings.FACE_INDEX_MAX_CATCH_UP:
+        return _reload(current)
+
+    changes = _shared().get_many([_change_key(sequence) for sequence in pending])
+    user_ids = set()
+    applied = _sequence
+    for sequence in pending:
+        change = changes.get(_change_key(sequence))
+        if change is None:
+            break
+        if change == RELOAD:
+            return _reload(current)
+        user_ids.add(change)
+        applied = sequence
+
+    if applied < current:
+        # Entrada ainda não gravada ou já expirada: espera um pouco antes de
+        # desistir do log e recarregar tudo.
+        now = time.monotonic()
+        if _gap_since is None:
+            _gap_since = now
+        elif now - _gap_since > _GAP_TIMEOUT:
+            return _reload(current)
+    else:
+        _gap_since = None
+
+    if user_ids:
+        _apply(user_ids)
+    _sequence = applied
+
+
+def get_index():
+    current = _shared().get(SEQUENCE_KEY, 0)
+    if _index is not None and current == _sequence:
+        return _index
+    with _index_lock:
+        if _index is None or current < _sequence:
+            # Primeira carga ou o cache compartilhado foi esvaziado.
+            _reload(current)
+        elif current > _sequence:
+            _catch_up(current)
+    return _index
+
+
+def _record(change):
+    global _sequence
+    sequence = _publish(change)
+    # A alteração já foi aplicada no índice local; só avança a sequência se
+    # nenhuma outra entrou antes, senão _catch_up reaplica a partir do banco.
+    with _index_lock:
+        if _sequence is not None and sequence == _sequence + 1:
+            _sequence = sequence
+
+
+def invalidate():
+    transaction.on_commit(lambda: _publish(RELOAD))
+
+
+def profile_saved(profile):
+    embedding = profile.get_face_embedding()
+    user_id = profile.user_id
+
+    def apply():
+        if _index is not None:
+            if embedding is None:
+                _index.remove(user_id)
+            else:
+                _index.upsert(user_id, embedding)
+        _record(user_id)
+
+    transaction.on_commit(apply)
+
+
+def profile_deleted(profile):
+    user_id = profile.user_id
+
+    def apply():
+        if _index is not None:
+            _index.remove(user_id)
+        _record(user_id)
+
+    transaction.on_commit(apply)
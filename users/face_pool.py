@@ -0,0 +1,338 @@
+"""
+Pool de processos dedicado à inferência facial.
+
+Os workers são processos de longa duração que carregam os modelos do dlib
+uma única vez (`face_processing.load_models`) e recebem jobs de
+decodificação + encoding. As views apenas submetem o job e aguardam o
+resultado.
+
+O pool vive no processo que chama `get_pool()`. Sem `FACE_POOL_ADDRESS`,
+cada worker HTTP tem o seu, e N workers somam N × `FACE_POOL_SIZE`
+processos, cada um com sua cópia dos modelos. Com `FACE_POOL_ADDRESS`, um
+único serviço (`manage.py run_face_pool`) mantém o pool e os workers HTTP
+enviam os jobs a ele por socket (`FacePoolClient`), de modo que o número de
+núcleos usados pela biometria fica independente dos workers HTTP.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Client, Listener
+
+from django.conf import settings
+
+from face_wallet import metrics
+
+from . import face_processing, image_quality
+
+logger = logging.getLogger(__name__)
+
+
+class FacePoolError(Exception):
+    pass
+
+
+class FacePoolBusy(FacePoolError):
+    pass
+
+
+class FacePoolTimeout(FacePoolError):
+    pass
+
+
+class FaceInferencePool:
+    def __init__(self, size, max_queue, job_timeout):
+        self.size = size
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self._slots = threading.BoundedSemaphore(size + max_queue) if size > 0 else None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        with self._lock:
+            # Após um fork (ex.: gunicorn --preload) o executor herdado não
+            # pertence a este processo e precisa ser recriado.
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=face_processing.load_models,
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _discard_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise FacePoolBusy("Fila de processamento facial cheia.")
+
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard_executor(executor)
+            raise FacePoolError("Pool de processamento facial indisponível.")
+        except BaseException:
+            self._slots.release()
+            raise
+
+        # O slot só é devolvido quando o worker termina de fato, mesmo que o
+        # chamador já tenha desistido por timeout.
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def result(self, future, timeout=None):
+        try:
+            return future.result(timeout=self.job_timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise FacePoolTimeout("Tempo limite do processamento facial excedido.")
+        except BrokenProcessPool:
+            self._discard_executor(self._executor)
+            raise FacePoolError("Pool de processamento facial indisponível.")
+
+    def run(self, fn, *args, timeout=None):
+        if self.size <= 0:
+            return fn(*args)
+        return self.result(self.submit(fn, *args), timeout=timeout)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def parse_address(address):
+    """`host:porta` vira endereço TCP; qualquer outro valor é um socket Unix."""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+class FacePoolServer:
+    """Expõe um `FaceInferencePool` aos workers HTTP por socket autenticado."""
+
+    def __init__(self, pool, address, authkey):
+        self.pool = pool
+        self.listener = Listener(parse_address(address), authkey=authkey)
+        self.address = self.listener.address
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except multiprocessing.AuthenticationError:
+                logger.warning("Conexão ao pool facial recusada: chave inválida.")
+                continue
+            except OSError:
+                # Listener fechado por stop().
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    fn, args, timeout = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    # Só as funções de face_processing são aceitas como job.
+                    if getattr(fn, '__module__', None) != face_processing.__name__:
+                        raise FacePoolError("Job não permitido no pool facial.")
+                    reply = ('ok', self._execute(fn, args, timeout))
+                except Exception as e:
+                    reply = ('error', e)
+                try:
+                    conn.send(reply)
+                except OSError:
+                    return
+
+    def _execute(self, fn, args, timeout):
+        if timeout is not None or self.pool.size <= 0:
+            return self.pool.run(fn, *args, timeout=timeout)
+        # Jobs vindos de submit(): o prazo é aplicado pelo cliente, em result().
+        future = self.pool.submit(fn, *args)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self.pool._discard_executor(self.pool._executor)
+            raise FacePoolError("Pool de processamento facial indisponível.")
+
+    def stop(self):
+        self.listener.close()
+        self.pool.shutdown(wait=False)
+
+
+class FacePoolClient:
+    """Mesma interface do `FaceInferencePool`, executando no serviço compartilhado."""
+
+    def __init__(self, address, authkey, size, max_queue, job_timeout):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.size = size
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        try:
+            return Client(self.address, authkey=self.authkey)
+        except (OSError, multiprocessing.AuthenticationError):
+            raise FacePoolError("Pool de processamento facial indisponível.")
+
+    def _release(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+
+    def _call(self, fn, args, timeout):
+        conn = self._acquire()
+        try:
+            conn.send((fn, args, timeout))
+            if not conn.poll(timeout):
+                # A resposta atrasada dessincronizaria a conexão; ela é descartada.
+                conn.close()
+                raise FacePoolTimeout("Tempo limite do processamento facial excedido.")
+            status, value = conn.recv()
+        except (EOFError, OSError):
+            conn.close()
+            raise FacePoolError("Pool de processamento facial indisponível.")
+        self._release(conn)
+        if status == 'error':
+            raise value
+        return value
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max(1, self.size + self.max_queue))
+            executor = self._executor
+        return executor.submit(self._call, fn, args, None)
+
+    def result(self, future, timeout=None):
+        try:
+            return future.result(timeout=self.job_timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            raise FacePoolTimeout("Tempo limite do processamento facial excedido.")
+
+    def run(self, fn, *args, timeout=None):
+        return self._call(fn, args, self.job_timeout if timeout is None else timeout)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            idle, self._idle = self._idle, []
+        if executor is not None:
+            executor.shutdown(wait=wait)
+        for conn in idle:
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None and settings.FACE_POOL_ADDRESS:
+                _pool = FacePoolClient(
+                    address=settings.FACE_POOL_ADDRESS,
+                    authkey=settings.FACE_POOL_AUTHKEY.encode(),
+                    size=settings.FACE_POOL_SIZE,
+                    max_queue=settings.FACE_POOL_MAX_QUEUE,
+                    job_timeout=settings.FACE_POOL_JOB_TIMEOUT,
+                )
+            elif _pool is None:
+                _pool = FaceInferencePool(
+                    size=settings.FACE_POOL_SIZE,
+                    max_queue=settings.FACE_POOL_MAX_QUEUE,
+                    job_timeout=settings.FACE_POOL_JOB_TIMEOUT,
+                )
+    return _pool
+
+
+def get_detection_options():
+    return face_processing.resolve_detection_options(
+        settings.FACE_DETECTION_PRESET, settings.FACE_DETECTION
+    )
+
+
+def get_quality_thresholds():
+    return image_quality.resolve_thresholds(settings.FACE_QUALITY)
+
+
+def encode_face(image_bytes, face_box=None):
+    if not settings.FACE_ALLOW_CLIENT_BOX:
+        face_box = None
+    started = time.perf_counter()
+    try:
+        embedding, timings, memory = get_pool().run(
+            face_processing.encode_face_timed, image_bytes, get_detection_options(), face_box,
+            get_quality_thresholds(),
+        )
+    except image_quality.ImageRejected as e:
+        image_quality.record_rejection(e.reason)
+        raise
+
+    # O que não foi gasto nas etapas do worker é fila e transporte até o pool.
+    total = time.perf_counter() - started
+    for stage, seconds in timings.items():
+        metrics.observe_span(f'face.{stage}', seconds)
+    metrics.observe_span('face.pool_overhead', max(0.0, total - sum(timings.values())))
+    metrics.registry.observe('face_wallet_image_peak_bytes', memory['peak_bytes'], buckets=metrics.BYTE_BUCKETS,
+                             help="Pico dos buffers de imagem (upload, decodificada e cópia do detector) por requisição.")
+    metrics.registry.increment('face_wallet_image_decode_total', (('factor', memory['decode_factor']),),
+                               help="Imagens decodificadas por fator de redução (1 = resolução original).")
+    return embedding
+
+
+def encode_faces(images, face_boxes=None):
+    if not images:
+        return []
+    face_boxes = list(face_boxes) if face_boxes and settings.FACE_ALLOW_CLIENT_BOX else [None] * len(images)
+    options = get_detection_options()
+    quality = get_quality_thresholds()
+    pool = get_pool()
+    if pool.size <= 0:
+        return _count_rejections(face_processing.encode_faces(images, options, face_boxes, quality))
+
+    # Divide o lote em um job por worker para usar todos os processos.
+    chunk_size = -(-len(images) // pool.size)
+    chunks = [
+        (images[start:start + chunk_size], face_boxes[start:start + chunk_size])
+        for start in range(0, len(images), chunk_size)
+    ]
+    futures = [pool.submit(face_processing.encode_faces, chunk, options, boxes, quality) for chunk, boxes in chunks]
+
+    results = []
+    for (chunk, _), future in zip(chunks, futures):
+        results.extend(pool.result(future, timeout=pool.job_timeout * len(chunk)))
+    return _count_rejections(results)
+
+
+def _count_rejections(results):
+    for result in results:
+        if isinstance(result, image_quality.ImageRejected):
+            image_quality.record_rejection(result.reason)
+    return results
@@ -0,0 +1,262 @@
+"""
+Decodificação de imagens e extração de embeddings faciais.
+
+Este módulo é carregado dentro dos processos do pool de inferência
+(`users.face_pool`), por isso não depende do Django: tudo o que ele precisa
+chega como argumento de cada job.
+"""
+import struct
+import time
+
+import cv2
+import numpy as np
+
+face_recognition = None
+
+# Presets de detecção. `max_dimension` é o maior lado da cópia reduzida usada
+# pelo detector (None = resolução original); `upsample` é o
+# number_of_times_to_upsample do face_recognition; `landmarks` escolhe o
+# modelo de 5 ('small') ou 68 ('large') pontos usado no encoding.
+# `decode_dimension` é o menor "maior lado" aceitável ao decodificar JPEGs em
+# resolução reduzida (1/2, 1/4 ou 1/8, escolhida pelo cabeçalho); None
+# decodifica sempre na resolução original.
+DETECTION_PRESETS = {
+    'fast': {
+        'decode_dimension': 960,
+        'max_dimension': 480,
+        'model': 'hog',
+        'upsample': 0,
+        'num_jitters': 1,
+        'landmarks': 'small',
+    },
+    'balanced': {
+        'decode_dimension': 1280,
+        'max_dimension': 800,
+        'model': 'hog',
+        'upsample': 1,
+        'num_jitters': 1,
+        'landmarks': 'large',
+    },
+    'accurate': {
+        'decode_dimension': 2048,
+        'max_dimension': 1600,
+        'model': 'cnn',
+        'upsample': 1,
+        'num_jitters': 5,
+        'landmarks': 'large',
+    },
+}
+
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# Marcadores SOFn do JPEG (0xC4, 0xC8 e 0xCC têm outro significado).
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class FaceProcessingError(Exception):
+    pass
+
+
+class NoFaceDetected(FaceProcessingError):
+    pass
+
+
+def load_models():
+    # Importar face_recognition carrega os modelos do dlib (detector,
+    # landmarks e a rede de encoding). Cada worker faz isso uma única vez.
+    global face_recognition
+    if face_recognition is None:
+        import face_recognition as fr
+        face_recognition = fr
+
+
+def resolve_detection_options(preset='balanced', overrides=None):
+    if preset not in DETECTION_PRESETS:
+        raise ValueError(f"Preset de detecção desconhecido: {preset}")
+
+    options = dict(DETECTION_PRESETS[preset])
+    unknown = set(overrides or {}) - set(options)
+    if unknown:
+        raise ValueError(f"Opções de detecção desconhecidas: {', '.join(sorted(unknown))}")
+    options.update(overrides or {})
+
+    if options['model'] not in ('hog', 'cnn'):
+        raise ValueError("O modelo de detecção deve ser 'hog' ou 'cnn'.")
+    if options['landmarks'] not in ('small', 'large'):
+        raise ValueError("O modelo de landmarks deve ser 'small' ou 'large'.")
+    return options
+
+
+def image_header(image_bytes):
+    """
+    Lê formato e dimensões ('jpeg' | 'png', largura, altura) direto do
+    cabeçalho, sem decodificar a imagem. Devolve None se não reconhecer.
+    """
+    data = memoryview(image_bytes)
+    if data[:8] == _PNG_SIGNATURE and len(data) >= 24:
+        width, height = struct.unpack('>II', data[16:24])
+        return 'png', width, height
+
+    if data[:2] != b'\xff\xd8':
+        return None
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            position += 2
+            continue
+        (length,) = struct.unpack('>H', data[position + 2:position + 4])
+        if marker in _JPEG_SOF_MARKERS:
+            if position + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[position + 5:position + 9])
+            return 'jpeg', width, height
+        position += 2 + length
+    return None
+
+
+def reduction_factor(image_bytes, decode_dimension):
+    # O libjpeg decodifica direto em 1/2, 1/4 ou 1/8 da resolução pulando
+    # parte da IDCT: usa o maior fator que mantém o maior lado acima de
+    # `decode_dimension`.
+    header = image_header(image_bytes) if decode_dimension else None
+    if header is None or header[0] != 'jpeg':
+        return 1
+    longest = max(header[1], header[2])
+    for factor, _ in _REDUCED_DECODE_FLAGS:
+        if longest // factor >= decode_dimension:
+            return factor
+    return 1
+
+
+def decode_image(image_bytes, factor=1):
+    flag = dict(_REDUCED_DECODE_FLAGS).get(factor, cv2.IMREAD_COLOR)
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+    if img is None:
+        raise FaceProcessingError("Não foi possível decodificar a imagem enviada.")
+    # Converte no próprio buffer em vez de alocar uma segunda cópia.
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+
+
+def clamp_face_box(face_box, shape):
+    height, width = shape[:2]
+    top, right, bottom, left = face_box
+    top, bottom = max(0, min(top, height)), max(0, min(bottom, height))
+    left, right = max(0, min(left, width)), max(0, min(right, width))
+    if bottom <= top or right <= left:
+        raise FaceProcessingError("A região do rosto informada está fora da imagem.")
+    return top, right, bottom, left
+
+
+def locate_face(rgb_img, options, memory=None):
+    height, width = rgb_img.shape[:2]
+    max_dimension = options['max_dimension']
+
+    scale = 1.0
+    detection_img = rgb_img
+    if max_dimension and max(height, width) > max_dimension:
+        scale = max_dimension / max(height, width)
+        detection_img = cv2.resize(
+            rgb_img,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+        if memory is not None:
+            memory['detection_bytes'] = detection_img.nbytes
+
+    locations = face_recognition.face_locations(
+        detection_img,
+        number_of_times_to_upsample=options['upsample'],
+        model=options['model'],
+    )
+    if not locations:
+        raise NoFaceDetected("Nenhum rosto detectado na imagem.")
+
+    # Com mais de um rosto na foto, fica o maior (o mais próximo da câmera).
+    top, right, bottom, left = max(locations, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+    return clamp_face_box(
+        (round(top / scale), round(right / scale), round(bottom / scale), round(left / scale)),
+        rgb_img.shape,
+    )
+
+
+def encode_face(image_bytes, options=None, face_box=None, quality=None, timings=None, memory=None):
+    from .image_quality import assess
+
+    load_models()
+    options = options or resolve_detection_options()
+    clock = _StageClock(timings)
+
+    factor = reduction_factor(image_bytes, options.get('decode_dimension'))
+    rgb_img = decode_image(image_bytes, factor)
+    clock.lap('decode')
+    if memory is not None:
+        memory.update(decode_factor=factor, upload_bytes=len(image_bytes), decoded_bytes=rgb_img.nbytes)
+    assess(rgb_img, quality)
+    clock.lap('quality')
+
+    if face_box is not None:
+        # O face_box vem em pixels da imagem original.
+        face_box = clamp_face_box(tuple(round(value / factor) for value in face_box), rgb_img.shape)
+    else:
+        face_box = locate_face(rgb_img, options, memory)
+    clock.lap('detect')
+
+    face_encodings = face_recognition.face_encodings(
+        rgb_img,
+        known_face_locations=[face_box],
+        num_jitters=options['num_jitters'],
+        model=options['landmarks'],
+    )
+    clock.lap('encode')
+    if not face_encodings:
+        raise NoFaceDetected("Nenhum rosto detectado na imagem.")
+
+    return face_encodings[0]
+
+
+def encode_face_timed(image_bytes, options=None, face_box=None, quality=None):
+    # Variante usada pelo pool: devolve também a duração de cada etapa e o
+    # pico dos buffers de imagem, que o processo web registra nas métricas.
+    timings = {}
+    memory = {}
+    embedding = encode_face(image_bytes, options, face_box, quality, timings, memory)
+    # Upload, imagem decodificada e cópia reduzida do detector coexistem.
+    memory['peak_bytes'] = (
+        memory.get('upload_bytes', 0) + memory.get('decoded_bytes', 0) + memory.get('detection_bytes', 0)
+    )
+    return embedding, timings, memory
+
+
+class _StageClock:
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.perf_counter() if timings is not None else None
+
+    def lap(self, stage):
+        if self.timings is not None:
+            now = time.perf_counter()
+            self.timings[stage] = now - self.last
+            self.last = now
+
+
+def encode_faces(images, options=None, face_boxes=None, quality=None):
+    # Versão em lote: os erros de cada imagem são devolvidos no lugar do
+    # embedding para que uma foto ruim não derrube o lote inteiro.
+    face_boxes = face_boxes or [None] * len(images)
+    results = []
+    for image_bytes, face_box in zip(images, face_boxes):
+        try:
+            results.append(encode_face(image_bytes, options, face_box, quality))
+        except FaceProcessingError as e:
+            results.append(e)
+    return results
@@ -0,0 +1,78 @@
+"""
+Galeria de templates faciais por usuário.
+
+A verificação compara o rosto enviado com todos os templates do usuário (o
+embedding do cadastro mais até `FACE_GALLERY_MAX_TEMPLATES` adicionais) num
+único cálculo vetorizado e usa a menor distância.
+
+Depois de uma verificação com alta confiança, o embedding recém-calculado
+pode entrar na galeria, cobrindo variações de iluminação, óculos ou idade
+sem exigir um novo cadastro. Só entram embeddings que também casam com o
+template do cadastro (que nunca é descartado) e que não são quase iguais a
+um template existente. Com a galeria cheia, sai o template usado há mais
+tempo.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def distances_to(gallery, embedding):
+    return np.linalg.norm(gallery.matrix - np.asarray(embedding, dtype=np.float32), axis=1)
+
+
+def best_distances(galleries, embeddings):
+    """
+    Menor distância de cada embedding à galeria correspondente, calculada
+    para o lote inteiro de uma vez, mesmo com galerias de tamanhos
+    diferentes.
+    """
+    if not galleries:
+        return np.empty(0, dtype=np.float32)
+    sizes = np.array([len(gallery.template_ids) for gallery in galleries])
+    stored = np.vstack([gallery.matrix for gallery in galleries])
+    queries = np.repeat(np.vstack(embeddings).astype(np.float32), sizes, axis=0)
+    distances = np.linalg.norm(stored - queries, axis=1)
+    return np.minimum.reduceat(distances, np.concatenate([[0], np.cumsum(sizes)[:-1]]))
+
+
+def add_template(user_id, embedding, source=None):
+    from .models import FaceTemplate
+
+    template = FaceTemplate(user_id=user_id, source=source or FaceTemplate.SOURCE_VERIFICATION)
+    template.set_embedding(embedding)
+    with transaction.atomic():
+        template.save()
+        evicted = (
+            FaceTemplate.objects.filter(user_id=user_id)
+            .order_by(Coalesce('last_matched_at', 'created_at').desc(), '-pk')
+            .values_list('pk', flat=True)[settings.FACE_GALLERY_MAX_TEMPLATES:]
+        )
+        evicted = list(evicted)
+        if evicted:
+            # Um delete por instância para que os sinais invalidem o cache.
+            for stale in FaceTemplate.objects.filter(pk__in=evicted):
+                stale.delete()
+    return template
+
+
+def learn_from_match(user_id, gallery, embedding, distances):
+    from .models import FaceTemplate
+
+    best = int(np.argmin(distances))
+    template_id = gallery.template_ids[best]
+    if template_id is not None:
+        # update() não dispara sinais: a galeria em cache continua válida.
+        FaceTemplate.objects.filter(pk=template_id).update(last_matched_at=timezone.now())
+
+    if (
+        settings.FACE_GALLERY_AUTO_ADD
+        and settings.FACE_GALLERY_MAX_TEMPLATES > 0
+        and distances[0] <= settings.FACE_MATCH_TOLERANCE
+        and settings.FACE_GALLERY_MIN_NOVELTY <= distances[best] <= settings.FACE_GALLERY_ADD_DISTANCE
+    ):
+        add_template(user_id, embedding)
+        return True
+    return False
@@ -0,0 +1,115 @@
+"""
+Triagem barata da imagem antes do encoder facial.
+
+Roda numa cópia em tons de cinza reduzida (`analysis_dimension`) e custa
+poucos milissegundos: resolução mínima, nitidez (variância do Laplaciano),
+exposição (brilho médio e fração de pixels estourados) e, opcionalmente,
+presença de rosto pelo classificador Haar do OpenCV. Imagens reprovadas são
+rejeitadas com um código de motivo antes de chegar ao face_recognition.
+
+Assim como `face_processing`, este módulo roda dentro dos workers do pool e
+não depende do Django; a contagem de rejeições fica no processo web
+(`record_rejection`).
+"""
+import threading
+from collections import Counter
+
+import cv2
+
+from .face_processing import FaceProcessingError
+
+DEFAULT_THRESHOLDS = {
+    'enabled': True,
+    'analysis_dimension': 256,
+    'min_width': 160,
+    'min_height': 160,
+    'min_sharpness': 25.0,
+    'min_brightness': 40.0,
+    'max_brightness': 215.0,
+    'max_clipped_fraction': 0.5,
+    'face_cascade': False,
+}
+
+_cascade = None
+_rejections = Counter()
+_rejections_lock = threading.Lock()
+
+
+class ImageRejected(FaceProcessingError):
+    def __init__(self, reason, message):
+        super().__init__(reason, message)
+        self.reason = reason
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def resolve_thresholds(overrides=None):
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    unknown = set(overrides or {}) - set(thresholds)
+    if unknown:
+        raise ValueError(f"Limites de qualidade desconhecidos: {', '.join(sorted(unknown))}")
+    thresholds.update(overrides or {})
+    return thresholds
+
+
+def _face_cascade():
+    global _cascade
+    if _cascade is None:
+        _cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return _cascade
+
+
+def assess(rgb_img, thresholds=None):
+    """
+    Levanta ImageRejected se a imagem não passar na triagem; caso contrário
+    devolve as métricas calculadas.
+    """
+    thresholds = thresholds or DEFAULT_THRESHOLDS
+    if not thresholds['enabled']:
+        return {}
+
+    height, width = rgb_img.shape[:2]
+    if width < thresholds['min_width'] or height < thresholds['min_height']:
+        raise ImageRejected('too_small', "A imagem tem resolução baixa demais.")
+
+    scale = thresholds['analysis_dimension'] / max(height, width)
+    small = rgb_img
+    if scale < 1:
+        small = cv2.resize(rgb_img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+    histogram = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel() / gray.size
+    metrics = {
+        'sharpness': float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        'brightness': float(gray.mean()),
+        'clipped_fraction': float(histogram[:6].sum() + histogram[250:].sum()),
+    }
+
+    if metrics['brightness'] < thresholds['min_brightness']:
+        raise ImageRejected('too_dark', "A imagem está escura demais.")
+    if metrics['brightness'] > thresholds['max_brightness']:
+        raise ImageRejected('too_bright', "A imagem está clara demais.")
+    if metrics['clipped_fraction'] > thresholds['max_clipped_fraction']:
+        raise ImageRejected('bad_exposure', "A exposição da imagem está estourada.")
+    if metrics['sharpness'] < thresholds['min_sharpness']:
+        raise ImageRejected('blurry', "A imagem está desfocada.")
+
+    if thresholds['face_cascade']:
+        faces = _face_cascade().detectMultiScale(gray, scaleFactor=1.2, minNeighbors=4, minSize=(24, 24))
+        if len(faces) == 0:
+            raise ImageRejected('no_face', "Nenhum rosto detectado na imagem.")
+
+    return metrics
+
+
+def record_rejection(reason):
+    with _rejections_lock:
+        _rejections[reason] += 1
+
+
+def rejection_counts():
+    with _rejections_lock:
+        return dict(_rejections)
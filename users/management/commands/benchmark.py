@@ -0,0 +1,268 @@
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cards.models import Card
+from cards.serializers import CardSerializer
+from users import face_processing, image_quality
+from users.embeddings import pack_embedding, unpack_embedding
+from users.face_index import EmbeddingIndex
+from users.face_pool import get_detection_options, get_quality_thresholds
+
+STAGES = (
+    'decode', 'quality', 'detect', 'encode',
+    'embedding_pack', 'embedding_unpack', 'compare_faces', 'index_search',
+    'card_seal', 'card_open', 'card_serializer',
+)
+
+
+def synthetic_face(width, height, rng):
+    """
+    Imagem sintética com um "rosto" (oval com olhos, nariz e boca) sobre um
+    fundo com ruído. Não precisa ser reconhecida pelo detector: serve para
+    medir decodificação, detecção e encoding com dados reproduzíveis.
+    """
+    background = rng.integers(60, 200, size=(height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+    img = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = cv2.GaussianBlur(img, (0, 0), 3)
+
+    cx, cy = width // 2, height // 2
+    face_w, face_h = max(8, width // 6), max(10, height // 4)
+    cv2.ellipse(img, (cx, cy), (face_w, face_h), 0, 0, 360, (120, 150, 200), -1)
+    eye_dx, eye_dy = face_w // 2, face_h // 4
+    for side in (-1, 1):
+        cv2.ellipse(img, (cx + side * eye_dx, cy - eye_dy), (max(2, face_w // 6), max(1, face_h // 12)),
+                    0, 0, 360, (250, 250, 250), -1)
+        cv2.circle(img, (cx + side * eye_dx, cy - eye_dy), max(1, face_w // 14), (40, 30, 30), -1)
+    cv2.line(img, (cx, cy - eye_dy // 2), (cx, cy + face_h // 5), (90, 110, 160), max(1, width // 400))
+    cv2.ellipse(img, (cx, cy + face_h // 2), (face_w // 3, face_h // 10), 0, 0, 180, (60, 60, 150), -1)
+
+    noise = rng.normal(0, 6, size=img.shape)
+    img = np.clip(img + noise, 0, 255).astype(np.uint8)
+    face_box = (cy - face_h, cx + face_w, cy + face_h, cx - face_w)
+    return img, face_box
+
+
+def summarize(samples):
+    samples_ms = sorted(ns / 1e6 for ns in samples)
+    return {
+        'runs': len(samples_ms),
+        'mean_ms': round(statistics.fmean(samples_ms), 4),
+        'median_ms': round(statistics.median(samples_ms), 4),
+        'p95_ms': round(samples_ms[min(len(samples_ms) - 1, int(len(samples_ms) * 0.95))], 4),
+        'min_ms': round(samples_ms[0], 4),
+        'max_ms': round(samples_ms[-1], 4),
+        'stdev_ms': round(statistics.stdev(samples_ms), 4) if len(samples_ms) > 1 else 0.0,
+    }
+
+
+def measure(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - started)
+    return summarize(samples)
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede separadamente cada etapa da biometria e da criptografia dos cartões "
+        "com dados sintéticos e reproduzíveis, e emite o resultado em JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help="Execuções medidas por etapa.")
+        parser.add_argument('--warmup', type=int, default=2, help="Execuções descartadas antes de medir.")
+        parser.add_argument('--resolutions', default='640x480,1280x720,1920x1080',
+                            help="Resoluções das imagens sintéticas (LARGURAxALTURA, separadas por vírgula).")
+        parser.add_argument('--image', action='append', default=[],
+                            help="Imagem real adicional para as etapas de imagem (pode repetir).")
+        parser.add_argument('--gallery-size', type=int, default=10000,
+                            help="Embeddings sintéticos usados em compare_faces e na busca 1:N.")
+        parser.add_argument('--stages', default=','.join(STAGES), help="Etapas a executar.")
+        parser.add_argument('--seed', type=int, default=1234)
+        parser.add_argument('--output', default=None, help="Arquivo de saída (padrão: stdout).")
+
+    def handle(self, *args, **options):
+        stages = [stage.strip() for stage in options['stages'].split(',') if stage.strip()]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise CommandError(f"Etapas desconhecidas: {', '.join(sorted(unknown))}")
+
+        self.iterations = options['iterations']
+        self.warmup = options['warmup']
+        self.stages = stages
+        rng = np.random.default_rng(options['seed'])
+
+        report = {
+            'environment': {
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'numpy': np.__version__,
+                'opencv': cv2.__version__,
+                'detection_preset': settings.FACE_DETECTION_PRESET,
+                'embedding_dtype': settings.FACE_EMBEDDING_DTYPE,
+            },
+            'parameters': {
+                'iterations': self.iterations,
+                'warmup': self.warmup,
+                'seed': options['seed'],
+                'gallery_size': options['gallery_size'],
+            },
+            'images': self._image_stages(self._fixtures(options, rng)),
+            'embeddings': self._embedding_stages(rng, options['gallery_size']),
+            'cards': self._card_stages(rng),
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+            self.stderr.write(f"Resultado gravado em {options['output']}.")
+        else:
+            self.stdout.write(output)
+
+    def _fixtures(self, options, rng):
+        fixtures = []
+        for resolution in options['resolutions'].split(','):
+            try:
+                width, height = (int(value) for value in resolution.lower().split('x'))
+            except ValueError:
+                raise CommandError(f"Resolução inválida: {resolution}")
+            img, face_box = synthetic_face(width, height, rng)
+            ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            fixtures.append((f'synthetic_{width}x{height}', encoded.tobytes(), face_box))
+
+        for path in options['image']:
+            with open(path, 'rb') as fh:
+                fixtures.append((os.path.basename(path), fh.read(), None))
+        return fixtures
+
+    def _image_stages(self, fixtures):
+        wanted = {'decode', 'quality', 'detect', 'encode'} & set(self.stages)
+        if not wanted:
+            return {}
+
+        face_processing.load_models()
+        options = get_detection_options()
+        thresholds = get_quality_thresholds()
+        results = {}
+        for name, image_bytes, face_box in fixtures:
+            factor = face_processing.reduction_factor(image_bytes, options.get('decode_dimension'))
+            rgb_img = face_processing.decode_image(image_bytes, factor)
+            entry = {'width': rgb_img.shape[1], 'height': rgb_img.shape[0], 'bytes': len(image_bytes),
+                     'decode_factor': factor}
+            if face_box is not None:
+                face_box = tuple(round(value / factor) for value in face_box)
+
+            if 'decode' in wanted:
+                entry['decode'] = measure(lambda: face_processing.decode_image(image_bytes, factor),
+                                          self.iterations, self.warmup)
+
+            if 'quality' in wanted:
+                try:
+                    image_quality.assess(rgb_img, thresholds)
+                    entry['quality_reason'] = None
+                except image_quality.ImageRejected as e:
+                    entry['quality_reason'] = e.reason
+                entry['quality'] = measure(lambda: self._assess(rgb_img, thresholds), self.iterations, self.warmup)
+
+            if 'detect' in wanted or ('encode' in wanted and face_box is None):
+                try:
+                    detected_box = face_processing.locate_face(rgb_img, options)
+                except face_processing.NoFaceDetected:
+                    detected_box = None
+                entry['face_detected'] = detected_box is not None
+                face_box = detected_box or face_box
+                if 'detect' in wanted:
+                    entry['detect'] = measure(lambda: self._locate(rgb_img, options), self.iterations, self.warmup)
+
+            # O encoding usa a caixa conhecida para ser medido mesmo quando o
+            # detector não acha o rosto sintético.
+            if 'encode' in wanted and face_box is not None:
+                entry['encode'] = measure(
+                    lambda: face_processing.face_recognition.face_encodings(
+                        rgb_img,
+                        known_face_locations=[face_box],
+                        num_jitters=options['num_jitters'],
+                        model=options['landmarks'],
+                    ),
+                    self.iterations, self.warmup,
+                )
+            results[name] = entry
+        return results
+
+    def _assess(self, rgb_img, thresholds):
+        try:
+            image_quality.assess(rgb_img, thresholds)
+        except image_quality.ImageRejected:
+            pass
+
+    def _locate(self, rgb_img, options):
+        try:
+            face_processing.locate_face(rgb_img, options)
+        except face_processing.NoFaceDetected:
+            pass
+
+    def _embedding_stages(self, rng, gallery_size):
+        gallery = rng.normal(0, 0.1, size=(gallery_size, 128)).astype(np.float32)
+        query = gallery[0] + rng.normal(0, 0.01, size=128).astype(np.float32)
+        packed = pack_embedding(query, settings.FACE_EMBEDDING_DTYPE)
+        results = {}
+
+        if 'embedding_pack' in self.stages:
+            results['embedding_pack'] = measure(
+                lambda: pack_embedding(query, settings.FACE_EMBEDDING_DTYPE), self.iterations, self.warmup
+            )
+        if 'embedding_unpack' in self.stages:
+            results['embedding_unpack'] = measure(lambda: unpack_embedding(packed), self.iterations, self.warmup)
+
+        if 'compare_faces' in self.stages:
+            face_processing.load_models()
+            compare_faces = face_processing.face_recognition.compare_faces
+            tolerance = settings.FACE_MATCH_TOLERANCE
+            results['compare_faces_1'] = measure(
+                lambda: compare_faces([gallery[0]], query, tolerance=tolerance), self.iterations, self.warmup
+            )
+            results[f'compare_faces_{gallery_size}'] = measure(
+                lambda: compare_faces(gallery, query, tolerance=tolerance), self.iterations, self.warmup
+            )
+
+        if 'index_search' in self.stages:
+            index = EmbeddingIndex(np.arange(gallery_size, dtype=np.int64), gallery)
+            results[f'index_search_{gallery_size}'] = measure(
+                lambda: index.search(query, k=5), self.iterations, self.warmup
+            )
+        return results
+
+    def _card_stages(self, rng):
+        values = {
+            'card_holder_name': 'FULANO DE TAL',
+            'card_number': ''.join(str(digit) for digit in rng.integers(0, 10, size=16)),
+            'expiry_date': '12/30',
+            'cvv': ''.join(str(digit) for digit in rng.integers(0, 10, size=3)),
+        }
+        # Cartão fora do banco: mede só a cifragem e a serialização.
+        card = Card(pk=1, user_id=1)
+        card.seal(values)
+        results = {}
+
+        if 'card_seal' in self.stages:
+            results['card_seal'] = measure(lambda: card.seal(values), self.iterations, self.warmup)
+        if 'card_open' in self.stages:
+            results['card_open'] = measure(card.open, self.iterations, self.warmup)
+        if 'card_serializer' in self.stages:
+            results['card_serializer'] = measure(lambda: CardSerializer(card).data, self.iterations, self.warmup)
+        return results
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users import face_index
+
+
+class Command(BaseCommand):
+    help = "Gera o snapshot em disco do índice de embeddings faciais (FACE_INDEX_PATH)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help="Diretório do snapshot (padrão: FACE_INDEX_PATH).")
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.FACE_INDEX_PATH
+        if not path:
+            raise CommandError("Informe --path ou configure FACE_INDEX_PATH.")
+
+        count = face_index.write_snapshot(path)
+        face_index.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Snapshot com {count} embeddings gravado em {path}."))
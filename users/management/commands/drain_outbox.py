@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users import outbox
+
+
+class Command(BaseCommand):
+    help = "Entrega as mensagens pendentes do outbox à Evolution API."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Processa o que estiver vencido e encerra.")
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--concurrency', type=int, default=settings.OUTBOX_CONCURRENCY)
+        parser.add_argument('--interval', type=float, default=settings.OUTBOX_POLL_INTERVAL,
+                            help="Segundos de espera quando não há mensagens.")
+
+    def handle(self, *args, **options):
+        client = outbox.EvolutionClient(pool_size=options['concurrency'])
+        try:
+            while True:
+                processed = outbox.drain(client, options['batch_size'], options['concurrency'])
+                if processed:
+                    self.stdout.write(f"{processed} mensagem(ns) processada(s).")
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            client.close()
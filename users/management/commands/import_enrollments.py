@@ -0,0 +1,284 @@
+import csv
+import itertools
+import json
+import os
+import tarfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from users import face_index, face_processing, otp
+from users.embeddings import pack_embedding
+from users.face_pool import FaceInferencePool, get_detection_options, get_quality_thresholds
+from users.models import Profile
+from users.outbox import enqueue_messages
+from users.services import verification_message
+
+REQUIRED_FIELDS = ('username', 'email', 'phone_number', 'image')
+
+
+class ImageSource:
+    """Lê as imagens de um diretório ou de um arquivo tar (compactado ou não)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._tar = None
+        self._members = None
+        if os.path.isfile(path) and tarfile.is_tarfile(path):
+            self._tar = tarfile.open(path, 'r:*')
+            self._members = {
+                os.path.normpath(member.name): member for member in self._tar.getmembers() if member.isfile()
+            }
+        elif not os.path.isdir(path):
+            raise CommandError(f"{path} não é um diretório nem um arquivo tar.")
+
+    def read(self, name):
+        name = os.path.normpath(name)
+        if self._tar is not None:
+            member = self._members.get(name)
+            if member is None:
+                return None
+            return self._tar.extractfile(member).read()
+
+        full_path = os.path.join(self.path, name)
+        if not os.path.abspath(full_path).startswith(os.path.abspath(self.path) + os.sep):
+            return None
+        try:
+            with open(full_path, 'rb') as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+
+
+def read_records(path, fmt):
+    with open(path, newline='', encoding='utf-8') as fh:
+        if fmt == 'csv':
+            yield from csv.DictReader(fh)
+        else:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa usuários com rosto em massa a partir de um CSV/JSONL e de um diretório "
+        "ou arquivo tar de imagens, sem enviar códigos pelo WhatsApp (a não ser com --send-codes)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('records', help="Arquivo .csv ou .jsonl com username, email, phone_number e image.")
+        parser.add_argument('images', help="Diretório ou arquivo tar com as imagens referenciadas em `image`.")
+        parser.add_argument('--format', choices=('csv', 'jsonl'), default=None,
+                            help="Formato dos registros (padrão: pela extensão do arquivo).")
+        parser.add_argument('--batch-size', type=int, default=500, help="Registros gravados por transação.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Processos usados para calcular os embeddings.")
+        parser.add_argument('--checkpoint', default=None,
+                            help="Arquivo com o número de registros já processados; a importação retoma dele.")
+        parser.add_argument('--errors', default=None, help="Grava os registros rejeitados (JSONL) neste arquivo.")
+        parser.add_argument('--phone-verified', action='store_true',
+                            help="Marca os telefones como já verificados pelo parceiro.")
+        parser.add_argument('--send-codes', action='store_true',
+                            help="Envia pelo outbox o código de verificação do telefone a cada usuário importado "
+                                 "sem --phone-verified.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--workers e --batch-size devem ser maiores que zero.")
+        fmt = options['format'] or ('csv' if options['records'].lower().endswith('.csv') else 'jsonl')
+        self.phone_verified = options['phone_verified']
+        self.send_codes = options['send_codes'] and not self.phone_verified
+        self.detection_options = get_detection_options()
+        self.quality = get_quality_thresholds()
+        self.errors_file = open(options['errors'], 'a', encoding='utf-8') if options['errors'] else None
+        self.counts = {'created': 0, 'skipped': 0, 'failed': 0}
+
+        checkpoint = options['checkpoint']
+        done = self._read_checkpoint(checkpoint)
+        if done:
+            self.stdout.write(f"Retomando após {done} registro(s).")
+
+        source = ImageSource(options['images'])
+        pool = FaceInferencePool(size=options['workers'], max_queue=options['workers'],
+                                 job_timeout=settings.FACE_POOL_JOB_TIMEOUT)
+        records = itertools.islice(enumerate(read_records(options['records'], fmt)), done, None)
+        batches = iter(lambda: list(itertools.islice(records, options['batch_size'])), [])
+
+        started = time.monotonic()
+        try:
+            # Os embeddings do próximo lote são calculados enquanto o lote
+            # atual é gravado no banco.
+            pending = self._submit(pool, source, next(batches, []))
+            while pending is not None:
+                upcoming = self._submit(pool, source, next(batches, []))
+                last_index = self._write(pool, pending)
+                self._write_checkpoint(checkpoint, last_index + 1)
+                self._progress(started)
+                pending = upcoming
+        finally:
+            pool.shutdown()
+            source.close()
+            if self.errors_file is not None:
+                self.errors_file.close()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.counts['created']} usuário(s) criado(s), {self.counts['skipped']} já existente(s), "
+            f"{self.counts['failed']} rejeitado(s) em {elapsed:.1f}s."
+        ))
+
+    def _submit(self, pool, source, batch):
+        if not batch:
+            return None
+
+        accepted = []
+        for index, record in batch:
+            missing = [field for field in REQUIRED_FIELDS if not record.get(field)]
+            if missing:
+                self._reject(index, record, f"Campos obrigatórios ausentes: {', '.join(missing)}.")
+                continue
+            if not self.phone_verified and not self.send_codes and self._password_hash(record) is None:
+                # Sem hash, sem telefone verificado e sem código, a conta não
+                # teria como entrar nem como definir uma senha.
+                self._reject(index, record, "Sem password_hash válido, exige --phone-verified ou --send-codes.")
+                continue
+            image_bytes = source.read(record['image'])
+            if image_bytes is None:
+                self._reject(index, record, "Imagem não encontrada.")
+                continue
+            accepted.append((index, record, image_bytes))
+
+        chunk_size = max(1, -(-len(accepted) // pool.size))
+        futures = []
+        for start in range(0, len(accepted), chunk_size):
+            chunk = accepted[start:start + chunk_size]
+            future = pool.submit(
+                face_processing.encode_faces, [image for _, _, image in chunk],
+                self.detection_options, None, self.quality,
+            )
+            futures.append((chunk, future))
+        return batch[-1][0], futures
+
+    def _write(self, pool, pending):
+        last_index, futures = pending
+        rows = []
+        for chunk, future in futures:
+            embeddings = pool.result(future, timeout=pool.job_timeout * len(chunk))
+            for (index, record, _), embedding in zip(chunk, embeddings):
+                if isinstance(embedding, Exception):
+                    self._reject(index, record, str(embedding))
+                else:
+                    rows.append((index, record, embedding))
+
+        with transaction.atomic():
+            existing_usernames = set(User.objects.filter(
+                username__in=[record['username'] for _, record, _ in rows]
+            ).values_list('username', flat=True))
+            existing_emails = set(User.objects.filter(
+                email__in=[record['email'] for _, record, _ in rows]
+            ).values_list('email', flat=True))
+
+            new_rows = []
+            for index, record, embedding in rows:
+                if record['username'] in existing_usernames or record['email'] in existing_emails:
+                    self.counts['skipped'] += 1
+                    continue
+                existing_usernames.add(record['username'])
+                existing_emails.add(record['email'])
+                new_rows.append((record, embedding))
+
+            users = User.objects.bulk_create([
+                User(
+                    username=record['username'],
+                    email=record['email'],
+                    first_name=record.get('first_name') or '',
+                    last_name=record.get('last_name') or '',
+                    password=self._password(record),
+                )
+                for record, _ in new_rows
+            ])
+            if any(user.pk is None for user in users):
+                # Bancos sem RETURNING no INSERT (MySQL) não devolvem as
+                # chaves criadas pelo bulk_create.
+                created = dict(User.objects.filter(
+                    username__in=[user.username for user in users]
+                ).values_list('username', 'pk'))
+                for user in users:
+                    user.pk = created[user.username]
+            Profile.objects.bulk_create([
+                Profile(
+                    user=user,
+                    phone_number=record['phone_number'],
+                    is_phone_verified=self.phone_verified,
+                    face_embedding=pack_embedding(embedding, settings.FACE_EMBEDDING_DTYPE),
+                )
+                for user, (record, embedding) in zip(users, new_rows)
+            ])
+            if self.send_codes:
+                codes = {user: otp.generate_code() for user in users}
+                enqueue_messages([
+                    (record['phone_number'], verification_message(user, codes[user]))
+                    for user, (record, _) in zip(users, new_rows)
+                ])
+                otp.issue_many(otp.PHONE_VERIFICATION, codes)
+            # bulk_create não dispara os sinais de Profile. Publicado a cada
+            # lote gravado, para que uma importação interrompida não deixe
+            # usuários de fora do índice 1:N dos outros workers.
+            face_index.invalidate()
+        self.counts['created'] += len(new_rows)
+        return last_index
+
+    def _password_hash(self, record):
+        password_hash = record.get('password_hash')
+        if password_hash:
+            try:
+                identify_hasher(password_hash)
+                return password_hash
+            except ValueError:
+                pass
+        return None
+
+    def _password(self, record):
+        # Senhas em claro não são aceitas: ou o parceiro envia o hash no
+        # formato do Django, ou o usuário define a senha pelo fluxo de
+        # recuperação.
+        return self._password_hash(record) or make_password(None)
+
+    def _reject(self, index, record, reason):
+        self.counts['failed'] += 1
+        if self.errors_file is not None:
+            self.errors_file.write(json.dumps(
+                {'record': index, 'username': record.get('username'), 'reason': reason}, ensure_ascii=False
+            ) + '\n')
+
+    def _progress(self, started):
+        elapsed = time.monotonic() - started
+        processed = sum(self.counts.values())
+        self.stdout.write(
+            f"{processed} registro(s) processado(s) ({processed / elapsed:.1f}/s): "
+            f"{self.counts['created']} criado(s), {self.counts['skipped']} já existente(s), "
+            f"{self.counts['failed']} rejeitado(s)."
+        )
+
+    def _read_checkpoint(self, path):
+        if path and os.path.exists(path):
+            with open(path) as fh:
+                return int(fh.read().strip() or 0)
+        return 0
+
+    def _write_checkpoint(self, path, done):
+        if not path:
+            return
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as fh:
+            fh.write(str(done))
+        os.replace(tmp_path, path)
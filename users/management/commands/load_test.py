@@ -0,0 +1,217 @@
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from users.evolution_stub import CODE_PATTERN, EvolutionStub
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = Counter()
+
+    def add(self, endpoint, elapsed, status):
+        with self._lock:
+            self.latencies[endpoint].append(elapsed)
+            self.statuses[endpoint][status] += 1
+            if not isinstance(status, int) or status >= 400:
+                self.errors[endpoint] += 1
+
+    def report(self, wall_time):
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            endpoints[endpoint] = {
+                'requests': len(values),
+                'errors': self.errors[endpoint],
+                'statuses': {str(status): count for status, count in self.statuses[endpoint].items()},
+                'throughput_rps': round(len(values) / wall_time, 2) if wall_time else None,
+                'mean_ms': round(1000 * sum(values) / len(values), 2),
+                'p50_ms': round(1000 * percentile(values, 0.50), 2),
+                'p95_ms': round(1000 * percentile(values, 0.95), 2),
+                'p99_ms': round(1000 * percentile(values, 0.99), 2),
+                'max_ms': round(1000 * values[-1], 2),
+            }
+        return endpoints
+
+
+class ScenarioFailed(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera carga contra um servidor em execução percorrendo o fluxo completo "
+        "(cadastro → verificação do telefone → login → verificação facial → cartões) "
+        "e reporta vazão e latências p50/p95/p99 por endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--face-image', required=True,
+                            help="Foto com um rosto, usada no cadastro e na verificação facial.")
+        parser.add_argument('--users', type=int, default=20, help="Número de cenários (usuários novos).")
+        parser.add_argument('--concurrency', type=int, default=4, help="Cenários executados em paralelo.")
+        parser.add_argument('--cards', type=int, default=2, help="Cartões cadastrados por usuário.")
+        parser.add_argument('--stub-url', default=None,
+                            help="URL de uma Evolution API falsa já em execução (run_evolution_stub). "
+                                 "Sem ela, o comando sobe a sua própria em --stub-port.")
+        parser.add_argument('--stub-host', default='127.0.0.1')
+        parser.add_argument('--stub-port', type=int, default=8081)
+        parser.add_argument('--stub-api-key', default='stub-key')
+        parser.add_argument('--stub-instance', default='stub')
+        parser.add_argument('--code-timeout', type=float, default=30.0,
+                            help="Tempo máximo de espera pelo código do WhatsApp, em segundos.")
+        parser.add_argument('--timeout', type=float, default=60.0, help="Timeout de cada requisição HTTP.")
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--output', default=None, help="Grava o relatório JSON neste arquivo.")
+
+    def handle(self, *args, **options):
+        with open(options['face_image'], 'rb') as fh:
+            self.face_image = fh.read()
+
+        self.base_url = options['base_url'].rstrip('/')
+        self.timeout = options['timeout']
+        self.code_timeout = options['code_timeout']
+        self.cards = options['cards']
+        self.recorder = Recorder()
+        self.random = random.Random(options['seed'])
+        self.run_id = uuid.uuid4().hex[:8]
+
+        stub = None
+        if options['stub_url']:
+            self.stub_url = options['stub_url'].rstrip('/')
+        else:
+            try:
+                stub = EvolutionStub(
+                    options['stub_host'], options['stub_port'], options['stub_api_key'], options['stub_instance']
+                ).start()
+            except OSError as e:
+                raise CommandError(f"Não foi possível subir a Evolution API falsa: {e}")
+            self.stub_url = stub.url
+        self.stub = stub
+        self.stdout.write(
+            f"Evolution API falsa em {self.stub_url}; o servidor precisa de EVOLUTION_API_URL={self.stub_url}, "
+            f"EVOLUTION_API_KEY={options['stub_api_key']}, EVOLUTION_INSTANCE_NAME={options['stub_instance']} "
+            "e de um drain_outbox em execução."
+        )
+
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                outcomes = list(executor.map(self._scenario, range(options['users'])))
+        finally:
+            if stub is not None:
+                stub.stop()
+        wall_time = time.monotonic() - started
+
+        failures = Counter(outcome for outcome in outcomes if outcome)
+        report = {
+            'base_url': self.base_url,
+            'users': options['users'],
+            'concurrency': options['concurrency'],
+            'wall_time_s': round(wall_time, 2),
+            'scenarios_completed': outcomes.count(None),
+            'scenarios_failed': dict(failures),
+            'endpoints': self.recorder.report(wall_time),
+        }
+
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+        self.stdout.write(output)
+
+    def _request(self, session, endpoint, method, path, expected, **kwargs):
+        started = time.monotonic()
+        try:
+            response = session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.recorder.add(endpoint, time.monotonic() - started, type(e).__name__)
+            raise ScenarioFailed(endpoint)
+        self.recorder.add(endpoint, time.monotonic() - started, response.status_code)
+        if response.status_code != expected:
+            raise ScenarioFailed(endpoint)
+        return response
+
+    def _wait_for_code(self, session, phone_number):
+        # Tempo entre o fim do cadastro e a chegada do código à Evolution API
+        # (inclui a fila do outbox); entra no relatório como "whatsapp_delivery".
+        started = time.monotonic()
+        while time.monotonic() - started < self.code_timeout:
+            if self.stub is not None:
+                code = self.stub.last_code(phone_number)
+            else:
+                response = session.get(f"{self.stub_url}/messages", params={'number': phone_number}, timeout=5)
+                matches = [CODE_PATTERN.search(message['text']) for message in response.json()]
+                code = next((match.group(1) for match in reversed(matches) if match), None)
+            if code:
+                self.recorder.add('whatsapp_delivery', time.monotonic() - started, 200)
+                return code
+            time.sleep(0.1)
+        self.recorder.add('whatsapp_delivery', time.monotonic() - started, 'Timeout')
+        raise ScenarioFailed('whatsapp_delivery')
+
+    def _card_number(self):
+        digits = [self.random.randint(0, 9) for _ in range(15)]
+        # Dígito verificador de Luhn, para que o número pareça um cartão real.
+        total = sum(d if i % 2 else sum(divmod(d * 2, 10)) for i, d in enumerate(reversed(digits)))
+        return ''.join(map(str, digits)) + str((10 - total % 10) % 10)
+
+    def _scenario(self, number):
+        username = f"load_{self.run_id}_{number}"
+        password = f"Carga-{self.run_id}-{number}!"
+        phone_number = f"5511{int(self.run_id, 16) % 10000:04d}{number:05d}"
+
+        session = requests.Session()
+        try:
+            self._request(session, 'register', 'POST', '/api/auth/register/', 201, data={
+                'username': username,
+                'password': password,
+                'email': f"{username}@example.com",
+                'first_name': 'Carga',
+                'last_name': str(number),
+                'phone_number': phone_number,
+            }, files={'face_image': ('face.jpg', self.face_image, 'image/jpeg')})
+
+            code = self._wait_for_code(session, phone_number)
+            self._request(session, 'verify_phone', 'POST', '/api/auth/verify-phone/', 200,
+                          json={'username': username, 'code': code})
+
+            token = self._request(session, 'login', 'POST', '/api/auth/login/', 200,
+                                  data={'username': username, 'password': password}).json()['token']
+            session.headers['Authorization'] = f"Token {token}"
+
+            self._request(session, 'verify_face', 'POST', '/api/auth/verify-face/', 200,
+                          files={'face_image': ('face.jpg', self.face_image, 'image/jpeg')})
+
+            for _ in range(self.cards):
+                self._request(session, 'create_card', 'POST', '/api/cards/', 201, json={
+                    'card_holder_name': f"CARGA {number}",
+                    'card_number': self._card_number(),
+                    'expiry_date': '12/30',
+                    'cvv': f"{self.random.randint(0, 999):03d}",
+                })
+            self._request(session, 'list_cards', 'GET', '/api/cards/', 200)
+        except ScenarioFailed as e:
+            return str(e)
+        finally:
+            session.close()
+        return None
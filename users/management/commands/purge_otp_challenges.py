@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from users import otp, outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Apaga os códigos de verificação vencidos e as mensagens do outbox mais antigas que a validade "
+        "dos códigos. Agende a execução periódica (ex.: cron a cada hora)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Linhas apagadas por DELETE.")
+
+    def handle(self, *args, **options):
+        deleted = otp.purge_expired(options['batch_size'])
+        self.stdout.write(f"{deleted} código(s) vencido(s) apagado(s).")
+        deleted = outbox.purge(options['batch_size'])
+        self.stdout.write(f"{deleted} mensagem(ns) antiga(s) do outbox apagada(s).")
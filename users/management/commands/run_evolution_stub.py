@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from users.evolution_stub import EvolutionStub
+
+
+class Command(BaseCommand):
+    help = "Sobe um servidor local que imita a Evolution API (apenas para testes e carga)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--api-key', default='stub-key')
+        parser.add_argument('--instance', default='stub')
+        parser.add_argument('--delay', type=float, default=0.0, help="Atraso artificial por mensagem, em segundos.")
+
+    def handle(self, *args, **options):
+        stub = EvolutionStub(options['host'], options['port'], options['api_key'], options['instance'])
+        stub.delay = options['delay']
+        self.stdout.write(f"Evolution API falsa em {stub.url} (instância '{stub.instance_name}').")
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            stub.stop()
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.face_pool import FaceInferencePool, FacePoolServer
+
+
+class Command(BaseCommand):
+    help = "Sobe o pool de inferência facial compartilhado pelos workers HTTP (FACE_POOL_ADDRESS)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default=settings.FACE_POOL_ADDRESS,
+                            help="host:porta ou caminho de socket Unix (padrão: FACE_POOL_ADDRESS).")
+        parser.add_argument('--size', type=int, default=settings.FACE_POOL_SIZE,
+                            help="Processos de inferência deste host (padrão: FACE_POOL_SIZE).")
+
+    def handle(self, *args, **options):
+        if not options['address']:
+            raise CommandError("Informe --address ou defina FACE_POOL_ADDRESS.")
+        if options['size'] <= 0:
+            raise CommandError("O serviço precisa de ao menos um processo (--size).")
+
+        pool = FaceInferencePool(
+            size=options['size'],
+            max_queue=settings.FACE_POOL_MAX_QUEUE,
+            job_timeout=settings.FACE_POOL_JOB_TIMEOUT,
+        )
+        server = FacePoolServer(pool, options['address'], settings.FACE_POOL_AUTHKEY.encode())
+        self.stdout.write(f"Pool facial com {pool.size} processo(s) em {server.address}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,32 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Copia o banco SQLite primário para os arquivos de réplica (DB_REPLICAS). "
+        "Substitui a replicação em desenvolvimento, para testar o roteamento de leituras."
+    )
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("Disponível apenas com DB_ENGINE=django.db.backends.sqlite3.")
+        if not settings.DATABASE_READ_REPLICAS:
+            raise CommandError("Nenhuma réplica configurada em DB_REPLICAS.")
+
+        source = sqlite3.connect(primary['NAME'])
+        try:
+            for alias in settings.DATABASE_READ_REPLICAS:
+                target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+                try:
+                    # A API de backup copia um snapshot consistente mesmo com
+                    # o primário em uso.
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f"{alias}: {settings.DATABASES[alias]['NAME']} atualizado.")
+        finally:
+            source.close()
@@ -0,0 +1,62 @@
+import json
+
+from django.conf import settings
+from django.db import migrations, models
+
+from users.embeddings import pack_embedding, unpack_embedding
+
+
+def json_to_binary(apps, schema_editor):
+    Profile = apps.get_model('users', 'Profile')
+    profiles = Profile.objects.exclude(face_embedding__isnull=True).exclude(face_embedding='')
+    batch = []
+    for profile in profiles.only('id', 'face_embedding').iterator(chunk_size=500):
+        profile.face_embedding_packed = pack_embedding(
+            json.loads(profile.face_embedding), settings.FACE_EMBEDDING_DTYPE
+        )
+        batch.append(profile)
+        if len(batch) >= 500:
+            Profile.objects.bulk_update(batch, ['face_embedding_packed'])
+            batch = []
+    if batch:
+        Profile.objects.bulk_update(batch, ['face_embedding_packed'])
+
+
+def binary_to_json(apps, schema_editor):
+    Profile = apps.get_model('users', 'Profile')
+    profiles = Profile.objects.exclude(face_embedding_packed__isnull=True)
+    batch = []
+    for profile in profiles.only('id', 'face_embedding_packed').iterator(chunk_size=500):
+        embedding = unpack_embedding(bytes(profile.face_embedding_packed))
+        profile.face_embedding = json.dumps(embedding.tolist())
+        batch.append(profile)
+        if len(batch) >= 500:
+            Profile.objects.bulk_update(batch, ['face_embedding'])
+            batch = []
+    if batch:
+        Profile.objects.bulk_update(batch, ['face_embedding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_alter_profile_phone_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='face_embedding_packed',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='profile',
+            name='face_embedding',
+        ),
+        migrations.RenameField(
+            model_name='profile',
+            old_name='face_embedding_packed',
+            new_name='face_embedding',
+        ),
+    ]
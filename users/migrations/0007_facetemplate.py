@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:03
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_outboxmessage'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaceTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('embedding', models.BinaryField()),
+                ('source', models.CharField(choices=[('enrollment', 'Cadastro'), ('verification', 'Verificação')], default='verification', max_length=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_matched_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='face_templates', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def _email_index():
+    # O reset de senha procura o usuário por LOWER(email) (ver users.otp).
+    return models.Index(Lower('email'), name='users_user_email_lower_idx')
+
+
+def create_email_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model(settings.AUTH_USER_MODEL), _email_index())
+
+
+def drop_email_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model(settings.AUTH_USER_MODEL), _email_index())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_facetemplate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='profile',
+            name='verification_code',
+        ),
+        migrations.RemoveField(
+            model_name='profile',
+            name='verification_expiry',
+        ),
+        migrations.CreateModel(
+            name='OTPChallenge',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purpose', models.CharField(choices=[('phone_verification', 'Verificação de telefone'), ('password_reset', 'Redefinição de senha')], max_length=20)),
+                ('code_hash', models.CharField(max_length=64)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='otp_challenges', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('purpose', 'user'), name='unique_otp_challenge_per_purpose')],
+            },
+        ),
+        # O reset de senha localiza o usuário pelo e-mail, que não é indexado
+        # em auth_user.
+        migrations.RunPython(create_email_index, drop_email_index),
+    ]
@@ -1,19 +1,125 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .embeddings import pack_embedding, unpack_embedding
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    face_embedding = models.TextField(null=True, blank=True)
+    face_embedding = models.BinaryField(null=True, blank=True)
     phone_number = models.CharField(max_length=20, null=True, blank=True)
     is_phone_verified = models.BooleanField(default=False)
-    verification_code = models.CharField(max_length=6, null=True, blank=True)
-    verification_expiry = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_face_embedding = instance.__dict__.get('face_embedding')
+        return instance
 
     def __str__(self):
         return f"Perfil de {self.user.username}"
 
-    def is_verification_code_expired(self):
-        if self.verification_expiry and self.verification_expiry < timezone.now():
+    def get_face_embedding(self):
+        if not self.face_embedding:
+            return None
+        return unpack_embedding(self.face_embedding)
+
+    def face_embedding_changed(self):
+        if 'face_embedding' not in self.__dict__:
+            return False
+        if not hasattr(self, '_loaded_face_embedding'):
             return True
-        return False
\ No newline at end of file
+        return bytes(self.face_embedding or b'') != bytes(self._loaded_face_embedding or b'')
+
+    def set_face_embedding(self, embedding):
+        self.face_embedding = pack_embedding(embedding, settings.FACE_EMBEDDING_DTYPE)
+
+class FaceTemplate(models.Model):
+    """
+    Template facial adicional do usuário. O embedding do cadastro continua em
+    `Profile.face_embedding` e nunca é descartado; estes templates completam
+    a galeria usada na verificação (ver `users.gallery`).
+    """
+    SOURCE_ENROLLMENT = 'enrollment'
+    SOURCE_VERIFICATION = 'verification'
+    SOURCE_CHOICES = [
+        (SOURCE_ENROLLMENT, 'Cadastro'),
+        (SOURCE_VERIFICATION, 'Verificação'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='face_templates')
+    embedding = models.BinaryField()
+    source = models.CharField(max_length=12, choices=SOURCE_CHOICES, default=SOURCE_VERIFICATION)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_matched_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Template facial de {self.user.username}"
+
+    def get_embedding(self):
+        return unpack_embedding(self.embedding)
+
+    def set_embedding(self, embedding):
+        self.embedding = pack_embedding(embedding, settings.FACE_EMBEDDING_DTYPE)
+
+class OTPChallenge(models.Model):
+    """
+    Código de uso único enviado pelo WhatsApp (ver `users.otp`). Guarda só o
+    HMAC do código e é encontrado pelo usuário e pela finalidade.
+    """
+    PURPOSE_PHONE_VERIFICATION = 'phone_verification'
+    PURPOSE_PASSWORD_RESET = 'password_reset'
+    PURPOSE_CHOICES = [
+        (PURPOSE_PHONE_VERIFICATION, 'Verificação de telefone'),
+        (PURPOSE_PASSWORD_RESET, 'Redefinição de senha'),
+    ]
+
+    purpose = models.CharField(max_length=20, choices=PURPOSE_CHOICES)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='otp_challenges')
+    code_hash = models.CharField(max_length=64)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['purpose', 'user'], name='unique_otp_challenge_per_purpose'),
+        ]
+
+    def __str__(self):
+        return f"Código de {self.get_purpose_display().lower()} de {self.user_id}"
+
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+class OutboxMessage(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_SENDING, 'Enviando'),
+        (STATUS_SENT, 'Enviada'),
+        (STATUS_FAILED, 'Falhou'),
+    ]
+
+    phone_number = models.CharField(max_length=20)
+    text = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim_token = models.UUIDField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"Mensagem para {self.phone_number} ({self.status})"
\ No newline at end of file
@@ -0,0 +1,37 @@
+"""
+Estatísticas já mantidas pelos módulos de `users` (caches, triagem de
+qualidade, controle de admissão), expostas no endpoint de métricas.
+"""
+from . import admission, authentication, embedding_cache, face_index, image_quality
+
+
+def _cache_samples(stats):
+    return [((('result', 'hit'),), stats['hits'] + stats.get('shared_hits', 0)),
+            ((('result', 'miss'),), stats['misses'])]
+
+
+def collect():
+    embedding_stats = embedding_cache.stats()
+    token_stats = authentication.stats()
+    admission_stats = admission.get_controller().stats()
+    index = face_index._index
+
+    return [
+        ('face_wallet_embedding_cache_requests_total', 'counter',
+         "Consultas ao cache de embeddings.", _cache_samples(embedding_stats)),
+        ('face_wallet_embedding_cache_size', 'gauge',
+         "Embeddings no cache local.", [((), embedding_stats['size'])]),
+        ('face_wallet_token_cache_requests_total', 'counter',
+         "Consultas ao cache de tokens de autenticação.", _cache_samples(token_stats)),
+        ('face_wallet_token_cache_size', 'gauge',
+         "Tokens no cache local.", [((), token_stats['size'])]),
+        ('face_wallet_image_rejections_total', 'counter',
+         "Imagens rejeitadas pela triagem de qualidade, por motivo.",
+         [((('reason', reason),), count) for reason, count in sorted(image_quality.rejection_counts().items())]),
+        ('face_wallet_face_admission_active', 'gauge',
+         "Requisições faciais em processamento.", [((), admission_stats['active'])]),
+        ('face_wallet_face_admission_queued', 'gauge',
+         "Requisições faciais aguardando vaga.", [((), admission_stats['queued'])]),
+        ('face_wallet_face_index_size', 'gauge',
+         "Embeddings no índice 1:N carregado.", [((), len(index) if index is not None else 0)]),
+    ]
@@ -0,0 +1,121 @@
+"""
+Códigos de uso único (verificação de telefone e redefinição de senha).
+
+Cada usuário tem no máximo um desafio ativo por finalidade (`OTPChallenge`);
+emitir um novo código substitui o anterior. O código é guardado como HMAC
+(chaveado pelo SECRET_KEY). O identificador que o cliente informa é resolvido
+para um único usuário (`identify`): o username exato na verificação de
+telefone e o e-mail, sem diferenciar maiúsculas, na redefinição de senha;
+sem exatamente um usuário não há desafio a conferir. O desafio é então
+localizado pelo `user_id`, numa consulta indexada sobre uma linha estreita.
+
+Cada tentativa incrementa `attempts`; após `OTP_MAX_ATTEMPTS` erros o
+desafio deixa de aceitar códigos. Um código correto consome o desafio.
+Desafios vencidos são apagados por `manage.py purge_otp_challenges`.
+"""
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .models import OTPChallenge
+
+PHONE_VERIFICATION = OTPChallenge.PURPOSE_PHONE_VERIFICATION
+PASSWORD_RESET = OTPChallenge.PURPOSE_PASSWORD_RESET
+
+
+def generate_code():
+    return f'{secrets.randbelow(1_000_000):06d}'
+
+
+def identify(purpose, identifier):
+    # Usernames diferenciam maiúsculas; "Bob" e "bob" são usuários distintos.
+    if purpose == PASSWORD_RESET:
+        # LOWER(email) em vez de email__iexact: é a expressão do índice criado
+        # na migração 0008 (o iexact vira LIKE no SQLite e UPPER no
+        # PostgreSQL, que o índice não atende).
+        users = User.objects.alias(email_lower=Lower('email')).filter(email_lower=identifier.strip().lower())
+    else:
+        users = User.objects.filter(username=identifier)
+    user_ids = list(users.values_list('pk', flat=True)[:2])
+    return user_ids[0] if len(user_ids) == 1 else None
+
+
+def _hash_code(purpose, user_id, code):
+    return salted_hmac(f'users.otp.{purpose}', f'{user_id}:{code}', algorithm='sha256').hexdigest()
+
+
+def _challenge_values(purpose, user, code):
+    return {
+        'code_hash': _hash_code(purpose, user.pk, code),
+        'attempts': 0,
+        'expires_at': timezone.now() + timedelta(seconds=settings.OTP_CODE_TTL),
+    }
+
+
+def issue(purpose, user, code, replace=True):
+    values = _challenge_values(purpose, user, code)
+    if not replace:
+        # Usuário recém-criado: não há desafio anterior a substituir.
+        OTPChallenge.objects.create(purpose=purpose, user=user, **values)
+        return
+    try:
+        with transaction.atomic():
+            OTPChallenge.objects.update_or_create(purpose=purpose, user=user, defaults=values)
+    except IntegrityError:
+        # Outra requisição criou o desafio entre a consulta e o insert.
+        OTPChallenge.objects.filter(purpose=purpose, user=user).update(**values)
+
+
+def issue_many(purpose, codes):
+    # {user: code} de usuários recém-criados, num único INSERT.
+    OTPChallenge.objects.bulk_create([
+        OTPChallenge(purpose=purpose, user=user, **_challenge_values(purpose, user, code))
+        for user, code in codes.items()
+    ])
+
+
+def verify(purpose, identifier, code):
+    """
+    Confere o código e consome o desafio. Devolve o `user_id` dono do
+    desafio ou None se o identificador não aponta para exatamente um usuário
+    ou se o código estiver errado, vencido ou esgotado.
+    """
+    user_id = identify(purpose, identifier)
+    if user_id is None:
+        return None
+    challenge = (
+        OTPChallenge.objects.filter(purpose=purpose, user_id=user_id, expires_at__gt=timezone.now())
+        .values('pk', 'code_hash')
+        .first()
+    )
+    if challenge is None:
+        return None
+
+    counted = OTPChallenge.objects.filter(
+        pk=challenge['pk'], attempts__lt=settings.OTP_MAX_ATTEMPTS,
+    ).update(attempts=F('attempts') + 1)
+    if not counted or not constant_time_compare(_hash_code(purpose, user_id, code), challenge['code_hash']):
+        return None
+
+    # Só quem de fato apagou a linha usa o código, mesmo com duas
+    # requisições concorrentes corretas.
+    deleted, _ = OTPChallenge.objects.filter(pk=challenge['pk']).delete()
+    return user_id if deleted else None
+
+
+def purge_expired(batch_size=1000, now=None):
+    now = now or timezone.now()
+    total = 0
+    while True:
+        expired = list(OTPChallenge.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size])
+        if not expired:
+            return total
+        deleted, _ = OTPChallenge.objects.filter(pk__in=expired).delete()
+        total += deleted
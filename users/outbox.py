@@ -0,0 +1,172 @@
+"""
+Outbox de mensagens do WhatsApp.
+
+As views apenas gravam um `OutboxMessage` pendente; a entrega à Evolution
+API acontece num processo separado (`manage.py drain_outbox`), que reivindica
+lotes de mensagens, envia em paralelo com uma sessão HTTP reaproveitada e
+reagenda as falhas com backoff exponencial.
+
+O texto das mensagens carrega o código em claro, então é apagado assim que a
+mensagem sai da fila (enviada ou com falha definitiva), e `purge` remove as
+linhas mais antigas que a validade dos códigos (`manage.py
+purge_otp_challenges`).
+"""
+import random
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .models import OutboxMessage
+
+# Respostas 4xx que indicam problema na própria mensagem (número inválido,
+# payload recusado) não melhoram com novas tentativas.
+RETRYABLE_STATUS = {408, 425, 429}
+
+
+class PermanentDeliveryError(Exception):
+    pass
+
+
+def enqueue_message(phone_number, text):
+    return OutboxMessage.objects.create(phone_number=phone_number, text=text)
+
+
+def enqueue_messages(messages):
+    # [(phone_number, text), ...] num único INSERT.
+    return OutboxMessage.objects.bulk_create(
+        [OutboxMessage(phone_number=phone_number, text=text) for phone_number, text in messages]
+    )
+
+
+class EvolutionClient:
+    def __init__(self, base_url=None, api_key=None, instance_name=None, timeout=None, pool_size=None):
+        self.base_url = (base_url or settings.EVOLUTION_API_URL).rstrip('/')
+        self.api_key = api_key or settings.EVOLUTION_API_KEY
+        self.instance_name = instance_name or settings.EVOLUTION_INSTANCE_NAME
+        self.timeout = timeout or (settings.EVOLUTION_API_CONNECT_TIMEOUT, settings.EVOLUTION_API_READ_TIMEOUT)
+
+        pool_size = pool_size or settings.OUTBOX_CONCURRENCY
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            "apikey": self.api_key,
+            "Content-Type": "application/json",
+        })
+
+    def send_text(self, phone_number, text):
+        url = f"{self.base_url}/message/sendText/{self.instance_name}"
+        payload = {
+            "number": phone_number,
+            "options": {
+                "delay": 1200,
+                "presence": "composing"
+            },
+            "textMessage": {
+                "text": text
+            }
+        }
+
+        response = self.session.post(url, json=payload, timeout=self.timeout)
+        if 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_STATUS:
+            raise PermanentDeliveryError(f"{response.status_code} {response.reason}")
+        response.raise_for_status()
+
+    def close(self):
+        self.session.close()
+
+
+def backoff_delay(attempts):
+    delay = min(settings.OUTBOX_BACKOFF_MAX, settings.OUTBOX_BACKOFF_BASE * (2 ** (attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_batch(limit):
+    # Um único UPDATE marca o lote com um token próprio; assim vários
+    # processos podem drenar a mesma tabela sem enviar a mesma mensagem duas
+    # vezes. Mensagens presas em "enviando" voltam a ser elegíveis quando o
+    # prazo (lease) expira.
+    now = timezone.now()
+    due = OutboxMessage.objects.filter(
+        Q(status=OutboxMessage.STATUS_PENDING) | Q(status=OutboxMessage.STATUS_SENDING),
+        next_attempt_at__lte=now,
+    )
+    candidate_ids = list(due.order_by('next_attempt_at').values_list('pk', flat=True)[:limit])
+    if not candidate_ids:
+        return []
+
+    token = uuid.uuid4()
+    due.filter(pk__in=candidate_ids).update(
+        status=OutboxMessage.STATUS_SENDING,
+        claim_token=token,
+        next_attempt_at=now + timedelta(seconds=settings.OUTBOX_CLAIM_LEASE),
+    )
+    return list(OutboxMessage.objects.filter(claim_token=token, status=OutboxMessage.STATUS_SENDING))
+
+
+def _deliver(client, message):
+    try:
+        client.send_text(message.phone_number, message.text)
+        return None, False
+    except PermanentDeliveryError as e:
+        return str(e), True
+    except requests.exceptions.RequestException as e:
+        return str(e), False
+
+
+def _record(message, error, permanent):
+    now = timezone.now()
+    message.attempts += 1
+    message.claim_token = None
+    if error is None:
+        message.status = OutboxMessage.STATUS_SENT
+        message.sent_at = now
+        message.last_error = ''
+        message.text = ''
+    elif permanent or message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        message.status = OutboxMessage.STATUS_FAILED
+        message.last_error = error
+        message.text = ''
+    else:
+        message.status = OutboxMessage.STATUS_PENDING
+        message.next_attempt_at = now + timedelta(seconds=backoff_delay(message.attempts))
+        message.last_error = error
+    message.save(update_fields=['attempts', 'claim_token', 'status', 'sent_at', 'next_attempt_at', 'last_error', 'text'])
+
+
+def drain(client, batch_size=None, concurrency=None):
+    """
+    Envia um lote de mensagens vencidas e devolve quantas foram processadas.
+    Só as chamadas HTTP rodam nos threads; o acesso ao banco fica no thread
+    que chamou.
+    """
+    messages = claim_batch(batch_size or settings.OUTBOX_BATCH_SIZE)
+    if not messages:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=concurrency or settings.OUTBOX_CONCURRENCY) as executor:
+        outcomes = list(executor.map(lambda message: _deliver(client, message), messages))
+
+    for message, (error, permanent) in zip(messages, outcomes):
+        _record(message, error, permanent)
+    return len(messages)
+
+
+def purge(batch_size=1000, now=None):
+    # Passada a validade, o código da mensagem já não serve para nada, tenha
+    # ela sido enviada ou não.
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.OTP_CODE_TTL)
+    total = 0
+    while True:
+        old = list(OutboxMessage.objects.filter(created_at__lte=cutoff).values_list('pk', flat=True)[:batch_size])
+        if not old:
+            return total
+        deleted, _ = OutboxMessage.objects.filter(pk__in=old).delete()
+        total += deleted
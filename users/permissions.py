@@ -0,0 +1,19 @@
+from rest_framework.permissions import BasePermission
+
+from . import step_up
+
+
+class HasFaceStepUp(BasePermission):
+    """
+    Exige um grant de verificação facial recente (ver `users.step_up`),
+    emitido para o mesmo token usado na requisição.
+    """
+    message = "Confirme sua identidade com a verificação facial para continuar."
+    code = 'face_step_up_required'
+
+    def has_permission(self, request, view):
+        token = request.auth
+        grant = request.META.get(step_up.HEADER)
+        if not grant or token is None or not hasattr(token, 'key'):
+            return False
+        return step_up.is_valid(grant, token.key, request.user.pk)
@@ -1,13 +1,59 @@
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from rest_framework import serializers, validators
 
+from .face_processing import image_header
+from .uploads import read_upload
+
+class FaceImageField(serializers.FileField):
+    """
+    Aceita JPEG ou PNG dentro de FACE_UPLOAD_MAX_BYTES e FACE_IMAGE_MAX_PIXELS.
+    Formato e dimensões vêm do cabeçalho, sem decodificar a imagem (o
+    ImageField do DRF abre o arquivo inteiro com o Pillow numa cópia em
+    memória).
+    """
+    default_error_messages = {
+        'too_large': 'A imagem excede o tamanho máximo de {limit_mb:g} MB.',
+        'invalid_image': 'Envie uma imagem JPEG ou PNG válida.',
+        'too_many_pixels': 'A imagem excede a resolução máxima de {limit_mp:g} megapixels.',
+    }
+
+    def to_internal_value(self, data):
+        uploaded = super().to_internal_value(data)
+        if uploaded.size > settings.FACE_UPLOAD_MAX_BYTES:
+            self.fail('too_large', limit_mb=settings.FACE_UPLOAD_MAX_BYTES / (1024 * 1024))
+        header = image_header(read_upload(uploaded))
+        if header is None:
+            self.fail('invalid_image')
+        _, width, height = header
+        if width * height > settings.FACE_IMAGE_MAX_PIXELS:
+            self.fail('too_many_pixels', limit_mp=settings.FACE_IMAGE_MAX_PIXELS / 1_000_000)
+        return uploaded
+
+class FaceBoxField(serializers.CharField):
+    default_error_messages = {
+        'invalid_box': 'Informe a região do rosto como "top,right,bottom,left" em pixels.',
+    }
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        try:
+            top, right, bottom, left = (int(part) for part in value.split(','))
+        except ValueError:
+            self.fail('invalid_box')
+        if min(top, right, bottom, left) < 0 or bottom <= top or right <= left:
+            self.fail('invalid_box')
+        return top, right, bottom, left
+
 class RegisterSerializer(serializers.ModelSerializer):
-    face_image = serializers.ImageField(write_only=True, required=True)
+    face_image = FaceImageField(write_only=True, required=True)
+    face_box = FaceBoxField(write_only=True, required=False)
     phone_number = serializers.CharField(write_only=True, required=True)
     class Meta:
         model = User
-        fields = ('username', 'password', 'email', 'first_name', 'last_name', 'face_image', 'phone_number')
+        fields = ('username', 'password', 'email', 'first_name', 'last_name', 'face_image', 'face_box', 'phone_number')
         
         extra_kwargs = {
             "password": {"write_only": True},
@@ -24,22 +70,42 @@ class RegisterSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         username = validated_data.get('username')
-        password = validated_data.get('password')
         email = validated_data.get('email')
         first_name = validated_data.get('first_name')
         last_name = validated_data.get('last_name')
+        # A RegisterView passa o hash já calculado, fora da transação.
+        password_hash = validated_data.get('password_hash') or make_password(validated_data.get('password'))
 
-        user = User.objects.create_user(
-            username=username,
-            password=password,
-            email=email,
-            first_name=first_name,
-            last_name=last_name
+        user = User(
+            username=User.normalize_username(username),
+            password=password_hash,
+            email=User.objects.normalize_email(email),
+            first_name=first_name or '',
+            last_name=last_name or '',
         )
+        user.save()
         return user
     
 class FaceVerificationSerializer(serializers.Serializer):
-    face_image = serializers.ImageField(write_only=True, required=True)
+    face_image = FaceImageField(write_only=True, required=True)
+    face_box = FaceBoxField(write_only=True, required=False)
+
+class FaceIdentificationSerializer(serializers.Serializer):
+    face_image = FaceImageField(write_only=True, required=True)
+    face_box = FaceBoxField(write_only=True, required=False)
+    top_k = serializers.IntegerField(required=False, default=1, min_value=1, max_value=10)
+
+class BatchFaceVerificationSerializer(serializers.Serializer):
+    face_images = serializers.ListField(
+        child=FaceImageField(), min_length=1, max_length=settings.FACE_BATCH_MAX_ITEMS, write_only=True
+    )
+    user_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+
+    def validate(self, attrs):
+        user_ids = attrs.get('user_ids')
+        if user_ids is not None and len(user_ids) != len(attrs['face_images']):
+            raise serializers.ValidationError({"user_ids": "Informe um usuário para cada imagem enviada."})
+        return attrs
 
 class PhoneVerificationSerializer(serializers.Serializer):
     username = serializers.CharField(required=True)
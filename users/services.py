@@ -1,37 +1,32 @@
-import requests
-from django.conf import settings
-import random
+import logging
+
+from django.db import DatabaseError
+
+from face_wallet.metrics import span
+
+from .otp import generate_code
+from .outbox import enqueue_message
+
+logger = logging.getLogger(__name__)
+
+
+def verification_message(user, code):
+    return f"Olá {user.first_name}, seu código de verificação para a Carteira Digital é: *{code}*"
+
 
 def send_whatsapp_code(phone_number, user):
-    code = str(random.randint(100000, 999999))
-    message = f"Olá {user.first_name}, seu código de verificação para a Carteira Digital é: *{code}*"
-
-    api_url = settings.EVOLUTION_API_URL
-    api_key = settings.EVOLUTION_API_KEY
-    instance_name = settings.EVOLUTION_INSTANCE_NAME
-
-    url = f"{api_url}/message/sendText/{instance_name}"
-
-    headers = {
-        "apikey": api_key,
-        "Content-Type": "application/json"
-    }
-
-    payload = {
-        "number": phone_number,
-        "options": {
-            "delay": 1200,
-            "presence": "composing"
-        },
-        "textMessage": {
-            "text": message
-        }
-    }
+    code = generate_code()
+    message = verification_message(user, code)
 
+    # A entrega à Evolution API é feita pelo worker do outbox
+    # (manage.py drain_outbox); aqui só registramos a mensagem. Se a
+    # mensagem não puder ser gravada o erro sobe, para que a transação de
+    # quem chamou seja desfeita em vez de confirmar um código que nunca
+    # será enviado.
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        return code, True 
-    except requests.exceptions.RequestException as e:
-        print(f"Erro ao enviar mensagem para a Evolution API: {e}")
-        return None, False 
\ No newline at end of file
+        with span('whatsapp.enqueue'):
+            enqueue_message(phone_number, message)
+    except DatabaseError:
+        logger.exception('Erro ao enfileirar mensagem para a Evolution API')
+        raise
+    return code
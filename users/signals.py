@@ -0,0 +1,42 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import authentication, embedding_cache, face_index, step_up
+from .models import FaceTemplate, Profile
+
+
+@receiver(post_save, sender=Profile)
+def profile_post_save(sender, instance, created, **kwargs):
+    if created or instance.face_embedding_changed():
+        embedding_cache.invalidate(instance.user_id)
+        face_index.profile_saved(instance)
+    instance._loaded_face_embedding = instance.__dict__.get('face_embedding')
+
+
+@receiver(post_delete, sender=Profile)
+def profile_post_delete(sender, instance, **kwargs):
+    embedding_cache.invalidate(instance.user_id)
+    face_index.profile_deleted(instance)
+
+
+@receiver(post_save, sender=FaceTemplate)
+@receiver(post_delete, sender=FaceTemplate)
+def face_template_changed(sender, instance, **kwargs):
+    embedding_cache.invalidate(instance.user_id)
+
+
+@receiver(post_delete, sender=Token)
+def token_post_delete(sender, instance, **kwargs):
+    authentication.invalidate(instance.key)
+    step_up.revoke(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_post_save(sender, instance, created, **kwargs):
+    # O usuário em cache fica desatualizado a cada alteração (inclusive a
+    # desativação), então o token dele sai do cache.
+    if not created:
+        for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+            authentication.invalidate(key)
@@ -0,0 +1,58 @@
+"""
+Autorização temporária ("step-up") concedida por uma verificação facial.
+
+Quando `FaceVerificationView` confirma o rosto, o servidor emite um grant
+assinado (`django.core.signing`) com validade de `FACE_STEP_UP_TTL` segundos,
+vinculado ao token de autenticação usado na verificação, e registra o id do
+grant no cache. O cliente reenvia o grant no cabeçalho `X-Face-Grant` e
+`users.permissions.HasFaceStepUp` o aceita enquanto a assinatura for válida,
+o token for o mesmo e o registro no cache existir. Uma única verificação
+facial cobre assim todas as ações sensíveis da janela.
+
+Remover o token (logout) ou emitir um novo grant invalida o anterior.
+"""
+import hashlib
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+HEADER = 'HTTP_X_FACE_GRANT'
+_SALT = 'users.step_up'
+
+
+def _cache():
+    return caches[settings.FACE_STEP_UP_CACHE_ALIAS]
+
+
+def _token_digest(token_key):
+    return hashlib.sha256(token_key.encode('utf-8')).hexdigest()
+
+
+def _cache_key(token_key):
+    return f'face_step_up:{_token_digest(token_key)}'
+
+
+def issue(token_key, user_id):
+    grant_id = secrets.token_urlsafe(12)
+    _cache().set(_cache_key(token_key), grant_id, settings.FACE_STEP_UP_TTL)
+    return signing.dumps(
+        {'u': user_id, 't': _token_digest(token_key)[:32], 'g': grant_id},
+        salt=_SALT, compress=False,
+    )
+
+
+def is_valid(grant, token_key, user_id):
+    try:
+        payload = signing.loads(grant, salt=_SALT, max_age=settings.FACE_STEP_UP_TTL)
+    except signing.BadSignature:
+        return False
+
+    if payload.get('u') != user_id or payload.get('t') != _token_digest(token_key)[:32]:
+        return False
+    return _cache().get(_cache_key(token_key)) == payload.get('g')
+
+
+def revoke(token_key):
+    _cache().delete(_cache_key(token_key))
@@ -1,3 +1,434 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from . import admission, authentication, caching, checks, embedding_cache, face_pool, face_processing, otp
+from .embeddings import pack_embedding, unpack_embedding
+from .evolution_stub import EvolutionStub
+from .models import OTPChallenge, OutboxMessage, Profile
+from .outbox import EvolutionClient, drain, enqueue_message, purge
+from .services import send_whatsapp_code
+from .throttling import EmailRateThrottle, IPRateThrottle
+
+
+class OutboxDrainTests(TestCase):
+    def setUp(self):
+        self.stub = EvolutionStub(api_key='chave', instance_name='carteira').start()
+        self.addCleanup(self.stub.stop)
+        self.client_api = EvolutionClient(base_url=self.stub.url, api_key='chave', instance_name='carteira')
+        self.addCleanup(self.client_api.close)
+
+    def test_drain_delivers_queued_message(self):
+        message = enqueue_message('5511999999999', 'Seu código é: *123456*')
+
+        self.assertEqual(drain(self.client_api), 1)
+
+        self.assertEqual(self.stub.last_code('5511999999999'), '123456')
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.STATUS_SENT)
+        self.assertEqual(message.text, '')
+        self.assertEqual(drain(self.client_api), 0)
+
+    def test_purge_removes_messages_older_than_code_ttl(self):
+        old = enqueue_message('5511999999999', 'Seu código é: *123456*')
+        OutboxMessage.objects.filter(pk=old.pk).update(
+            created_at=timezone.now() - timedelta(seconds=settings.OTP_CODE_TTL + 1)
+        )
+        recent = enqueue_message('5511999999999', 'Seu código é: *654321*')
+
+        self.assertEqual(purge(), 1)
+        self.assertEqual(list(OutboxMessage.objects.values_list('pk', flat=True)), [recent.pk])
+
+    def test_drain_reschedules_on_server_error(self):
+        message = enqueue_message('5511999999999', 'Seu código é: *123456*')
+        self.stub.fail(1)
+
+        self.assertEqual(drain(self.client_api), 1)
+
+        self.assertEqual(self.stub.messages, [])
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.STATUS_PENDING)
+        self.assertEqual(message.attempts, 1)
+
+
+class SendWhatsappCodeTests(TestCase):
+    def test_enqueue_failure_propagates(self):
+        user = User.objects.create_user(username='ana', password='senha-forte-123')
+        with mock.patch('users.services.enqueue_message', side_effect=DatabaseError('banco fora')):
+            with self.assertLogs('users.services', level='ERROR'):
+                with self.assertRaises(DatabaseError):
+                    send_whatsapp_code('5511999999999', user)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        authentication._local.clear()
+        caches['default'].clear()
+        self.user = User.objects.create_user(username='ana', password='senha-forte-123')
+        self.token = Token.objects.create(user=self.user)
+        self.auth = authentication.CachedTokenAuthentication()
+
+    def test_token_deleted_in_another_worker_is_rejected(self):
+        key = self.token.key
+        self.auth.authenticate_credentials(key)
+
+        # O outro worker não mexe no LRU deste processo, só na versão.
+        with mock.patch.object(authentication._local, 'delete'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.token.delete()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.auth.authenticate_credentials(key)
+
+    @override_settings(AUTH_TOKEN_CACHE_ALIAS='default')
+    def test_shared_cache_keeps_no_user_object(self):
+        self.auth.authenticate_credentials(self.token.key)
+
+        entry = caches['default'].get(authentication._shared_key(self.token.key))
+        self.assertEqual(entry, (0, self.user.pk, True, self.token.created))
+
+        authentication._local.clear()
+        user, token = self.auth.authenticate_credentials(self.token.key)
+        self.assertEqual((user.pk, token.key), (self.user.pk, self.token.key))
+
+
+class ThrottledView(APIView):
+    authentication_classes = []
+    permission_classes = []
+    throttle_scope = 'password_reset'
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
+
+    def post(self, request):
+        return Response({'ok': True})
+
+
+@override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={
+    'password_reset_ip': '1/min', 'password_reset_email': '2/min',
+}))
+class SlidingWindowThrottleTests(SimpleTestCase):
+    def setUp(self):
+        caches[settings.RATE_LIMIT_CACHE_ALIAS].clear()
+        self.factory = APIRequestFactory()
+
+    def post(self, ip, email='ana@example.com'):
+        request = self.factory.post('/reset/', {'email': email}, format='json', REMOTE_ADDR=ip)
+        return ThrottledView.as_view()(request)
+
+    def test_exceeded_limit_answers_429_with_retry_after(self):
+        self.assertEqual(self.post('10.0.0.1').status_code, 200)
+        response = self.post('10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_rejected_request_does_not_consume_the_next_limit(self):
+        self.assertEqual(self.post('10.0.0.1').status_code, 200)
+        # Recusada pelo limite de IP: não pode gastar a cota do e-mail.
+        self.assertEqual(self.post('10.0.0.1').status_code, 429)
+        self.assertEqual(self.post('10.0.0.2').status_code, 200)
+        self.assertEqual(self.post('10.0.0.3').status_code, 429)
+
+
+class EmbeddingFormatTests(SimpleTestCase):
+    def test_round_trip_keeps_dtype_and_values(self):
+        embedding = np.random.default_rng(0).standard_normal(128)
+        for dtype in ('float32', 'float64'):
+            with self.subTest(dtype=dtype):
+                data = pack_embedding(embedding, dtype)
+                self.assertEqual(len(data), 6 + 128 * np.dtype(dtype).itemsize)
+                unpacked = unpack_embedding(data)
+                self.assertEqual(unpacked.dtype, np.dtype(dtype))
+                np.testing.assert_array_equal(unpacked, embedding.astype(dtype))
+
+    def test_unknown_header_is_rejected(self):
+        data = pack_embedding(np.ones(128))
+        for corrupted in (b'XX' + data[2:], data[:2] + b'\x09' + data[3:], data[:3] + b'\x07' + data[4:]):
+            with self.subTest(header=corrupted[:4]), self.assertRaisesMessage(ValueError, "Formato de embedding"):
+                unpack_embedding(corrupted)
+        with self.assertRaises(ValueError):
+            pack_embedding(np.ones(128), 'int8')
+
+
+class VersionedInvalidationTests(TestCase):
+    def test_evicts_now_and_bumps_the_version_on_commit(self):
+        cache = caches['default']
+        cache.delete('versao:teste')
+        evict = mock.Mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            caching.invalidate_versioned(cache, 'versao:teste', evict)
+            self.assertEqual(evict.call_count, 1)
+            self.assertIsNone(cache.get('versao:teste'))
+
+        self.assertEqual(evict.call_count, 2)
+        self.assertEqual(cache.get('versao:teste'), 1)
+        self.assertEqual(caching.incr(cache, 'versao:teste'), 2)
+
+
+class EmbeddingCacheStatsTests(TestCase):
+    def test_stale_local_entry_counts_as_miss(self):
+        user = User.objects.create_user(username='ana', password='senha-forte-123')
+        Profile.objects.create(user=user, phone_number='5511999999999', face_embedding=pack_embedding(np.ones(128)))
+        embedding_cache.clear()
+        before = embedding_cache.stats()
+
+        embedding_cache.get_gallery(user.pk)
+        embedding_cache.get_gallery(user.pk)
+        # Outro processo alterou a galeria: a entrada local ficou vencida.
+        caching.incr(caches[settings.FACE_GALLERY_VERSION_ALIAS], embedding_cache._version_key(user.pk))
+        embedding_cache.get_gallery(user.pk)
+
+        after = embedding_cache.stats()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 2)
+        self.assertGreaterEqual(after['misses'], 0)
+
+
+class AdmissionClientKeyTests(TestCase):
+    def setUp(self):
+        authentication._local.clear()
+        self.factory = RequestFactory()
+
+    def test_unresolved_tokens_share_the_ip_key(self):
+        keys = {
+            admission.client_key(self.factory.get('/', HTTP_AUTHORIZATION=f'Token {secrets.token_hex(20)}'))
+            for _ in range(3)
+        }
+        self.assertEqual(keys, {'ip:127.0.0.1'})
+
+    def test_valid_token_is_keyed_by_user(self):
+        user = User.objects.create_user(username='ana', password='senha-forte-123')
+        token = Token.objects.create(user=user)
+        request = self.factory.get('/', HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(admission.client_key(request), f'user:{user.pk}')
+
+
+class OTPTests(TestCase):
+    def setUp(self):
+        self.bob = User.objects.create_user(username='Bob', email='Bob@example.com', password='senha-forte-123')
+        self.other = User.objects.create_user(username='bob', email='bob@example.org', password='senha-forte-123')
+
+    def test_usernames_differing_in_case_have_separate_challenges(self):
+        otp.issue(otp.PHONE_VERIFICATION, self.bob, '111111')
+        otp.issue(otp.PHONE_VERIFICATION, self.other, '222222')
+
+        self.assertIsNone(otp.verify(otp.PHONE_VERIFICATION, 'bob', '111111'))
+        self.assertEqual(otp.verify(otp.PHONE_VERIFICATION, 'bob', '222222'), self.other.pk)
+        self.assertEqual(otp.verify(otp.PHONE_VERIFICATION, 'Bob', '111111'), self.bob.pk)
+
+    def test_password_reset_requires_a_single_user_for_the_email(self):
+        otp.issue(otp.PASSWORD_RESET, self.bob, '111111')
+        self.assertEqual(otp.verify(otp.PASSWORD_RESET, 'BOB@example.com', '111111'), self.bob.pk)
+
+        otp.issue(otp.PASSWORD_RESET, self.bob, '111111')
+        User.objects.create_user(username='robert', email='bob@EXAMPLE.com', password='senha-forte-123')
+        self.assertIsNone(otp.verify(otp.PASSWORD_RESET, 'bob@example.com', '111111'))
+
+
+class RegisterViewTests(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        image = BytesIO()
+        Image.new('RGB', (64, 64)).save(image, 'PNG')
+        self.image = SimpleUploadedFile('rosto.png', image.getvalue(), content_type='image/png')
+
+    @override_settings(RATE_LIMIT_ENABLED=False)
+    def test_password_is_hashed_outside_the_transaction(self):
+        depth_while_hashing = []
+
+        def hash_password(password):
+            depth_while_hashing.append(len(connection.atomic_blocks))
+            return make_password(password)
+
+        with mock.patch('users.views.face_pool.encode_face', return_value=np.ones(128, dtype=np.float32)), \
+                mock.patch('users.views.make_password', side_effect=hash_password):
+            response = self.client.post('/api/auth/register/', {
+                'username': 'ana', 'password': 'Senha-forte-123', 'email': 'ana@example.com',
+                'phone_number': '5511999999999', 'face_image': self.image,
+            })
+
+        self.assertEqual(response.status_code, 201, response.content)
+        # O TestCase já envolve o teste em transações; a view não abre outra
+        # antes do hash.
+        self.assertEqual(depth_while_hashing, [len(connection.atomic_blocks)])
+        user = User.objects.get(username='ana')
+        self.assertTrue(user.check_password('Senha-forte-123'))
+        self.assertTrue(OTPChallenge.objects.filter(user=user).exists())
+
+
+class FakePool:
+    def __init__(self, size, max_queue, job_timeout):
+        self.size = size
+        self.job_timeout = job_timeout
+
+    def submit(self, fn, images, *args):
+        return [np.ones(128, dtype=np.float32) for _ in images]
+
+    def result(self, future, timeout=None):
+        return future
+
+    def shutdown(self):
+        pass
+
+
+@mock.patch('users.management.commands.import_enrollments.FaceInferencePool', FakePool)
+class ImportEnrollmentsTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        with open(os.path.join(self.directory, 'rosto.jpg'), 'wb') as fh:
+            fh.write(b'imagem')
+        self.records = os.path.join(self.directory, 'clientes.jsonl')
+        with open(self.records, 'w') as fh:
+            for i, password_hash in enumerate([make_password('senha-forte-123'), '']):
+                fh.write(json.dumps({
+                    'username': f'cliente{i}', 'email': f'cliente{i}@example.com', 'phone_number': '5511999999999',
+                    'image': 'rosto.jpg', 'password_hash': password_hash,
+                }) + '\n')
+
+    def run_import(self, *args):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            call_command('import_enrollments', self.records, self.directory, '--workers', '1', *args,
+                         stdout=StringIO())
+        return callbacks
+
+    def test_sends_no_codes_by_default(self):
+        self.run_import()
+
+        # Sem hash nem código, o segundo registro não teria como entrar.
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), ['cliente0'])
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.assertFalse(OTPChallenge.objects.exists())
+
+    def test_send_codes_queues_a_code_per_user(self):
+        self.run_import('--send-codes')
+
+        self.assertEqual(User.objects.count(), 2)
+        self.assertEqual(OutboxMessage.objects.count(), 2)
+        self.assertEqual(OTPChallenge.objects.filter(purpose=otp.PHONE_VERIFICATION).count(), 2)
+
+    def test_face_index_is_published_per_batch(self):
+        with mock.patch('users.management.commands.import_enrollments.face_index.invalidate') as invalidate:
+            self.run_import('--phone-verified', '--batch-size', '1')
+        self.assertEqual(invalidate.call_count, 2)
+
+
+class BatchFaceVerificationTests(TestCase):
+    def test_batch_without_enrolled_faces_skips_the_encoder(self):
+        user = User.objects.create_user(username='ana', password='senha-forte-123')
+        Profile.objects.create(user=user, phone_number='5511999999999')
+        image = BytesIO()
+        Image.new('RGB', (64, 64)).save(image, 'PNG')
+        token = Token.objects.create(user=user)
+
+        with mock.patch('users.face_pool.get_pool') as get_pool:
+            response = self.client.post('/api/auth/verify-face/batch/', {
+                'face_images': [SimpleUploadedFile('rosto.png', image.getvalue(), content_type='image/png')],
+            }, HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['results'][0]['detail'], "Nenhum rosto cadastrado para este usuário.")
+        get_pool.assert_not_called()
+
+
+class FacePoolServerTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        address = os.path.join(directory, 'pool.sock')
+        self.server = face_pool.FacePoolServer(
+            face_pool.FaceInferencePool(size=0, max_queue=0, job_timeout=5), address, b'chave')
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.stop)
+        self.client_pool = face_pool.FacePoolClient(address, b'chave', size=2, max_queue=2, job_timeout=5)
+        self.addCleanup(self.client_pool.shutdown)
+
+    def test_jobs_run_in_the_shared_service(self):
+        expected = face_processing.resolve_detection_options('fast')
+        self.assertEqual(self.client_pool.run(face_processing.resolve_detection_options, 'fast'), expected)
+        future = self.client_pool.submit(face_processing.resolve_detection_options, 'fast')
+        self.assertEqual(self.client_pool.result(future), expected)
+
+    def test_service_errors_reach_the_caller(self):
+        with self.assertRaises(ValueError):
+            self.client_pool.run(face_processing.resolve_detection_options, 'inexistente')
+        with self.assertRaisesMessage(face_pool.FacePoolError, "Job não permitido"):
+            self.client_pool.run(os.getpid)
+
+    def test_wrong_key_is_refused(self):
+        intruder = face_pool.FacePoolClient(self.server.address, b'outra', size=1, max_queue=0, job_timeout=5)
+        with self.assertRaises(face_pool.FacePoolError), self.assertLogs('users.face_pool', 'WARNING'):
+            intruder.run(face_processing.resolve_detection_options, 'fast')
+
+
+class AdmissionControlledTests(SimpleTestCase):
+    @override_settings(DEBUG=True)
+    def test_middleware_chain_is_not_adapted_to_sync(self):
+        # Com DEBUG, o Django registra cada middleware que precisou adaptar.
+        with self.assertLogs('django.request', level='DEBUG') as logs:
+            ASGIHandler()
+            logging.getLogger('django.request').debug('carregado')
+        self.assertFalse([line for line in logs.output if 'adapted' in line], logs.output)
+
+    def test_queued_request_waits_on_the_event_loop(self):
+        controller = admission.AdmissionController(max_active=1, max_queue=4, per_client=4, queue_timeout=5)
+        calls = []
+
+        def view(request):
+            calls.append(request)
+            return HttpResponse('ok')
+
+        wrapped = admission.admission_controlled(view)
+        request = RequestFactory().post('/api/auth/verify-face/')
+
+        async def scenario():
+            await controller.acquire('ocupado')
+            task = asyncio.ensure_future(wrapped(request))
+            await asyncio.sleep(0.05)
+            queued = controller.stats()['queued']
+            controller.release('ocupado')
+            response = await task
+            return queued, response
+
+        with mock.patch.object(admission, 'get_controller', return_value=controller):
+            queued, response = async_to_sync(scenario)()
+
+        self.assertEqual(queued, 1)
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(calls, [request])
+        self.assertEqual(controller.stats(), {'active': 0, 'queued': 0, 'clients': 0})
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    def test_process_local_coordination_caches_are_reported(self):
+        warned = {warning.obj for warning in checks.check_shared_cache_aliases(None)}
+        self.assertIn('FACE_STEP_UP_CACHE_ALIAS', warned)
+        self.assertIn('RATE_LIMIT_CACHE_ALIAS', warned)
@@ -0,0 +1,118 @@
+"""
+Limites de requisição dos endpoints públicos (cadastro, verificação de
+telefone e redefinição de senha), guardados no cache do Django para valer
+entre todos os workers.
+
+Cada view declara um `throttle_scope` e as chaves que quer limitar (IP,
+telefone, e-mail); a taxa de cada combinação vem de
+`REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']['<scope>_<tipo>']`, no formato do
+DRF ('5/hour'). Escopos sem taxa configurada não são limitados.
+
+A contagem é uma janela deslizante aproximada: um contador por janela fixa,
+incrementado com `cache.incr` (atômico no Redis, no Memcached e no locmem),
+e o contador da janela anterior ponderado pelo quanto dela ainda cabe na
+janela atual. Requisições recusadas não contam. Como os limites rodam antes
+do handler da view, a recusa acontece antes de qualquer envio de WhatsApp,
+encoding facial ou hash de senha; e, recusada por um limite, a requisição não
+consome os seguintes (o limite por IP vem primeiro e dispensa até a leitura
+do corpo).
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from . import caching
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    kind = None
+
+    def __init__(self):
+        # A taxa depende do escopo da view, conhecido só em allow_request.
+        self.cache = caches[settings.RATE_LIMIT_CACHE_ALIAS]
+
+    def identity(self, request):
+        raise NotImplementedError
+
+    def get_cache_key(self, request, view):
+        identity = self.identity(request)
+        if not identity:
+            return None
+        digest = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]
+        return f'throttle:{self.scope}:{digest}'
+
+    def allow_request(self, request, view):
+        if not settings.RATE_LIMIT_ENABLED or getattr(request, '_rate_limited', False):
+            return True
+        self.scope = f'{getattr(view, "throttle_scope", None)}_{self.kind}'
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(rate)
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = self.timer()
+        window = int(now // self.duration)
+        self.elapsed = now - window * self.duration
+        current_key = f'{self.key}:{window}'
+        current = caching.incr(self.cache, current_key, timeout=self.duration * 2)
+        self.previous = self.cache.get(f'{self.key}:{window - 1}', 0)
+
+        weight = 1 - self.elapsed / self.duration
+        if self.previous * weight + current <= self.num_requests:
+            return True
+
+        self.cache.decr(current_key)
+        self.current = current - 1
+        request._rate_limited = True
+        return False
+
+    def wait(self):
+        # Tempo até a estimativa da janela deslizante abrir espaço para mais
+        # uma requisição.
+        room = self.num_requests - 1 - self.current
+        if self.previous and room >= 0:
+            return max(0.0, self.duration * (1 - room / self.previous) - self.elapsed)
+        remaining = self.duration - self.elapsed
+        if self.current:
+            remaining += max(0.0, self.duration * (1 - (self.num_requests - 1) / self.current))
+        return remaining
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    kind = 'ip'
+
+    def identity(self, request):
+        return self.get_ident(request)
+
+
+class FieldRateThrottle(SlidingWindowThrottle):
+    field = None
+
+    def normalize(self, value):
+        return value.strip().lower()
+
+    def identity(self, request):
+        value = request.data.get(self.field)
+        if not isinstance(value, str):
+            return None
+        return self.normalize(value) or None
+
+
+class PhoneRateThrottle(FieldRateThrottle):
+    kind = 'phone'
+    field = 'phone_number'
+
+    def normalize(self, value):
+        return ''.join(char for char in value if char.isdigit())
+
+
+class EmailRateThrottle(FieldRateThrottle):
+    kind = 'email'
+    field = 'email'
@@ -0,0 +1,61 @@
+"""
+Limites e leitura dos uploads de imagem dos endpoints faciais.
+
+`limit_upload_size` recusa com 413 as requisições cujo `Content-Length`
+passa do permitido antes de o corpo ser lido (sob WSGI o corpo só é lido
+quando a view acessa `request.data`; sob ASGI o Django já o guardou num
+arquivo temporário, limitado em memória por `FILE_UPLOAD_MAX_MEMORY_SIZE`).
+O tamanho de cada arquivo é validado de novo pelo serializer, o que cobre
+uploads sem `Content-Length`.
+
+Com `FILE_UPLOAD_MAX_MEMORY_SIZE` igual a `FACE_UPLOAD_MAX_BYTES`, uma
+imagem dentro do limite fica num `BytesIO` e `read_upload` devolve os bytes
+dele sem copiar.
+"""
+import functools
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+
+# Folga para os campos de texto e os delimitadores do multipart.
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+def read_upload(uploaded):
+    buffer = getattr(uploaded, 'file', None)
+    if hasattr(buffer, 'getvalue'):
+        # BytesIO.getvalue() compartilha o buffer interno em vez de copiá-lo,
+        # ao contrário de read().
+        return buffer.getvalue()
+    uploaded.seek(0)
+    return uploaded.read()
+
+
+def max_request_bytes(max_images=1):
+    return settings.FACE_UPLOAD_MAX_BYTES * max_images + FORM_OVERHEAD_BYTES
+
+
+def _too_large(request, max_images):
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length <= max_request_bytes(max_images):
+        return None
+    limit_mb = settings.FACE_UPLOAD_MAX_BYTES / (1024 * 1024)
+    return JsonResponse(
+        {"detail": f"A requisição excede o tamanho máximo de {limit_mb:g} MB por imagem."}, status=413
+    )
+
+
+def limit_upload_size(view, max_images=1):
+    if iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def wrapped(request, *args, **kwargs):
+            return _too_large(request, max_images) or await view(request, *args, **kwargs)
+    else:
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            return _too_large(request, max_images) or view(request, *args, **kwargs)
+    return wrapped
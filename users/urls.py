@@ -1,13 +1,23 @@
+from django.conf import settings
 from django.urls import path
+from .admission import admission_controlled
+from .uploads import limit_upload_size
 from .views import (
-    RegisterView, CustomObtainAuthToken, FaceVerificationView,
+    RegisterView, CustomObtainAuthToken, FaceVerificationView, IdentifyFaceView,
+    BatchFaceVerificationView,
     PhoneVerificationView, PasswordResetRequestView, PasswordResetConfirmView
 )
 
 urlpatterns = [
-    path('register/', RegisterView.as_view(), name='auth-register'),
+    path('register/', limit_upload_size(admission_controlled(RegisterView.as_view())), name='auth-register'),
     path('login/', CustomObtainAuthToken.as_view(), name='auth-login'),
-    path('verify-face/', FaceVerificationView.as_view(), name='auth-verify-face'),
+    path('verify-face/', limit_upload_size(admission_controlled(FaceVerificationView.as_view())), name='auth-verify-face'),
+    path(
+        'verify-face/batch/',
+        limit_upload_size(admission_controlled(BatchFaceVerificationView.as_view()), settings.FACE_BATCH_MAX_ITEMS),
+        name='auth-verify-face-batch',
+    ),
+    path('identify-face/', limit_upload_size(admission_controlled(IdentifyFaceView.as_view())), name='auth-identify-face'),
     path('verify-phone/', PhoneVerificationView.as_view(), name='auth-verify-phone'),
     path('password-reset/request/', PasswordResetRequestView.as_view(), name='password-reset-request'),
     path('password-reset/confirm/', PasswordResetConfirmView.as_view(), name='password-reset-confirm'),
@@ -1,56 +1,38 @@
 from rest_framework.generics import CreateAPIView
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework import serializers
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException, PermissionDenied
 
 from .models import Profile
-import face_recognition
-import json
-import numpy as np
-import cv2
 
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from .serializers import RegisterSerializer, FaceVerificationSerializer
-from django.utils import timezone
-from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from .services import send_whatsapp_code
+from face_wallet.metrics import span
+from . import embedding_cache, face_index, face_pool, gallery, otp, step_up
+from .face_pool import FacePoolError
+from .face_processing import FaceProcessingError, NoFaceDetected
+from .image_quality import ImageRejected
+from .throttling import EmailRateThrottle, IPRateThrottle, PhoneRateThrottle
+from .uploads import read_upload
 from .serializers import (
-    RegisterSerializer, PhoneVerificationSerializer, 
+    RegisterSerializer, PhoneVerificationSerializer, FaceIdentificationSerializer,
+    BatchFaceVerificationSerializer,
     PasswordResetRequestSerializer, PasswordResetConfirmSerializer
 )
 
-class RegisterView(CreateAPIView):
-    serializer_class = RegisterSerializer
-    permission_classes = (AllowAny, )
-
-    def perform_create(self, serializer):
-        user = serializer.save()
-        face_image = self.request.data.get('face_image')
-
-        if face_image:
-            try:
-                image_bytes = face_image.read()
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-                face_encodings = face_recognition.face_encodings(rgb_img)
-                
-                if not face_encodings:
-                    raise ValueError("Nenhum rosto detectado na imagem.")
-
-                embedding = face_encodings[0]
-                
-                Profile.objects.create(
-                    user=user,
-                    face_embedding=json.dumps(embedding.tolist())
-                )
-            except Exception as e:
-                user.delete()
-                raise serializers.ValidationError({"face_image": f"Erro no processamento facial: {e}"})
+class FaceServiceUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Serviço de biometria sobrecarregado. Tente novamente em instantes."
+    default_code = 'face_service_unavailable'
+    wait = 5
 
 class CustomObtainAuthToken(ObtainAuthToken):
     def post(self, request, *args, **kwargs):
@@ -70,93 +52,205 @@ class FaceVerificationView(APIView):
     serializer_class = FaceVerificationSerializer
 
     def post(self, request, *args, **kwargs):
-        serializer = self.serializer_class(data=request.data)
-        serializer.is_valid(raise_exception=True)
+        with span('request.parse'):
+            serializer = self.serializer_class(data=request.data)
+            serializer.is_valid(raise_exception=True)
 
         user = request.user
         uploaded_image = request.data.get('face_image')
 
         try:
-            profile = Profile.objects.get(user=user)
-            stored_embedding_str = profile.face_embedding
-            if not stored_embedding_str:
+            with span('profile.lookup'):
+                stored_gallery = embedding_cache.get_gallery(user.pk)
+            if stored_gallery is None:
                 return Response({"detail": "Nenhum rosto cadastrado para este usuário."}, status=400)
-            
-            stored_embedding = np.array(json.loads(stored_embedding_str))
-            
-            image_bytes = uploaded_image.read()
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-            face_encodings = face_recognition.face_encodings(rgb_img)
-            if not face_encodings:
-                return Response({"detail": "Nenhum rosto detectado na imagem enviada."}, status=400)
-
-            new_embedding = face_encodings[0]
-
-            results = face_recognition.compare_faces([stored_embedding], new_embedding, tolerance=0.50)
-            
-            if results[0]:
-                return Response({"detail": "Rosto verificado com sucesso."}, status=200)
+
+            with span('request.read_upload'):
+                image_bytes = read_upload(uploaded_image)
+            new_embedding = face_pool.encode_face(image_bytes, serializer.validated_data.get('face_box'))
+
+            with span('face.compare'):
+                distances = gallery.distances_to(stored_gallery, new_embedding)
+            distance = float(distances.min())
+
+            if distance <= settings.FACE_MATCH_TOLERANCE:
+                with span('face.gallery_update'):
+                    gallery.learn_from_match(user.pk, stored_gallery, new_embedding, distances)
+                response = {"detail": "Rosto verificado com sucesso.", "distance": round(distance, 4)}
+                if isinstance(request.auth, Token):
+                    response["face_grant"] = step_up.issue(request.auth.key, user.pk)
+                    response["face_grant_expires_in"] = settings.FACE_STEP_UP_TTL
+                return Response(response, status=200)
             else:
-                return Response({"detail": "Verificação facial falhou. Os rostos não correspondem."}, status=400)
+                return Response({"detail": "Verificação facial falhou. Os rostos não correspondem.", "distance": round(distance, 4)}, status=400)
 
         except Profile.DoesNotExist:
             return Response({"detail": "Perfil não encontrado."}, status=404)
+        except NoFaceDetected:
+            return Response({"detail": "Nenhum rosto detectado na imagem enviada."}, status=400)
+        except ImageRejected as e:
+            return Response({"detail": e.message, "code": e.reason}, status=400)
+        except FaceProcessingError as e:
+            return Response({"detail": str(e)}, status=400)
+        except FacePoolError:
+            raise FaceServiceUnavailable()
         except Exception as e:
             return Response({"detail": f"Ocorreu um erro durante a verificação: {e}"}, status=500)
         
+class BatchFaceVerificationView(APIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = BatchFaceVerificationSerializer
+
+    def post(self, request, *args, **kwargs):
+        with span('request.parse'):
+            serializer = self.serializer_class(data=request.data)
+            serializer.is_valid(raise_exception=True)
+
+        images = serializer.validated_data['face_images']
+        user_ids = serializer.validated_data.get('user_ids') or [request.user.pk] * len(images)
+        if not request.user.is_staff and any(user_id != request.user.pk for user_id in user_ids):
+            raise PermissionDenied("Apenas dispositivos autorizados podem verificar outros usuários.")
+
+        with span('profile.lookup'):
+            stored = embedding_cache.get_galleries(user_ids)
+
+        # Imagens de usuários sem rosto cadastrado nem chegam ao encoder.
+        pending = [position for position, user_id in enumerate(user_ids) if stored.get(user_id) is not None]
+        try:
+            with span('face.encode_batch'):
+                encoded = dict(zip(pending, face_pool.encode_faces([read_upload(images[position]) for position in pending])))
+        except FacePoolError:
+            raise FaceServiceUnavailable()
+
+        results = []
+        comparable = []
+        for position, user_id in enumerate(user_ids):
+            embedding = encoded.get(position)
+            result = {"index": position, "user_id": user_id, "verified": False}
+            if stored.get(user_id) is None:
+                result["detail"] = "Nenhum rosto cadastrado para este usuário."
+            elif isinstance(embedding, NoFaceDetected):
+                result["detail"] = "Nenhum rosto detectado na imagem enviada."
+            elif isinstance(embedding, ImageRejected):
+                result.update({"detail": embedding.message, "code": embedding.reason})
+            elif isinstance(embedding, Exception):
+                result["detail"] = str(embedding)
+            else:
+                comparable.append(position)
+            results.append(result)
+
+        if comparable:
+            with span('face.compare'):
+                distances = gallery.best_distances(
+                    [stored[user_ids[position]] for position in comparable],
+                    [encoded[position] for position in comparable],
+                )
+
+            for position, distance in zip(comparable, distances):
+                verified = bool(distance <= settings.FACE_MATCH_TOLERANCE)
+                results[position].update({
+                    "verified": verified,
+                    "distance": round(float(distance), 4),
+                    "detail": "Rosto verificado com sucesso." if verified else "Os rostos não correspondem.",
+                })
+
+        return Response({"results": results}, status=200)
+
+class IdentifyFaceView(APIView):
+    permission_classes = [IsAdminUser]
+    serializer_class = FaceIdentificationSerializer
+
+    def post(self, request, *args, **kwargs):
+        with span('request.parse'):
+            serializer = self.serializer_class(data=request.data)
+            serializer.is_valid(raise_exception=True)
+
+        try:
+            embedding = face_pool.encode_face(
+                read_upload(serializer.validated_data['face_image']),
+                serializer.validated_data.get('face_box'),
+            )
+        except NoFaceDetected:
+            return Response({"detail": "Nenhum rosto detectado na imagem enviada."}, status=400)
+        except ImageRejected as e:
+            return Response({"detail": e.message, "code": e.reason}, status=400)
+        except FaceProcessingError as e:
+            return Response({"detail": str(e)}, status=400)
+        except FacePoolError:
+            raise FaceServiceUnavailable()
+
+        with span('face.index_search'):
+            matches = [
+                (user_id, distance)
+                for user_id, distance in face_index.get_index().search(embedding, serializer.validated_data['top_k'])
+                if distance <= settings.FACE_MATCH_TOLERANCE
+            ]
+        with span('profile.lookup'):
+            usernames = dict(User.objects.filter(pk__in=[user_id for user_id, _ in matches]).values_list('pk', 'username'))
+
+        return Response({
+            "matches": [
+                {"user_id": user_id, "username": usernames.get(user_id), "distance": round(distance, 4)}
+                for user_id, distance in matches
+                if user_id in usernames
+            ]
+        }, status=200)
+
 class RegisterView(CreateAPIView):
     serializer_class = RegisterSerializer
     permission_classes = (AllowAny,)
+    throttle_scope = 'register'
+    throttle_classes = [IPRateThrottle, PhoneRateThrottle, EmailRateThrottle]
 
     def perform_create(self, serializer):
         phone_number = serializer.validated_data.pop('phone_number')
         face_image = serializer.validated_data.pop('face_image')
-        user = serializer.save()
-
-        embedding = None
-        if face_image:
-            try:
-                image_bytes = face_image.read()
-                nparr = np.frombuffer(image_bytes, np.uint8)
-                img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-                face_encodings = face_recognition.face_encodings(rgb_img)
-                
-                if not face_encodings:
-                    user.delete()
-                    raise serializers.ValidationError({"face_image": "Nenhum rosto detectado na imagem."})
-                embedding = face_encodings[0]
-            
-            except Exception as e:
-                user.delete()
-                raise serializers.ValidationError({"face_image": f"Erro no processamento facial: {e}"})
-        else:
-             user.delete()
-             raise serializers.ValidationError({"face_image": "A imagem facial é obrigatória."})
-
-        profile = Profile.objects.create(
-            user=user, 
-            phone_number=phone_number, 
-            face_embedding=json.dumps(embedding.tolist())
-        )
-        
-        code, success = send_whatsapp_code(phone_number, user)
-        
-        if success:
-            profile.verification_code = code
-            profile.verification_expiry = timezone.now() + timedelta(minutes=10)
-            profile.save()
-        else:
-            user.delete()
-            raise serializers.ValidationError({"detail": "Não foi possível enviar o código de verificação. Tente novamente."})
+        face_box = serializer.validated_data.pop('face_box', None)
+
+        # Triagem e embedding (no pool de inferência) vêm antes de qualquer
+        # escrita: um cadastro recusado não grava nada nem gasta o hash da
+        # senha.
+        try:
+            embedding = face_pool.encode_face(read_upload(face_image), face_box)
+        except NoFaceDetected:
+            raise serializers.ValidationError({"face_image": "Nenhum rosto detectado na imagem."})
+        except ImageRejected as e:
+            raise serializers.ValidationError({"face_image": e.message, "code": e.reason})
+        except FacePoolError:
+            raise FaceServiceUnavailable()
+        except FaceProcessingError as e:
+            raise serializers.ValidationError({"face_image": f"Erro no processamento facial: {e}"})
+
+        # O hash da senha (PBKDF2, centenas de ms) é calculado antes da
+        # transação: com o SQLite em transaction_mode IMMEDIATE, ela segura o
+        # lock de escrita do banco inteiro enquanto estiver aberta.
+        with span('user.password_hash'):
+            password_hash = make_password(serializer.validated_data['password'])
+
+        # Usuário, perfil, código e mensagem do WhatsApp num único commit: o
+        # worker do outbox só enxerga a mensagem se o cadastro inteiro foi
+        # gravado.
+        try:
+            with transaction.atomic():
+                with span('user.create'):
+                    user = serializer.save(password_hash=password_hash)
+                with span('profile.save'):
+                    profile = Profile(user=user, phone_number=phone_number)
+                    profile.set_face_embedding(embedding)
+                    profile.save()
+
+                code = send_whatsapp_code(phone_number, user)
+                otp.issue(otp.PHONE_VERIFICATION, user, code, replace=False)
+        except IntegrityError:
+            # Outro cadastro com o mesmo username passou pela validação ao
+            # mesmo tempo.
+            raise serializers.ValidationError({"username": "Um usuário com este nome já existe."})
 
 class PhoneVerificationView(APIView):
     permission_classes = [AllowAny]
     serializer_class = PhoneVerificationSerializer
+    throttle_scope = 'verify_phone'
+    throttle_classes = [IPRateThrottle]
 
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
@@ -164,55 +258,50 @@ class PhoneVerificationView(APIView):
         username = serializer.validated_data['username']
         code = serializer.validated_data['code']
 
-        try:
-            user = User.objects.get(username=username)
-            profile = user.profile
-        except (User.DoesNotExist, Profile.DoesNotExist):
-            return Response({"detail": "Usuário não encontrado."}, status=404)
-
-        if profile.is_verification_code_expired() or profile.verification_code != code:
+        user_id = otp.verify(otp.PHONE_VERIFICATION, username, code)
+        if user_id is None:
             return Response({"detail": "Código inválido ou expirado."}, status=400)
 
-        profile.is_phone_verified = True
-        profile.verification_code = None
-        profile.verification_expiry = None
-        profile.save()
+        Profile.objects.filter(user_id=user_id).update(is_phone_verified=True)
 
         return Response({"detail": "Telefone verificado com sucesso!"}, status=200)
 
 class PasswordResetRequestView(APIView):
     permission_classes = [AllowAny]
     serializer_class = PasswordResetRequestSerializer
+    throttle_scope = 'password_reset'
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
 
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         email = serializer.validated_data['email']
 
-        try:
-            user = User.objects.get(email=email)
-            profile = user.profile
-            
-            if not profile.is_phone_verified:
-                 return Response({"detail": "O telefone deste usuário não está verificado."}, status=400)
-
-        except (User.DoesNotExist, Profile.DoesNotExist):
+        user_id = otp.identify(otp.PASSWORD_RESET, email)
+        profile = (
+            Profile.objects.filter(user_id=user_id)
+            .select_related('user')
+            .only('phone_number', 'is_phone_verified', 'user__first_name')
+            .first()
+        )
+        if profile is None:
             return Response({"detail": "Se uma conta com este e-mail existir, um código será enviado."}, status=200)
+        if not profile.is_phone_verified:
+            return Response({"detail": "O telefone deste usuário não está verificado."}, status=400)
 
-        phone_number = profile.phone_number
-        code, success = send_whatsapp_code(phone_number, user)
+        user = profile.user
+        with transaction.atomic():
+            code = send_whatsapp_code(profile.phone_number, user)
+            otp.issue(otp.PASSWORD_RESET, user, code)
 
-        if success:
-            profile.verification_code = code
-            profile.verification_expiry = timezone.now() + timedelta(minutes=10)
-            profile.save()
-        
         return Response({"detail": "Se uma conta com este e-mail existir, um código será enviado."}, status=200)
 
 
 class PasswordResetConfirmView(APIView):
     permission_classes = [AllowAny]
     serializer_class = PasswordResetConfirmSerializer
+    throttle_scope = 'password_reset_confirm'
+    throttle_classes = [IPRateThrottle, EmailRateThrottle]
 
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
@@ -221,20 +310,12 @@ class PasswordResetConfirmView(APIView):
         code = serializer.validated_data['code']
         password = serializer.validated_data['password']
 
-        try:
-            user = User.objects.get(email=email)
-            profile = user.profile
-        except (User.DoesNotExist, Profile.DoesNotExist):
-            return Response({"detail": "Código inválido ou link expirado."}, status=400)
-        
-        if profile.is_verification_code_expired() or profile.verification_code != code:
+        user_id = otp.verify(otp.PASSWORD_RESET, email, code)
+        if user_id is None:
             return Response({"detail": "Código inválido ou expirado."}, status=400)
 
+        user = User.objects.get(pk=user_id)
         user.set_password(password)
         user.save()
-        
-        profile.verification_code = None
-        profile.verification_expiry = None
-        profile.save()
 
         return Response({"detail": "Senha redefinida com sucesso."}, status=200)
\ No newline at end of file